@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import time
 from pidog import Pidog
+from pidog.distance_ring import FLAG_FILTERED_VALID
 from preset_actions import bark
 
 t = time.time()
@@ -10,11 +11,27 @@ my_dog.wait_all_done()
 time.sleep(.5)
 
 DANGER_DISTANCE = 15
+MAX_SAMPLE_AGE = 0.2  # second, older ultrasonic data is not trusted
 
 stand = my_dog.legs_angle_calculation([[0, 80], [0, 80], [30, 75], [30, 75]])
 
+def read_distance():
+    '''
+    filtered distance, -1 if not valid, None if too old
+    '''
+    sample = my_dog.read_distance_sample()
+    if sample is None or time.perf_counter() - sample.timestamp > MAX_SAMPLE_AGE:
+        return None
+    if not sample.flags & FLAG_FILTERED_VALID:
+        return -1
+    return round(sample.filtered, 2)
+
 def patrol():
-    distance = round(my_dog.read_distance(), 2)
+    distance = read_distance()
+    if distance is None:
+        print("distance: no recent data")
+        time.sleep(0.1)
+        return
     print(f"distance: {distance} cm", end="", flush=True)
 
     # danger
@@ -30,9 +47,11 @@ def patrol():
         time.sleep(0.5)
         bark(my_dog, [head_yaw, 0, 0])
 
-        while distance < DANGER_DISTANCE:
-            distance = round(my_dog.read_distance(), 2)
-            if distance < DANGER_DISTANCE:
+        while distance is None or distance < DANGER_DISTANCE:
+            distance = read_distance()
+            if distance is None:
+                print("distance: no recent data")
+            elif distance < DANGER_DISTANCE:
                 print(f"distance: {distance} cm \033[0;31m DANGER !\033[m")
             else:
                 print(f"distance: {distance} cm", end="", flush=True)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from pidog import Pidog
 from time import sleep
+import threading
 from math import sin
 from preset_actions import bark_action
 
@@ -28,11 +29,19 @@ def head_nod(step):
     my_dog.head_move(angs*step, immediately=False, speed=80)
 
 def alert():
+    # touch gestures are delivered as events, none is missed between two loops,
+    # without the event mode the pads are polled
+    touched = threading.Event()
+    if my_dog.dual_touch.event_mode:
+        my_dog.dual_touch.subscribe(lambda event: touched.set())
+
     my_dog.do_action('stand', step_count=1, speed=70)
     my_dog.rgb_strip.set_mode('breath', color='pink', bps=1, brightness=0.8)
     while True:
+        if not my_dog.dual_touch.event_mode and my_dog.dual_touch.read() != 'N':
+            touched.set()
         print(
-            f'distance.value: {round(my_dog.read_distance(), 2)} cm, touch {my_dog.dual_touch.read()}')
+            f'distance.value: {round(my_dog.read_distance(), 2)} cm, touch {touched.is_set()}')
         # alert
         if my_dog.read_distance() < 15 and my_dog.read_distance() > 1:
             my_dog.head_move([[0, 0, 0]], immediately=True, speed=90)
@@ -46,7 +55,8 @@ def alert():
             my_dog.do_action('stand', step_count=1, speed=90)
             sleep(0.5)
         # relax
-        if my_dog.dual_touch.read() != 'N':
+        if touched.is_set():
+            touched.clear()
             if len(my_dog.head_action_buffer) < 2:
                 head_nod(1)
                 my_dog.do_action('wag_tail', step_count=10, speed=80)
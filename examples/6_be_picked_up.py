@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 from pidog import Pidog
-from time import sleep
+from pidog.imu_buffer import AX
+from time import sleep, perf_counter
 
 my_dog = Pidog()
 sleep(0.1)
@@ -28,8 +29,13 @@ def be_picked_up():
     stand()
 
     while True:
-        ax = my_dog.accData[0]
-        print('ax: %s, is up: %s' % (ax, isUp))
+        # mean of the samples since the last check, a single spike does not trigger
+        window = my_dog.imu_buffer.since(perf_counter() - 0.05)
+        if len(window) == 0:
+            sleep(0.02)
+            continue
+        ax = window[:, AX].mean()
+        print('ax: %.0f, is up: %s' % (ax, isUp))
 
         # gravity : 1G = -16384
         if ax < -18000: # if down, acceleration is in the same direction as gravity, ax < -1G
@@ -24,16 +24,16 @@ def face_track():
     my_dog.wait_all_done()
     sleep(0.5)
     # Cleanup sound detection by servos moving
-    if my_dog.ears.isdetected():    
-        direction = my_dog.ears.read()
+    my_dog.ears.clear_events()
 
     while True:
         if flag == False:
             my_dog.rgb_strip.set_mode('breath', 'pink', bps=1)
-        # If heard somthing, turn to face it
-        if my_dog.ears.isdetected():
+        # If heard somthing, turn to face it, events are queued by the ears, none is missed
+        events = my_dog.ears.get_events()
+        if events:
             flag = False
-            direction = my_dog.ears.read()
+            direction = events[-1].direction
             pitch = 0
             if direction > 0 and direction < 160:
                 yaw = -direction
@@ -56,8 +56,8 @@ def face_track():
             flag = True
             my_dog.do_action('wag_tail', step_count=2, speed=100)
             bark(my_dog, [yaw, 0, 0], pitch_comp=-40, volume=80)
-            if my_dog.ears.isdetected():
-                direction = my_dog.ears.read()
+            # ignore our own bark
+            my_dog.ears.clear_events()
 
         if ex > 15 and yaw > -80:
             yaw -= 0.5 * int(ex/30.0+0.5)
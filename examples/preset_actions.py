@@ -2,6 +2,24 @@
 from time import sleep
 import random
 from math import sin, cos, pi
+from pidog.action_clip import ActionClip, concat, merge
+from pidog.choreography import Choreography
+
+
+def _frame_time(speed):
+    # ms a keyframe takes at a speed, below the dps limit, as Robot.servo_move
+    return 1000 - 9.9 * speed
+
+
+def _at_speed(clip, speed, clip_speed, start=None):
+    # resample a phase written for speed, to be played in a clip at clip_speed
+    # start: clip or pose the phase follows, the move into the phase is resampled too
+    if start is not None:
+        clip = concat(ActionClip.from_array(start.data[-1:], start.mask), clip)
+    clip = clip.time_scale(_frame_time(speed) / _frame_time(clip_speed))
+    if start is not None:
+        clip = ActionClip.from_array(clip.data[1:], clip.mask)
+    return clip
 
 
 def scratch(my_dog):
@@ -14,16 +32,15 @@ def scratch(my_dog):
         [30, 60, 40, 40, 80, -45, -80, 38],  # Note 1
         [30, 60, 50, 50, 80, -45, -80, 38],  # Note 1
     ]
-    my_dog.do_action('sit', speed=80)
-    my_dog.head_move(h2, immediately=False, speed=80)
-    my_dog.legs_move(f_up, immediately=False, speed=80)
-    my_dog.wait_all_done()
-    for _ in range(10):
-        my_dog.legs_move(f_scratch, immediately=False, speed=94)
-        my_dog.wait_all_done()
-
-    my_dog.head_move(h1, immediately=False, speed=80)
-    my_dog.do_action('sit', speed=80)
+    sit = ActionClip.from_action(my_dog, 'sit')
+    start = ActionClip(legs=[my_dog.leg_current_angles], head=[my_dog.head_current_angles])
+    clip = _at_speed(merge(concat(sit, ActionClip(legs=f_up)),
+                           ActionClip(head=[my_dog.head_rpy_to_angle(h) for h in h2])),
+                     80, 94, start)
+    clip = concat(clip, ActionClip(legs=f_scratch).repeat(10))
+    clip = concat(clip, _at_speed(merge(sit, ActionClip(head=[my_dog.head_rpy_to_angle(h) for h in h1])),
+                                  80, 94, clip))
+    my_dog.play_clip(clip, immediately=False, speed=94)
     my_dog.wait_all_done()
 # Note 1: Last servo(4th legs) original value is 45, change to 40 to push down alittle bit to support the rasing legs, prevent the dog from falling down.
 
@@ -39,17 +56,6 @@ def hand_shake(my_dog):
     f_withdraw = [
         [30, 60, -40, 30, 80, -45, -80, 38],  # Note 1
     ]
-
-    my_dog.legs_move(f_up, immediately=False, speed=80)
-    my_dog.wait_all_done()
-    sleep(0.1)
-
-    for _ in range(8):
-        my_dog.legs_move(f_handshake, immediately=False, speed=90)
-        my_dog.wait_all_done()
-
-    my_dog.legs_move(f_withdraw, immediately=False, speed=80)
-
     hand_down_angs = [
         [30, 60, -30, -40, 80, -45, -80, 45],
         [30, 60, -30, -50, 80, -45, -80, 45],
@@ -57,8 +63,15 @@ def hand_shake(my_dog):
         [30, 60, -30, -60, 80, -45, -80, 45],
     ]
 
-    my_dog.legs_move(hand_down_angs, immediately=False, speed=80)
-    my_dog.head_move([[0, 0, -35]], speed=80)
+    start = ActionClip(legs=[my_dog.leg_current_angles], head=[my_dog.head_current_angles])
+    clip = _at_speed(ActionClip(legs=f_up), 80, 90, start)
+    # held frames take 10 ms each, a 0.1 s pause
+    clip = concat(clip, ActionClip(legs=f_up * 10))
+    clip = concat(clip, ActionClip(legs=f_handshake).repeat(8))
+    clip = concat(clip, _at_speed(merge(ActionClip(legs=f_withdraw + hand_down_angs),
+                                        ActionClip(head=[my_dog.head_rpy_to_angle([0, 0, -35])])),
+                                  80, 90, clip))
+    my_dog.play_clip(clip, immediately=False, speed=90)
     my_dog.wait_all_done()
 
 
@@ -192,34 +205,47 @@ def bark(my_dog, yrp=None, pitch_comp=0, roll_comp=0, volume=100):
     sleep(0.5)
 
 
-def push_up(my_dog, speed=80):
-    my_dog.head_move([[0, 0, -80], [0, 0, -40]], speed=speed-10)
-    my_dog.do_action('push_up', speed=speed)
-    my_dog.wait_all_done()
+def push_up(my_dog, speed=80, token=None):
+    def routine(c):
+        c.wait_head_done()
+        my_dog.head_move([[0, 0, -80], [0, 0, -40]], immediately=False, speed=speed-10)
+        my_dog.do_action('push_up', speed=speed)
+        c.wait_all_done()
 
+    return Choreography(my_dog, token).run(routine)
 
-def howling(my_dog, volume=100):
-    my_dog.do_action('sit', speed=80)
-    my_dog.head_move([[0, 0, -30]], speed=95)
-    my_dog.wait_all_done()
 
-    my_dog.rgb_strip.set_mode('speak', color='cyan', bps=0.6)
-    my_dog.do_action('half_sit', speed=80)
-    my_dog.head_move([[0, 0, -60]], speed=80)
-    my_dog.wait_all_done()
-    my_dog.speak('howling', volume)
-    my_dog.do_action('sit', speed=60)
-    my_dog.head_move([[0, 0, 10]], speed=70)
-    my_dog.wait_all_done()
+def howling(my_dog, volume=100, token=None):
+    def routine(c):
+        c.wait_head_done()
+        my_dog.do_action('sit', speed=80)
+        my_dog.head_move([[0, 0, -30]], immediately=False, speed=95)
+        c.wait_all_done()
 
-    my_dog.do_action('sit', speed=60)
-    my_dog.head_move([[0, 0, 10]], speed=80)
-    my_dog.wait_all_done()
+        rgb_mode = my_dog.rgb_strip.mode_key
+        if rgb_mode is not None:
+            c.on_cancel(lambda: my_dog.rgb_strip.set_mode(*rgb_mode[:4]))
+        my_dog.rgb_strip.set_mode('speak', color='cyan', bps=0.6)
+        my_dog.do_action('half_sit', speed=80)
+        my_dog.head_move([[0, 0, -60]], immediately=False, speed=80)
+        c.wait_all_done()
+        voice = my_dog.speak('howling', volume)
+        if voice:
+            c.on_cancel(voice.cancel)
+        my_dog.do_action('sit', speed=60)
+        my_dog.head_move([[0, 0, 10]], immediately=False, speed=70)
+        c.wait_all_done()
 
-    sleep(2.34)
-    my_dog.do_action('sit', speed=80)
-    my_dog.head_move([[0, 0, -40]], speed=80)
-    my_dog.wait_all_done()
+        my_dog.do_action('sit', speed=60)
+        my_dog.head_move([[0, 0, 10]], immediately=False, speed=80)
+        c.wait_all_done()
+
+        c.sleep(2.34)
+        my_dog.do_action('sit', speed=80)
+        my_dog.head_move([[0, 0, -40]], immediately=False, speed=80)
+        c.wait_all_done()
+
+    return Choreography(my_dog, token).run(routine)
 
 
 def attack_posture(my_dog):
@@ -231,44 +257,49 @@ def attack_posture(my_dog):
     sleep(0.01)
 
 
-def lick_hand(my_dog):
-    leg1 =  [
-        [30, 45, 70, -32, 80, -55, -80, 45]
-    ]
-    head1 = [
-        [-22, -23, -45],
-        [-22, -23, -35],
-    ]
-    leg2 =  [
-        [30, 45, 70, -32, 80, -55, -80, 45],
-        [30, 45, 66, -36, 80, -55, -80, 45]
-    ]
+def lick_hand(my_dog, token=None):
+    def routine(c):
+        leg1 =  [
+            [30, 45, 70, -32, 80, -55, -80, 45]
+        ]
+        head1 = [
+            [-22, -23, -45],
+            [-22, -23, -35],
+        ]
+        leg2 =  [
+            [30, 45, 70, -32, 80, -55, -80, 45],
+            [30, 45, 66, -36, 80, -55, -80, 45]
+        ]
     
-    my_dog.do_action('sit', speed=80)
-    my_dog.head_move([[0, 0, -40]], immediately=True, speed=70)
-    my_dog.wait_head_done()
-    my_dog.wait_legs_done()
-
-    my_dog.legs_move(leg1, immediately=False, speed=80)
-    my_dog.head_move(head1, immediately=False, speed=70)
-    my_dog.wait_head_done()
-    my_dog.wait_legs_done()
-    for _ in range(3):
-        my_dog.legs_move(leg2, immediately=False, speed=90)
-        my_dog.head_move(head1, immediately=False, speed=80)
-        my_dog.wait_head_done()
-        my_dog.wait_legs_done()
+        c.wait_head_done()
+        my_dog.do_action('sit', speed=80)
+        my_dog.head_move([[0, 0, -40]], immediately=False, speed=70)
+        c.wait_head_done()
+        c.wait_legs_done()
+
+        my_dog.legs_move(leg1, immediately=False, speed=80)
+        my_dog.head_move(head1, immediately=False, speed=70)
+        c.wait_head_done()
+        c.wait_legs_done()
+        for _ in range(3):
+            my_dog.legs_move(leg2, immediately=False, speed=90)
+            my_dog.head_move(head1, immediately=False, speed=80)
+            c.wait_head_done()
+            c.wait_legs_done()
+
+        hand_down_angs = [
+            [30, 60, -30, -40, 80, -45, -80, 45],
+            [30, 60, -30, -50, 80, -45, -80, 45],
+            [30, 60, -30, -58, 80, -45, -80, 45],
+            [30, 60, -30, -60, 80, -45, -80, 45],
+        ]
 
-    hand_down_angs = [
-        [30, 60, -30, -40, 80, -45, -80, 45],
-        [30, 60, -30, -50, 80, -45, -80, 45],
-        [30, 60, -30, -58, 80, -45, -80, 45],
-        [30, 60, -30, -60, 80, -45, -80, 45],
-    ]
+        my_dog.legs_move(hand_down_angs, immediately=False, speed=80)
+        c.wait_head_done()
+        my_dog.head_move([[0, 0, -35]], immediately=False, speed=80)
+        c.wait_all_done()
 
-    my_dog.legs_move(hand_down_angs, immediately=False, speed=80)
-    my_dog.head_move([[0, 0, -35]], speed=80)
-    my_dog.wait_all_done()
+    return Choreography(my_dog, token).run(routine)
 
 def waiting(my_dog, pitch_comp):
     global last_wait
@@ -314,12 +345,11 @@ def feet_shake(my_dog, step=None):
     if step == None:
         step = random.randint(1, 2)
 
-    for _ in range(step):
-        my_dog.legs_move(legs_action, immediately=False, speed=45)
-        my_dog.wait_legs_done()
-
-    my_dog.do_action('sit', speed=60)
-    my_dog.head_move([[0, 0, -40]], speed=80)
+    start = ActionClip(legs=[current_legs], head=[my_dog.head_current_angles])
+    clip = _at_speed(ActionClip(legs=legs_action).repeat(step), 45, 80, start)
+    clip = concat(clip, merge(_at_speed(ActionClip.from_action(my_dog, 'sit'), 60, 80, clip),
+                              ActionClip(head=[my_dog.head_rpy_to_angle([0, 0, -40])])))
+    my_dog.play_clip(clip, immediately=False, speed=80)
     my_dog.wait_all_done()
 
     
@@ -396,7 +426,7 @@ def nod(my_dog, pitch_comp=-35, amplitude=20, step=2, speed=90):
         p = round(amplitude*cos(pi/10*i) - amplitude + pitch_comp, 2)
         angs.append([y, r, p])
 
-    my_dog.head_move_raw(angs, speed=speed)
+    my_dog.play_clip(ActionClip(head=angs), speed=speed)
     my_dog.wait_all_done()
 
 def think(my_dog, pitch_comp=0):
@@ -7,6 +7,7 @@ import readline # optimize keyboard input, only need to import
 
 import speech_recognition as sr
 from pidog import Pidog
+from pidog.rgb_layers import EnvelopeLayer
 
 import time
 import threading
@@ -106,7 +107,11 @@ def speak_hanlder():
             _isloaded = speech_loaded
         if _isloaded:
             gray_print('speak start')
-            my_dog.speak_block(tts_file)
+            voice = my_dog.speak(tts_file)
+            if voice:
+                # the rgb strip follows the loudness of the answer, until it ends
+                my_dog.rgb_strip.layers.add(EnvelopeLayer(voice, 'pink'), z=1)
+                voice.wait()
             gray_print('speak done')
             with speech_lock:
                 speech_loaded = False
@@ -285,7 +290,6 @@ def main():
                 if _status:
                     with speech_lock:
                         speech_loaded = True
-                    my_dog.rgb_strip.set_mode('speak', 'pink', 1)
             else:
                 my_dog.rgb_strip.set_mode('breath', 'blue', 1)
 
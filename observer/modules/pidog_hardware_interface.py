@@ -9,6 +9,7 @@ import time
 _try_import = True
 try:
     from pidog import Pidog       # True PiDog hardware
+    from pidog.distance_ring import FLAG_FILTERED_VALID
     from vilib import Vilib        # True Vilib camera
 except Exception as e:
     _try_import = False
@@ -139,11 +140,22 @@ else:
             except Exception:
                 pass
 
+        # Au-delà, la mesure ultrason est considérée comme périmée
+        MAX_DISTANCE_AGE = 0.2  # secondes
+
         def get_distance(self):
+            """
+            Distance filtrée (médiane + EWMA) en cm, -1 si la mesure est invalide ou périmée.
+            """
             if not self.my_dog:
                 return -1
             try:
-                return self.my_dog.read_distance()
+                sample = self.my_dog.read_distance_sample()
+                if sample is None or time.perf_counter() - sample.timestamp > self.MAX_DISTANCE_AGE:
+                    return -1
+                if not sample.flags & FLAG_FILTERED_VALID:
+                    return -1
+                return round(sample.filtered, 2)
             except Exception:
                 return -1
 
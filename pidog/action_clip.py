@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+''' ActionClip: compiled multi-channel action table
+
+    A clip is a (frames x 12) float32 array of servo angles, one row per
+    keyframe, in the same order the action threads consume them:
+
+        channels 0..7  : legs  (Pidog.DEFAULT_LEGS_PINS order)
+        channels 8..10 : head  (yaw, roll, pitch, raw angles as head_move_raw)
+        channel  11    : tail
+
+    Parts that a clip does not drive are masked out, so a legs-only clip
+    leaves the head and tail buffers alone when it is played.
+'''
+
+import numpy as np
+
+LEGS = slice(0, 8)
+HEAD = slice(8, 11)
+TAIL = slice(11, 12)
+PARTS = {'legs': LEGS, 'head': HEAD, 'tail': TAIL}
+CHANNELS = 12
+
+# mirror left <-> right:
+#   legs, swap left/right leg pairs, the two sides are opposite in sign
+#   head, negate yaw and roll
+#   tail, negate
+MIRROR_INDEX = np.array([2, 3, 0, 1, 6, 7, 4, 5, 8, 9, 10, 11])
+MIRROR_SIGN = np.array([-1, -1, -1, -1, -1, -1, -1, -1, -1, -1, 1, -1], dtype=np.float32)
+
+
+class ActionClip():
+
+    def __init__(self, legs=None, head=None, tail=None):
+        """
+        Compile keyframe lists into a clip
+
+        :param legs: legs keyframes, n*8 list or array
+        :param head: head keyframes, n*3 list or array (raw angles, without pitch offset)
+        :param tail: tail keyframes, n*1 list or array
+        """
+        parts = {}
+        for name, frames in (('legs', legs), ('head', head), ('tail', tail)):
+            if frames is not None and len(frames) > 0:
+                parts[name] = np.asarray(frames, dtype=np.float32).reshape(len(frames), -1)
+        length = max([len(frames) for frames in parts.values()], default=0)
+
+        self.data = np.zeros((length, CHANNELS), dtype=np.float32)
+        self.mask = np.zeros(CHANNELS, dtype=bool)
+        for name, frames in parts.items():
+            part = PARTS[name]
+            if frames.shape[1] != part.stop - part.start:
+                raise ValueError(f"Invalid {name} frame width: {frames.shape[1]}")
+            # hold the last frame of a shorter part until the clip ends
+            self.data[:, part] = _pad(frames, length)
+            self.mask[part] = True
+
+    @classmethod
+    def from_array(cls, data, mask):
+        clip = cls()
+        clip.data = np.ascontiguousarray(data, dtype=np.float32)
+        clip.mask = np.array(mask, dtype=bool)
+        return clip
+
+    @classmethod
+    def from_action(cls, dog, name, step_count=1, pitch_comp=0):
+        """
+        Compile a preset action of ActionDict into a clip, the same frames
+        do_action() would enqueue. Head actions are yaw, roll, pitch and
+        are converted to raw angles with head_rpy_to_angle().
+
+        :param dog: Pidog instance, for its actions_dict and head_rpy_to_angle()
+        :param name: action name, eg: 'sit', 'wag_tail'
+        :param step_count: repeat times
+        :param pitch_comp: pitch compensation of head actions, as do_action()
+        """
+        actions, part = dog.actions_dict[name]
+        if part == 'head':
+            actions = [dog.head_rpy_to_angle(yrp, pitch_comp=pitch_comp) for yrp in actions]
+        return cls(**{part: actions}).repeat(step_count)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __add__(self, other):
+        return concat(self, other)
+
+    def __mul__(self, n):
+        return self.repeat(n)
+
+    def has(self, part):
+        return bool(self.mask[PARTS[part]].all())
+
+    def part(self, part):
+        """
+        Frames of one part, a view of the clip data
+
+        :param part: 'legs', 'head' or 'tail'
+        :return: n*k array, or None if the clip does not drive this part
+        """
+        if not self.has(part):
+            return None
+        return self.data[:, PARTS[part]]
+
+    def frames(self, part, trim=False):
+        """
+        Frames of one part as keyframe lists, ready for the action buffers
+
+        :param trim: drop the frames held at the end of the part,
+                     where a shorter part was padded to the clip length
+        """
+        data = self.part(part)
+        if data is None:
+            return []
+        if trim:
+            moving = np.flatnonzero(np.any(data != data[-1], axis=1))
+            data = data[:moving[-1] + 2] if len(moving) > 0 else data[:1]
+        return data.tolist()
+
+    # combinators
+    # =================================================================
+    def repeat(self, n):
+        return ActionClip.from_array(np.tile(self.data, (max(0, int(n)), 1)), self.mask)
+
+    def mirror(self):
+        """
+        Swap left and right, eg: a left hand shake becomes a right hand shake
+        """
+        mask = self.mask[MIRROR_INDEX]
+        data = self.data[:, MIRROR_INDEX] * MIRROR_SIGN
+        return ActionClip.from_array(data, mask)
+
+    def time_scale(self, factor):
+        """
+        Stretch (factor > 1) or compress (factor < 1) a clip in time,
+        frames are resampled by linear interpolation
+
+        :param factor: time scale factor
+        :type factor: float
+        """
+        n = len(self.data)
+        length = max(1, int(round(n * factor)))
+        if n < 2:
+            return ActionClip.from_array(_pad(self.data, length), self.mask)
+        pos = np.linspace(0, n - 1, length, dtype=np.float32)
+        lo = np.floor(pos).astype(np.intp)
+        hi = np.minimum(lo + 1, n - 1)
+        w = (pos - lo)[:, np.newaxis]
+        data = self.data[lo] * (1 - w) + self.data[hi] * w
+        return ActionClip.from_array(data, self.mask)
+
+    def amplitude_scale(self, factor, center=None):
+        """
+        Scale the motion amplitude around a center pose
+
+        :param factor: amplitude scale factor
+        :type factor: float
+        :param center: center pose, 12 channels array, default is the mean pose of the clip
+        """
+        if center is None:
+            center = self.data.mean(axis=0)
+        center = np.asarray(center, dtype=np.float32)
+        data = (self.data - center) * np.float32(factor) + center
+        return ActionClip.from_array(data, self.mask)
+
+    def offset(self, legs=None, head=None, tail=None):
+        """
+        Add a constant offset to parts, eg: a pitch compensation of the head
+        """
+        data = self.data.copy()
+        for part, value in (('legs', legs), ('head', head), ('tail', tail)):
+            if value is not None:
+                data[:, PARTS[part]] += np.asarray(value, dtype=np.float32)
+        return ActionClip.from_array(data, self.mask)
+
+
+def _pad(frames, length):
+    if len(frames) >= length:
+        return frames[:length]
+    if len(frames) == 0:
+        return np.zeros((length, frames.shape[1]), dtype=np.float32)
+    return np.concatenate((frames, np.repeat(frames[-1:], length - len(frames), axis=0)))
+
+
+def concat(*clips):
+    """
+    Play clips one after another. A part driven by only some of the clips
+    holds its last pose (or waits at its first pose) where it is not driven.
+    """
+    clips = [clip for clip in clips if len(clip) > 0]
+    if len(clips) == 0:
+        return ActionClip()
+    data = np.concatenate([clip.data for clip in clips])
+    mask = np.any([clip.mask for clip in clips], axis=0)
+    # per-channel index of the last frame which actually drives it
+    driven = np.concatenate([np.repeat(clip.mask[np.newaxis], len(clip), axis=0) for clip in clips])
+    rows = np.arange(len(data))[:, np.newaxis]
+    last = np.maximum.accumulate(np.where(driven, rows, -1), axis=0)
+    first = np.argmax(driven, axis=0)
+    index = np.where(last < 0, first, last)
+    data = np.take_along_axis(data, index, axis=0)
+    return ActionClip.from_array(data, mask)
+
+
+def merge(*clips):
+    """
+    Play clips at the same time, eg: legs + head + tail into one clip.
+    The shorter clips hold their last pose. Later clips win on overlapping channels.
+    """
+    length = max([len(clip) for clip in clips], default=0)
+    data = np.zeros((length, CHANNELS), dtype=np.float32)
+    mask = np.zeros(CHANNELS, dtype=bool)
+    for clip in clips:
+        if len(clip) == 0:
+            continue
+        data[:, clip.mask] = _pad(clip.data, length)[:, clip.mask]
+        mask |= clip.mask
+    return ActionClip.from_array(data, mask)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+from math import atan, sqrt, exp
+from time import perf_counter
+
+''' AttitudeEstimator: gyro + accelerometer complementary filter
+
+    The accelerometer alone gives an absolute but noisy attitude (every
+    step of a gait shows up in it), the gyro a smooth but drifting one.
+    Every sample the gyro rates are integrated over the real dt, then
+    pulled towards the accelerometer attitude with a time constant TAU.
+    The pull is weakened while the measured acceleration is far from 1 G,
+    when the accelerometer does not measure gravity only.
+
+    Axes follow Pidog._imu_thread: x is vertical (1 G = -16384), pitch is
+    measured from y and roll from z. Pitch turns around the gyro z axis,
+    roll around y, yaw around x.
+'''
+
+ACC_1G = 16384  # LSB, 2g range
+GYRO_SENSITIVITY = 16.384  # LSB per dps, 2000 dps range
+RAD_TO_DEG = 57.2957795
+
+
+def accel_angles(ax, ay, az):
+    """
+    Pitch and roll from the accelerometer, same formula as Pidog._imu_thread
+
+    :return: pitch, roll in degree
+    """
+    ay = -ay
+    az = -az
+    pitch = atan(ay/sqrt(ax*ax+az*az))*RAD_TO_DEG if ax or az else 0.0
+    roll = atan(az/sqrt(ax*ax+ay*ay))*RAD_TO_DEG if ax or ay else 0.0
+    return pitch, roll
+
+
+class AttitudeEstimator():
+
+    TAU = 0.5  # second, time constant of the accelerometer correction
+    ACC_TRUST_WIDTH = 0.15  # G, accelerometer weight falls off as |a| leaves 1 G by this much
+    MAX_DT = 0.1  # second, larger gaps (thread stalls) restart from the accelerometer
+
+    # gyro axis index and sign for pitch, roll and yaw rates
+    PITCH_AXIS = (2, -1)
+    ROLL_AXIS = (1, 1)
+    YAW_AXIS = (0, -1)
+
+    def __init__(self, tau=TAU):
+        self.tau = tau
+        self.reset()
+
+    def reset(self):
+        self.pitch = 0.0
+        self.roll = 0.0
+        self.pitch_rate = 0.0
+        self.roll_rate = 0.0
+        self.yaw_rate = 0.0
+        self.last_time = None
+        self.updates = 0
+        self.cpu_time = 0.0
+
+    def update(self, acc, gyro, timestamp=None):
+        """
+        Update with one sample
+
+        :param acc: [ax, ay, az], offsets applied, LSB
+        :param gyro: [gx, gy, gz], offsets applied, LSB
+        :param timestamp: sample time in second (perf_counter), now if None
+        :return: pitch, roll in degree
+        """
+        start = perf_counter()
+        if timestamp is None:
+            timestamp = start
+
+        acc_pitch, acc_roll = accel_angles(*acc)
+        self.pitch_rate = self.PITCH_AXIS[1] * gyro[self.PITCH_AXIS[0]] / GYRO_SENSITIVITY
+        self.roll_rate = self.ROLL_AXIS[1] * gyro[self.ROLL_AXIS[0]] / GYRO_SENSITIVITY
+        self.yaw_rate = self.YAW_AXIS[1] * gyro[self.YAW_AXIS[0]] / GYRO_SENSITIVITY
+
+        if self.last_time is None or not 0 < timestamp - self.last_time <= self.MAX_DT:
+            self.pitch = acc_pitch
+            self.roll = acc_roll
+        else:
+            dt = timestamp - self.last_time
+            norm = sqrt(acc[0]*acc[0] + acc[1]*acc[1] + acc[2]*acc[2]) / ACC_1G
+            trust = exp(-((norm - 1) / self.ACC_TRUST_WIDTH)**2)
+            k = trust * dt / (self.tau + dt)
+            self.pitch += self.pitch_rate * dt
+            self.roll += self.roll_rate * dt
+            self.pitch += k * (acc_pitch - self.pitch)
+            self.roll += k * (acc_roll - self.roll)
+        self.last_time = timestamp
+
+        self.updates += 1
+        self.cpu_time += perf_counter() - start
+        return self.pitch, self.roll
+
+    def mean_update_time(self):
+        return self.cpu_time / self.updates if self.updates else 0.0
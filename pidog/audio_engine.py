@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+import threading
+import wave
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from time import perf_counter, sleep
+import numpy as np
+from robot_hat import utils
+import pygame
+from .sound_catalog import SoundCatalog
+
+''' AudioEngine: sound effects mixed from decoded PCM kept in memory
+
+    The pygame mixer is opened once, with a small buffer. Sounds are found
+    in a SoundCatalog, every asset is decoded to 16 bit PCM the first time
+    it is played, or ahead with preload(), and kept in an LRU cache up to
+    CACHE_SIZE bytes. Decoded PCM of the catalog sounds is also stored in
+    the disk cache of the catalog, written by a background thread, the
+    next process loads a wav instead of decoding the mp3.
+
+    play() adds a Voice and returns at once. One-shots, clips of at most
+    ONE_SHOT_TIME like barks, are played at once on a free pygame Channel
+    of their own, heard after one device buffer (5.8 ms at 44.1 kHz).
+    The mixer thread sums the other voices with numpy into chunks of
+    CHUNK samples and keeps one chunk queued behind the playing one on a
+    reserved pygame Channel (a Channel queues one Sound only), they are
+    heard after at most two chunks plus the device buffer: 11.6 + 11.6 +
+    5.8 ms, 29 ms at worst, 17 ms on average. The mixer has one chunk,
+    11.6 ms, to queue the next one; when the output runs dry while voices
+    are playing an underrun is counted, see stats(). A one-shot also goes
+    through the mixer when no Channel is free.
+
+    New voices start at their ducked or full gain. A change of the highest
+    priority playing ramps the gain of the other mixed voices to DUCK_GAIN
+    over one chunk, one-shots change their Channel volume at once.
+
+    Every Voice can be cancelled, and has a Future resolved with True once
+    its last sample is heard, from the schedule of the chunks or of its
+    Channel, False when it was cancelled. The trigger to sound latency of
+    every voice is recorded: the time until its first sample is heard,
+    from the same schedule, plus one device buffer.
+
+    The amplitude envelope of every clip, the RMS of ENVELOPE_RATE windows
+    per second normalized to its loudest window, is computed once and
+    cached. Voice.level() reads it at the playback clock, eg: to drive the
+    rgb strip (rgb_layers.EnvelopeLayer).
+'''
+
+
+class Voice():
+    """
+    Handle of a playing sound
+    """
+
+    def __init__(self, asset, pcm, volume=100, priority=0, on_done=None, envelope=None, envelope_rate=0):
+        """
+        :param pcm: int16 array of samples*channels
+        :param volume: 0~100
+        :param priority: higher priority voices duck the lower ones
+        :param on_done: callback(Voice), called from the mixer thread when the voice ends
+        :param envelope: amplitude envelope 0~1, envelope_rate values per second
+        """
+        self.asset = asset
+        self.pcm = pcm
+        self.volume = max(0, min(100, volume)) / 100
+        self.priority = priority
+        self.position = 0  # samples mixed
+        self.gain = 1.0  # ducking gain of the last chunk
+        self.trigger_time = perf_counter()
+        self.start_time = None  # perf_counter second the first sample is heard, estimated
+        self.end_time = None  # perf_counter second the last sample mixed so far is heard, estimated
+        self.channel = None  # pygame Channel of a one-shot, None for a mixed voice
+        self.sound = None
+        self.cancelled = False
+        self.future = Future()
+        self.envelope = envelope
+        self.envelope_rate = envelope_rate
+        if on_done is not None:
+            self.future.add_done_callback(lambda future: on_done(self))
+
+    def __repr__(self):
+        return f'Voice({self.asset.name}, priority={self.priority})'
+
+    @property
+    def duration(self):
+        return len(self.pcm)
+
+    def cancel(self):
+        """
+        Stop the voice at the next chunk
+        """
+        self.cancelled = True
+
+    def done(self):
+        return self.future.done()
+
+    def heard(self, now):
+        """
+        :return: True once every sample is mixed and the last one is heard
+        """
+        return self.position >= self.duration and self.end_time is not None and now >= self.end_time
+
+    def level(self, now=None):
+        """
+        Loudness of the sound heard at now, from the envelope
+
+        :param now: perf_counter second, now if None
+        :return: 0~1, 0 before the start, after the end or without an envelope
+        """
+        if self.start_time is None or self.envelope is None:
+            return 0.0
+        if now is None:
+            now = perf_counter()
+        index = int((now - self.start_time) * self.envelope_rate)
+        if 0 <= index < len(self.envelope):
+            return float(self.envelope[index])
+        return 0.0
+
+    def wait(self, timeout=None):
+        """
+        :return: True if played to the end, False if cancelled
+        """
+        return self.future.result(timeout)
+
+
+class AudioEngine():
+
+    FREQUENCY = 44100  # Hz
+    CHANNELS = 2
+    BUFFER = 256  # samples per device buffer
+    CHUNK = 512  # samples mixed at once, a new voice starts within about two chunks
+    MAX_VOICES = 8  # the lowest priority, oldest voice is dropped beyond
+    DUCK_GAIN = 0.3  # gain of the voices below the highest priority playing
+    CACHE_SIZE = 64*1024*1024  # bytes of decoded PCM kept
+    ENVELOPE_RATE = 50  # envelope values per second
+    ENVELOPE_CACHE = 64  # envelopes kept
+    LATENCY_HISTORY = 100
+    OUTPUT_CHANNEL = 0  # pygame channel reserved for the mixed output
+    ONE_SHOT_TIME = 1.0  # second, shorter clips are played on a Channel of their own
+
+    def __init__(self, sound_dir, cache_dir=None, frequency=FREQUENCY, channels=CHANNELS, buffer=BUFFER,
+                 cache_size=CACHE_SIZE):
+        """
+        :param sound_dir: folder of the sound files
+        :param cache_dir: folder of the decoded sounds on disk, None for no disk cache
+        :param buffer: samples per mixer buffer, smaller for a lower latency
+        :param cache_size: bytes of decoded PCM kept in memory
+        """
+        self.catalog = SoundCatalog(sound_dir, cache_dir)
+        self.frequency = frequency
+        self.channels = channels
+        self.buffer = buffer
+        self.cache_size = cache_size
+
+        self.is_open = False
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()  # asset hash: int16 array samples*channels
+        self.cache_bytes = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.latencies = deque(maxlen=self.LATENCY_HISTORY)
+        self.envelopes = OrderedDict()  # asset hash: float32 array
+
+        self.voices = []
+        self.condition = threading.Condition()
+        self.mixer_thread = None
+        self.output = None
+        self.chunks_mixed = 0
+        self.underruns = 0
+
+    def open(self):
+        """
+        Open the output device and start the mixer thread, once
+        """
+        with self.lock:
+            if self.is_open:
+                return
+            # Solve the problem that there is no sound when running in the vnc environment
+            utils.run_command('sudo killall pulseaudio')
+            pygame.mixer.pre_init(self.frequency, -16, self.channels, self.buffer)
+            pygame.mixer.init()
+            # the mixer may have been opened before with other settings
+            self.frequency, size, self.channels = pygame.mixer.get_init()
+            if size != -16:
+                pygame.mixer.quit()
+                raise IOError(f'mixer opened with {size} bit samples, 16 bit signed needed')
+            pygame.mixer.set_reserved(self.OUTPUT_CHANNEL + 1)
+            self.output = pygame.mixer.Channel(self.OUTPUT_CHANNEL)
+            self.is_open = True
+            self.mixer_thread = threading.Thread(name='audio_mixer_thread', target=self._mixer_thread)
+            self.mixer_thread.daemon = True
+            self.mixer_thread.start()
+
+    def close(self):
+        with self.lock:
+            if not self.is_open:
+                return
+        self.stop()
+        with self.condition:
+            self.is_open = False
+            self.condition.notify_all()
+        self.mixer_thread.join()
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+        pygame.mixer.quit()
+
+    # sounds
+    # =================================================================
+    def find(self, name):
+        """
+        :param name: sound name or alias in the catalog, or file path
+        :return: SoundAsset, None if not found
+        """
+        return self.catalog.find(name)
+
+    def _read_wav(self, path):
+        with wave.open(path, 'rb') as f:
+            if f.getnchannels() != self.channels or f.getsampwidth() != 2 or f.getframerate() != self.frequency:
+                return None
+            data = f.readframes(f.getnframes())
+        return np.frombuffer(data, dtype='<i2').reshape(-1, self.channels)
+
+    def _decode(self, asset):
+        wav = self.catalog.decoded_path(asset, self.frequency, self.channels)
+        if wav is not None:
+            try:
+                pcm = self._read_wav(wav)
+                if pcm is not None:
+                    return pcm
+            except (OSError, wave.Error):
+                pass
+        raw = pygame.mixer.Sound(asset.path).get_raw()
+        if self.catalog.cache_dir is not None and self.catalog.cataloged(asset):
+            # written off the play path
+            threading.Thread(name='audio_store_thread', target=self.catalog.store_decoded,
+                             args=(asset, raw, self.frequency, self.channels), daemon=True).start()
+        return np.frombuffer(raw, dtype=np.int16).reshape(-1, self.channels)
+
+    def load(self, asset):
+        """
+        Decoded samples of an asset, from the memory cache, the disk cache or decoded now
+
+        :param asset: SoundAsset
+        :return: int16 array of samples*channels
+        """
+        self.open()
+        key = asset.hash
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                return self.cache[key]
+            self.cache_misses += 1
+        # decode out of the lock, cached sounds keep playing meanwhile
+        pcm = self._decode(asset)
+        with self.lock:
+            if key not in self.cache:
+                self.cache[key] = pcm
+                self.cache_bytes += pcm.nbytes
+                while self.cache_bytes > self.cache_size and len(self.cache) > 1:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cache_bytes -= evicted.nbytes
+        return pcm
+
+    def envelope(self, asset, pcm=None):
+        """
+        Amplitude envelope of an asset, computed once: RMS of every 1/ENVELOPE_RATE second window,
+        normalized to the loudest one
+
+        :param pcm: decoded samples, loaded if None
+        :return: float32 array 0~1
+        """
+        key = asset.hash
+        with self.lock:
+            if key in self.envelopes:
+                self.envelopes.move_to_end(key)
+                return self.envelopes[key]
+        if pcm is None:
+            pcm = self.load(asset)
+        window = max(1, self.frequency // self.ENVELOPE_RATE)
+        count = len(pcm) // window
+        mono = pcm[:count*window].astype(np.float32).mean(axis=1).reshape(count, window)
+        envelope = np.sqrt(np.mean(mono*mono, axis=1))
+        peak = envelope.max() if count > 0 else 0
+        if peak > 0:
+            envelope /= peak
+        with self.lock:
+            self.envelopes[key] = envelope
+            while len(self.envelopes) > self.ENVELOPE_CACHE:
+                self.envelopes.popitem(last=False)
+        return envelope
+
+    def preload(self, names=None):
+        """
+        Decode sounds ahead, until the cache is full
+
+        :param names: list of names or paths, every sound of the catalog if None
+        """
+        if names is None:
+            names = self.catalog.names()
+        for name in names:
+            asset = self.find(name)
+            if asset is None:
+                continue
+            self.load(asset)
+            if self.cache_bytes >= self.cache_size:
+                break
+
+    # playback
+    # =================================================================
+    def play(self, name, volume=100, priority=0, on_done=None, one_shot=None):
+        """
+        Play a sound, without waiting
+
+        :param name: sound name or alias in the catalog, or file path
+        :param volume: 0~100
+        :param priority: voices of a lower priority are ducked while this one plays
+        :param on_done: callback(Voice), called from the mixer thread when the voice ends
+        :param one_shot: play on a free Channel, not mixed, None for clips of at most ONE_SHOT_TIME
+        :return: Voice, None if the sound is not found
+        """
+        asset = self.find(name)
+        if asset is None:
+            return None
+        pcm = self.load(asset)
+        if one_shot is None:
+            one_shot = len(pcm) <= self.ONE_SHOT_TIME * self.frequency
+        voice = Voice(asset, pcm, volume, priority, on_done, self.envelope(asset, pcm), self.ENVELOPE_RATE)
+        with self.condition:
+            if one_shot:
+                self._play_one_shot(voice)
+            self.voices.append(voice)
+            if len(self.voices) > self.MAX_VOICES:
+                dropped = min(self.voices, key=lambda v: (v.priority, v.trigger_time))
+                dropped.cancel()
+            self.condition.notify_all()
+        return voice
+
+    def play_block(self, name, volume=100, priority=0):
+        """
+        Play a sound and wait until it is done
+
+        :return: False if the sound is not found or was cancelled
+        """
+        voice = self.play(name, volume, priority)
+        if voice is None:
+            return False
+        return voice.wait()
+
+    def stop(self):
+        """
+        Cancel every voice
+        """
+        with self.condition:
+            for voice in self.voices:
+                voice.cancel()
+            self.condition.notify_all()
+
+    def _play_one_shot(self, voice):
+        # on a free channel of its own, with the condition held; left to the mixer if none is free
+        channel = pygame.mixer.find_channel()
+        if channel is None:
+            return
+        top = max([v.priority for v in self.voices] + [voice.priority])
+        voice.gain = 1.0 if voice.priority >= top else self.DUCK_GAIN
+        voice.sound = pygame.mixer.Sound(buffer=voice.pcm.tobytes())
+        channel.set_volume(voice.volume * voice.gain)
+        channel.play(voice.sound)
+        voice.channel = channel
+        voice.start_time = perf_counter() + self.buffer / self.frequency
+        voice.end_time = voice.start_time + voice.duration / self.frequency
+        voice.position = voice.duration
+        self.latencies.append(voice.start_time - voice.trigger_time)
+
+    def _mix(self, voices, start, top):
+        # sum a chunk of every voice, ramping the ducking gain over the chunk
+        # start: perf_counter second the chunk begins to play
+        # top: highest priority playing, one-shots included
+        out = np.zeros((self.CHUNK, self.channels), dtype=np.float32)
+        heard = start + self.buffer / self.frequency
+        for voice in voices:
+            n = min(self.CHUNK, voice.duration - voice.position)
+            if n <= 0:
+                continue
+            target = 1.0 if voice.priority >= top else self.DUCK_GAIN
+            if voice.start_time is None:
+                voice.start_time = heard
+                voice.gain = target
+                self.latencies.append(voice.start_time - voice.trigger_time)
+            gain = np.linspace(voice.gain, target, n, dtype=np.float32)[:, None] * voice.volume
+            voice.gain = target
+            out[:n] += voice.pcm[voice.position:voice.position + n] * gain
+            voice.position += n
+            voice.end_time = heard + n / self.frequency
+        np.clip(out, -32768, 32767, out=out)
+        self.chunks_mixed += 1
+        return pygame.mixer.Sound(buffer=out.astype(np.int16).tobytes())
+
+    def _mixer_thread(self):
+        chunk_time = self.CHUNK / self.frequency
+        end = 0.0  # perf_counter second the queued audio ends
+        streaming = False  # voices played since the last chunk, the output should be busy
+        while True:
+            with self.condition:
+                while self.is_open and not self.voices:
+                    streaming = False
+                    self.condition.wait()
+                if not self.is_open:
+                    break
+                now = perf_counter()
+                finished = [voice for voice in self.voices if voice.cancelled or voice.heard(now)]
+                self.voices = [voice for voice in self.voices if voice not in finished]
+                voices = list(self.voices)
+            for voice in finished:
+                if voice.cancelled and voice.channel is not None and voice.channel.get_sound() is voice.sound:
+                    voice.channel.stop()
+                voice.future.set_result(not voice.cancelled)
+            if not voices:
+                continue
+            top = max(voice.priority for voice in voices)
+            for voice in voices:
+                if voice.channel is not None:
+                    # one-shot on its own channel, ducked without a ramp
+                    gain = 1.0 if voice.priority >= top else self.DUCK_GAIN
+                    if gain != voice.gain:
+                        voice.gain = gain
+                        voice.channel.set_volume(voice.volume * gain)
+            mixed = [voice for voice in voices if voice.channel is None and voice.position < voice.duration]
+            if not mixed:
+                # the output may run dry, wait for the last samples to be heard or a new voice
+                streaming = False
+                with self.condition:
+                    self.condition.wait(chunk_time / 4)
+                continue
+            # keep one chunk queued behind the playing one
+            if not self.output.get_busy():
+                if streaming:
+                    # ran dry while voices were playing
+                    self.underruns += 1
+                self.output.play(self._mix(mixed, now, top))
+                end = now + chunk_time
+                streaming = True
+            elif self.output.get_queue() is None:
+                start = max(now, end)
+                self.output.queue(self._mix(mixed, start, top))
+                end = start + chunk_time
+            else:
+                # the queue frees when the playing chunk ends
+                sleep(min(chunk_time / 4, max(0.0005, end - chunk_time - now)))
+        for voice in self.voices:
+            voice.future.set_result(False)
+        self.voices = []
+
+    def stats(self):
+        """
+        :return: dict of trigger to sound latency (last, mean, max in second), voices,
+                 chunks mixed, underruns, cache hits, misses and bytes
+        """
+        latencies = list(self.latencies)
+        return {
+            'latency_last': latencies[-1] if latencies else None,
+            'latency_mean': sum(latencies) / len(latencies) if latencies else None,
+            'latency_max': max(latencies) if latencies else None,
+            'voices': len(self.voices),
+            'chunks_mixed': self.chunks_mixed,
+            'underruns': self.underruns,
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'cache_bytes': self.cache_bytes,
+        }
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import threading
+from time import perf_counter, sleep
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancelToken():
+    """
+    Cancellation token shared between a choreography and the thread which may cancel it
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.cancel_time = None
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        if self._event.is_set():
+            return
+        self.cancel_time = perf_counter()
+        self._event.set()
+        with self._lock:
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        with self._lock:
+            self._callbacks.append(callback)
+        if self.cancelled:
+            callback()
+
+    def remove_callback(self, callback):
+        with self._lock:
+            self._callbacks = [item for item in self._callbacks if item is not callback]
+
+    def wait(self, timeout=None):
+        """
+        :return: True if cancelled within timeout
+        """
+        return self._event.wait(timeout)
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+
+class Choreography():
+    """
+    Run multi-step actions which can be cancelled from another thread.
+
+    Steps are callables taking the runner, they enqueue actions on
+    runner.dog and use the runner's wait/sleep methods instead of
+    Pidog.wait_*_done and time.sleep, so a cancel is noticed at once.
+    Moves are enqueued with immediately=False, an immediate move blocks
+    in Pidog.wait_*_done where a cancel can not reach it.
+
+    On cancel, the queued frames of all parts are cleared atomically, the
+    undo callbacks of the run (see on_cancel) are called, and stop_latency
+    reports the time from the cancel request until the robot actually
+    holds still. The callbacks are removed from the token when the run
+    finishes, so a token can be reused for many runs.
+    """
+
+    POLL_INTERVAL = 0.001
+
+    def __init__(self, dog, token=None):
+        """
+        :param dog: Pidog instance
+        :param token: CancelToken, a new one is created if None
+        """
+        self.dog = dog
+        self.token = token if token is not None else CancelToken()
+        self.stop_latency = None
+        self._callbacks = []
+
+    def cancel(self):
+        self.token.cancel()
+
+    def on_cancel(self, callback):
+        """
+        Undo something a step started if the run is cancelled,
+        eg: stop a sound or restore the rgb mode
+
+        :param callback: callable without arguments
+        """
+        self._callbacks.append(callback)
+        self.token.on_cancel(callback)
+
+    # step helpers
+    # =================================================================
+    def sleep(self, seconds):
+        if self.token.wait(seconds):
+            raise Cancelled()
+
+    def _wait(self, is_done):
+        while not is_done():
+            if self.token.wait(self.POLL_INTERVAL):
+                raise Cancelled()
+
+    def wait_legs_done(self):
+        self._wait(self.dog.is_legs_done)
+
+    def wait_head_done(self):
+        self._wait(self.dog.is_head_done)
+
+    def wait_tail_done(self):
+        self._wait(self.dog.is_tail_done)
+
+    def wait_all_done(self):
+        self._wait(self.dog.is_all_done)
+
+    # run
+    # =================================================================
+    def run(self, steps):
+        """
+        :param steps: a step or a list of steps, step(runner)
+        :return: True if all steps finished, False if cancelled
+        """
+        if callable(steps):
+            steps = [steps]
+        self.on_cancel(self.dog.body_clear)
+        try:
+            for step in steps:
+                self.token.check()
+                step(self)
+            return True
+        except Cancelled:
+            # a step may have enqueued frames after the cancel callback cleared them
+            self.dog.body_clear()
+            while not self.dog.is_still():
+                sleep(self.POLL_INTERVAL)
+            self.stop_latency = perf_counter() - self.token.cancel_time
+            return False
+        finally:
+            for callback in self._callbacks:
+                self.token.remove_callback(callback)
+            self._callbacks = []
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+from collections import deque, namedtuple
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+import numpy as np
+from .memory_barrier import fence
+
+''' Ultrasonic readings: filter and timestamped ring in shared memory
+
+    The sensory process filters every raw reading (median of the last
+    readings, then EWMA) and pushes raw, filtered, flags and timestamp to a
+    DistanceRing. Pidog reads the latest sample or the history from the
+    main process without locking, the age of a sample is always known.
+    The write index is the commit word of the slots, see memory_barrier.py.
+'''
+
+# flags
+FLAG_VALID = 0x01  # raw reading in range
+FLAG_TIMEOUT = 0x02  # no echo, raw = -1
+FLAG_OUT_OF_RANGE = 0x04  # raw reading outside min/max distance
+FLAG_SPIKE = 0x08  # raw reading far from the median of the last ones
+FLAG_FILTERED_VALID = 0x10  # enough valid readings behind the filtered value
+
+DISTANCE_DTYPE = np.dtype([
+    ('timestamp', '<f8'),
+    ('raw', '<f4'),
+    ('filtered', '<f4'),
+    ('flags', '<u4'),
+    ('pad', '<u4'),
+])
+
+DistanceSample = namedtuple('DistanceSample', ['timestamp', 'raw', 'filtered', 'flags'])
+
+
+class DistanceFilter():
+
+    MEDIAN_WINDOW = 5  # readings
+    EWMA_ALPHA = 0.5  # weight of the new median, 1 for median only
+    MIN_VALID = 3  # valid readings in the window for a valid filtered value
+    MIN_DISTANCE = 2  # cm
+    MAX_DISTANCE = 400  # cm
+    SPIKE = 30  # cm, distance from the median flagged as spike
+
+    def __init__(self, median_window=MEDIAN_WINDOW, ewma_alpha=EWMA_ALPHA, min_valid=MIN_VALID,
+                 min_distance=MIN_DISTANCE, max_distance=MAX_DISTANCE, spike=SPIKE):
+        self.window = deque(maxlen=median_window)
+        self.ewma_alpha = ewma_alpha
+        self.min_valid = min(min_valid, median_window)
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+        self.spike = spike
+        self.filtered = -1.0
+
+    def update(self, raw):
+        """
+        :param raw: raw reading in cm, -1 for timeout
+        :return: filtered distance (-1 if not valid), flags
+        """
+        flags = 0
+        if raw < 0:
+            flags |= FLAG_TIMEOUT
+            self.window.append(None)
+        elif not self.min_distance <= raw <= self.max_distance:
+            flags |= FLAG_OUT_OF_RANGE
+            self.window.append(None)
+        else:
+            flags |= FLAG_VALID
+            self.window.append(raw)
+
+        valid = [v for v in self.window if v is not None]
+        if len(valid) < self.min_valid:
+            self.filtered = -1.0
+            return self.filtered, flags
+
+        median = float(np.median(valid))
+        if flags & FLAG_VALID and abs(raw - median) > self.spike:
+            flags |= FLAG_SPIKE
+        if self.filtered < 0:
+            self.filtered = median
+        else:
+            self.filtered += self.ewma_alpha * (median - self.filtered)
+        return self.filtered, flags | FLAG_FILTERED_VALID
+
+
+class DistanceRing():
+    """
+    Single writer ring of DistanceSample in shared memory
+    """
+
+    CAPACITY = 512
+    INDEX_SIZE = 8
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.shm = SharedMemory(create=True, size=self.INDEX_SIZE + capacity*DISTANCE_DTYPE.itemsize)
+        self.index = np.ndarray((1,), dtype='<u8', buffer=self.shm.buf)
+        self.slots = np.ndarray((capacity,), dtype=DISTANCE_DTYPE, buffer=self.shm.buf, offset=self.INDEX_SIZE)
+        self.index[0] = 0
+
+    def __len__(self):
+        return min(int(self.index[0]), self.capacity - 1)
+
+    def push(self, timestamp, raw, filtered, flags):
+        count = int(self.index[0])
+        slot = self.slots[count % self.capacity]
+        slot['timestamp'] = timestamp
+        slot['raw'] = raw
+        slot['filtered'] = filtered
+        slot['flags'] = flags
+        fence()
+        self.index[0] = count + 1
+
+    def latest(self):
+        """
+        :return: DistanceSample or None if empty
+        """
+        while True:
+            count = int(self.index[0])
+            if count == 0:
+                return None
+            fence()
+            slot = self.slots[(count - 1) % self.capacity].copy()
+            fence()
+            # the slot is only rewritten capacity - 1 samples later
+            if int(self.index[0]) - count < self.capacity - 1:
+                return DistanceSample(float(slot['timestamp']), float(slot['raw']),
+                                      float(slot['filtered']), int(slot['flags']))
+
+    def last(self, n):
+        """
+        Last n samples, oldest first, a copy
+
+        :return: structured array, fields as DISTANCE_DTYPE
+        """
+        while True:
+            count = int(self.index[0])
+            n = max(0, min(n, count, self.capacity - 1))
+            fence()
+            slots = np.take(self.slots, range(count - n, count), mode='wrap')
+            fence()
+            # the oldest of them is only rewritten capacity - n samples later
+            if int(self.index[0]) - count < self.capacity - n:
+                return slots
+
+    def since(self, timestamp):
+        """
+        Samples newer than timestamp, oldest first, a copy
+        """
+        slots = self.last(self.capacity - 1)
+        return slots[np.searchsorted(slots['timestamp'], timestamp, side='right'):]
+
+    def age(self):
+        """
+        Seconds since the latest sample, None if empty
+        """
+        sample = self.latest()
+        return None if sample is None else perf_counter() - sample.timestamp
+
+    def close(self):
+        del self.index, self.slots
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -1,19 +1,151 @@
 #!/usr/bin/env python3
 from robot_hat import Pin
 import time
+import threading
+from collections import deque, namedtuple
+from .sensor_hub import TOUCH_CODES
+
+# gestures, the first four are the codes of read()
+TAP_L = 'L'
+TAP_R = 'R'
+SLIDE_LR = 'LS'  # from left to right
+SLIDE_RL = 'RS'  # from right to left
+LONG_L = 'LONG_L'
+LONG_R = 'LONG_R'
+DOUBLE_L = 'DOUBLE_L'
+DOUBLE_R = 'DOUBLE_R'
+GESTURES = [TAP_L, TAP_R, SLIDE_LR, SLIDE_RL, LONG_L, LONG_R, DOUBLE_L, DOUBLE_R]
+# gesture: code of read()
+READ_CODES = {
+    TAP_L: 'L', TAP_R: 'R', SLIDE_LR: 'LS', SLIDE_RL: 'RS',
+    LONG_L: 'L', LONG_R: 'R', DOUBLE_L: 'L', DOUBLE_R: 'R',
+}
+
+# timestamp: perf_counter second the gesture was recognized
+TouchEvent = namedtuple('TouchEvent', ['timestamp', 'gesture'])
+
+
+class TouchGestures():
+    """
+    Gesture state machine, fed with debounced press / release of the two pads
+
+        tap:        press and release shorter than LONG_PRESS, no second tap within DOUBLE_TAP_INTERVAL
+        double tap: two taps on the same pad within DOUBLE_TAP_INTERVAL
+        long press: held for LONG_PRESS
+        slide:      the other pad pressed within SLIDE_MAX_INTERVAL after a press
+
+    A tap is only reported once DOUBLE_TAP_INTERVAL has passed, tick() reports
+    the gestures which depend on time, call it at next_deadline().
+    """
+
+    SLIDE_MAX_INTERVAL = 0.5  # second
+    LONG_PRESS = 0.8  # second
+    DOUBLE_TAP_INTERVAL = 0.3  # second
+
+    def __init__(self):
+        self.pressed = {'L': None, 'R': None}  # press time
+        self.consumed = {'L': False, 'R': False}  # press already part of a slide or long press
+        self.last_press = {'L': None, 'R': None}
+        self.pending_tap = None  # (side, release time)
+
+    def _other(self, side):
+        return 'R' if side == 'L' else 'L'
+
+    def feed(self, side, pressed, timestamp):
+        """
+        :param side: 'L' or 'R'
+        :param pressed: True on press, False on release
+        :return: list of gestures completed by this edge
+        """
+        gestures = self.tick(timestamp)
+        other = self._other(side)
+        if pressed:
+            if self.pressed[side] is not None:
+                return gestures
+            self.pressed[side] = timestamp
+            self.consumed[side] = False
+            other_press = self.last_press[other]
+            if other_press is not None and timestamp - other_press <= self.SLIDE_MAX_INTERVAL:
+                gestures.append(SLIDE_LR if side == 'R' else SLIDE_RL)
+                self.consumed[side] = True
+                self.consumed[other] = True
+                self.last_press[other] = None
+                if self.pending_tap is not None and self.pending_tap[0] == other:
+                    self.pending_tap = None
+                return gestures
+            self.last_press[side] = timestamp
+        else:
+            if self.pressed[side] is None:
+                return gestures
+            self.pressed[side] = None
+            if self.consumed[side]:
+                return gestures
+            if self.pending_tap is not None and self.pending_tap[0] == side:
+                gestures.append(DOUBLE_L if side == 'L' else DOUBLE_R)
+                self.pending_tap = None
+                self.last_press[side] = None
+            else:
+                if self.pending_tap is not None:
+                    gestures.append(TAP_L if self.pending_tap[0] == 'L' else TAP_R)
+                self.pending_tap = (side, timestamp)
+        return gestures
+
+    def tick(self, now):
+        """
+        :return: list of gestures completed by the time passing
+        """
+        gestures = []
+        for side in ('L', 'R'):
+            press = self.pressed[side]
+            if press is not None and not self.consumed[side] and now - press >= self.LONG_PRESS:
+                gestures.append(LONG_L if side == 'L' else LONG_R)
+                self.consumed[side] = True
+                self.last_press[side] = None
+        if self.pending_tap is not None and now - self.pending_tap[1] >= self.DOUBLE_TAP_INTERVAL:
+            gestures.append(TAP_L if self.pending_tap[0] == 'L' else TAP_R)
+            self.pending_tap = None
+        return gestures
+
+    def next_deadline(self):
+        """
+        :return: time tick() may report a gesture, None if nothing is pending
+        """
+        deadlines = [press + self.LONG_PRESS for side, press in self.pressed.items()
+                     if press is not None and not self.consumed[side]]
+        if self.pending_tap is not None:
+            deadlines.append(self.pending_tap[1] + self.DOUBLE_TAP_INTERVAL)
+        return min(deadlines) if deadlines else None
 
 
 class DualTouch():
 
     SLIDE_MAX_INTERVAL = 0.5  # second, Maximum effective interval for sliding detection
+    DEBOUNCE = 0.02  # second, edges of a pad closer than this are ignored
+    QUEUE_SIZE = 16  # events kept for read() and get_event()
 
-    def __init__(self, sw1='D2', sw2='D3'):
+    def __init__(self, sw1='D2', sw2='D3', publish=None):
+        '''
+        :param publish: callback(name, value, timestamp), eg: SensorHub.publish, called with every read or gesture
+        '''
+        self.publish = publish
 
         self.touch_L = Pin(sw1, mode=Pin.IN, pull=Pin.PULL_UP)
         self.touch_R = Pin(sw2, mode=Pin.IN, pull=Pin.PULL_UP)
         self.last_touch = 'N'
         self.last_touch_time = 0
 
+        self.event_mode = False
+        self.gestures = TouchGestures()
+        self.gestures.SLIDE_MAX_INTERVAL = self.SLIDE_MAX_INTERVAL
+        self.events = deque(maxlen=self.QUEUE_SIZE)
+        self.condition = threading.Condition()
+        self.dispatch = []
+        self.subscribers = {}
+        self.next_handle = 1
+        self.last_edge = {'L': 0, 'R': 0}
+        self.levels = {'L': False, 'R': False}
+        self.event_thread = None
+
     # def read(self):
     #     if self.touch_L.value() == 1:
     #         time.sleep(0.1)
@@ -30,6 +162,21 @@ class DualTouch():
     #     return 'N'
 
     def read(self):
+        '''
+        Touch status: 'N', 'L', 'R', 'LS' (slide left to right), 'RS' (slide right to left)
+
+        In event mode the newest unread gesture is returned, as its read() code,
+        the older ones are dropped. get_event() returns every one.
+        '''
+        if self.event_mode:
+            event = self.latest_event()
+            return 'N' if event is None else READ_CODES[event.gesture]
+        val = self._read()
+        if self.publish is not None:
+            self.publish('touch', TOUCH_CODES.index(val))
+        return val
+
+    def _read(self):
         if self.touch_L.value() == 1:
             if self.last_touch == 'R' and\
                 time.time() - self.last_touch_time <= self.SLIDE_MAX_INTERVAL:
@@ -48,4 +195,129 @@ class DualTouch():
             self.last_touch_time = time.time()
             self.last_touch = 'R'
             return val
-        return 'N'
\ No newline at end of file
+        return 'N'
+
+    # event mode
+    # =================================================================
+    def start_events(self):
+        """
+        Detect gestures from the pad edges (robot_hat Pin.irq), instead of polling read()
+        """
+        if self.event_mode:
+            return
+        self.event_mode = True
+        self.event_thread = threading.Thread(name='touch_event_thread', target=self._event_thread)
+        self.event_thread.daemon = True
+        self.event_thread.start()
+        try:
+            self.touch_L.irq(handler=lambda *args: self._on_edge('L'), trigger=Pin.IRQ_RISING_FALLING,
+                             bouncetime=int(self.DEBOUNCE*1000))
+            self.touch_R.irq(handler=lambda *args: self._on_edge('R'), trigger=Pin.IRQ_RISING_FALLING,
+                             bouncetime=int(self.DEBOUNCE*1000))
+        except Exception:
+            # no half set up event mode, the caller can fall back to polling
+            self.stop_events()
+            raise
+
+    def stop_events(self):
+        for pad in (self.touch_L, self.touch_R):
+            try:
+                pad.irq(handler=None, trigger=Pin.IRQ_RISING_FALLING)
+            except Exception:
+                pass
+        with self.condition:
+            self.event_mode = False
+            self.condition.notify_all()
+        if self.event_thread is not None:
+            self.event_thread.join()
+            self.event_thread = None
+
+    def _on_edge(self, side):
+        timestamp = time.perf_counter()
+        pad = self.touch_L if side == 'L' else self.touch_R
+        # the level is read back, a bounce or a missed edge can not leave the state inverted
+        pressed = pad.value() == 1
+        with self.condition:
+            if pressed == self.levels[side] or timestamp - self.last_edge[side] < self.DEBOUNCE:
+                return
+            self.last_edge[side] = timestamp
+            self.levels[side] = pressed
+            self._emit(self.gestures.feed(side, pressed, timestamp), timestamp)
+
+    def _emit(self, gestures, timestamp):
+        # called with the condition held
+        for gesture in gestures:
+            event = TouchEvent(timestamp, gesture)
+            self.events.append(event)
+            self.dispatch.append(event)
+        if gestures:
+            self.condition.notify_all()
+
+    def _event_thread(self):
+        # reports the gestures which complete with time, and calls the subscribers out of the gpio callback
+        while True:
+            with self.condition:
+                if not self.event_mode:
+                    break
+                if not self.dispatch:
+                    deadline = self.gestures.next_deadline()
+                    timeout = None if deadline is None else max(0, deadline - time.perf_counter())
+                    self.condition.wait(timeout)
+                now = time.perf_counter()
+                self._emit(self.gestures.tick(now), now)
+                events = self.dispatch
+                self.dispatch = []
+                subscribers = list(self.subscribers.values())
+            for event in events:
+                if self.publish is not None:
+                    self.publish('touch', TOUCH_CODES.index(event.gesture), event.timestamp)
+                for callback, gestures in subscribers:
+                    if gestures is None or event.gesture in gestures:
+                        try:
+                            callback(event)
+                        except Exception as e:
+                            print(f'\rtouch subscriber error: {e}')
+
+    def subscribe(self, callback, gestures=None):
+        """
+        Call callback(TouchEvent) for every gesture, from the touch event thread
+
+        :param gestures: list of gestures, eg: [SLIDE_LR, SLIDE_RL], None for all
+        :return: handle for unsubscribe
+        """
+        with self.condition:
+            handle = self.next_handle
+            self.next_handle += 1
+            self.subscribers[handle] = (callback, gestures)
+        return handle
+
+    def unsubscribe(self, handle):
+        with self.condition:
+            self.subscribers.pop(handle, None)
+
+    def get_event(self, timeout=0):
+        """
+        Oldest unread gesture
+
+        :param timeout: second to wait for one, 0 to return at once, None to wait forever
+        :return: TouchEvent or None
+        """
+        with self.condition:
+            if timeout != 0 and not self.events:
+                self.condition.wait_for(lambda: len(self.events) > 0, timeout)
+            return self.events.popleft() if self.events else None
+
+    def latest_event(self):
+        """
+        Newest unread gesture, the older ones are dropped
+
+        :return: TouchEvent or None
+        """
+        with self.condition:
+            event = self.events[-1] if self.events else None
+            self.events.clear()
+        return event
+
+    def clear_events(self):
+        with self.condition:
+            self.events.clear()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+from collections import namedtuple
+from time import sleep
+import numpy as np
+from .memory_barrier import fence
+
+''' ImuBuffer: timestamped history of imu samples
+
+    A preallocated ring of rows [timestamp, ax, ay, az, gx, gy, gz, pitch, roll],
+    written by the imu thread only. Every sample is written twice, at
+    index and index + capacity, so any window of the last samples is a
+    contiguous slice and can be returned as a view without copying.
+
+    latest() uses a sequence lock: the writer makes seq odd while writing
+    and even when done, the reader retries until it read a whole sample
+    under the same even seq, so acc, gyro and attitude always come from
+    the same sample (see memory_barrier.py for the fences).
+'''
+
+COLUMNS = ('timestamp', 'ax', 'ay', 'az', 'gx', 'gy', 'gz', 'pitch', 'roll')
+TIMESTAMP = 0
+AX, AY, AZ = 1, 2, 3
+GX, GY, GZ = 4, 5, 6
+PITCH = 7
+ROLL = 8
+ACC = slice(1, 4)
+GYRO = slice(4, 7)
+
+ImuSample = namedtuple('ImuSample', COLUMNS)
+
+
+class ImuBuffer():
+
+    CAPACITY = 2048  # samples, about 4 s at 500 Hz
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self._data = np.zeros((2*capacity, len(COLUMNS)), dtype=np.float64)
+        self._count = 0  # samples written since start
+        self._seq = 0
+
+    def __len__(self):
+        return min(self._count, self.max_window)
+
+    @property
+    def max_window(self):
+        # the slot of the next sample must not be inside a returned window
+        return self.capacity - 1
+
+    @property
+    def count(self):
+        return self._count
+
+    def push(self, timestamp, acc, gyro, pitch=0.0, roll=0.0):
+        """
+        Append a sample, imu thread only
+
+        :param timestamp: sample time, perf_counter second
+        :param acc: [ax, ay, az]
+        :param gyro: [gx, gy, gz]
+        """
+        index = self._count % self.capacity
+        row = (timestamp, acc[0], acc[1], acc[2], gyro[0], gyro[1], gyro[2], pitch, roll)
+        self._seq += 1
+        fence()
+        self._data[index] = row
+        self._data[index + self.capacity] = row
+        self._count += 1
+        fence()
+        self._seq += 1
+
+    def latest(self):
+        """
+        Newest sample, all fields from the same sample
+
+        :return: ImuSample or None if empty
+        :rtype: ImuSample
+        """
+        while True:
+            seq = self._seq
+            if seq & 1:
+                sleep(0)
+                continue
+            fence()
+            count = self._count
+            if count == 0:
+                return None
+            row = self._data[(count - 1) % self.capacity].tolist()
+            fence()
+            if self._seq == seq:
+                return ImuSample(*row)
+
+    def last(self, n):
+        """
+        Last n samples, oldest first
+
+        The result is a view into the ring, it stays valid until
+        capacity - n more samples are written. Copy it to keep it longer.
+
+        :param n: number of samples, at most capacity - 1
+        :return: n*9 array, columns as COLUMNS
+        :rtype: numpy.ndarray
+        """
+        count = self._count
+        n = max(0, min(n, count, self.max_window))
+        start = (count - n) % self.capacity
+        return self._data[start:start + n]
+
+    def since(self, timestamp):
+        """
+        Samples newer than timestamp, oldest first, a view like last()
+
+        :param timestamp: perf_counter second
+        :rtype: numpy.ndarray
+        """
+        window = self.last(self.max_window)
+        start = np.searchsorted(window[:, TIMESTAMP], timestamp, side='right')
+        return window[start:]
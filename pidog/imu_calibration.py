@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+from time import perf_counter, sleep
+import numpy as np
+
+''' IMU calibration: bulk sampling, ellipsoid fit, stored result
+
+    A perfect accelerometer at rest measures 1 G in every orientation, its
+    samples lie on a sphere. A real one has offsets, per axis gains and
+    cross-axis terms, its samples lie on an ellipsoid. Samples collected
+    while the robot is rotated are fitted with a general quadric by linear
+    least squares, the center is the offset and the square root of the
+    normalized quadric matrix maps the ellipsoid back onto the 1 G sphere:
+
+        acc = matrix @ (raw - center)
+
+    The gyro bias is the mean of samples taken at rest. The result is
+    stored in the fileDB of the Sh3001, Pidog reuses it at startup, where
+    it is leveled on the startup pose and the gyro bias measured again
+    (see ImuCalibration.leveled).
+'''
+
+ACC_1G = 16384  # LSB, 2g range
+MIN_SAMPLES = 100
+DB_CENTER = 'imu_acc_center'
+DB_MATRIX = 'imu_acc_matrix'
+DB_GYRO_BIAS = 'imu_gyro_bias'
+
+
+def collect_samples(imu, seconds, rate=500, progress=None):
+    """
+    Collect raw samples for some seconds, in bursts from the fifo if available
+
+    :param imu: Sh3001 instance
+    :param seconds: collect time
+    :param rate: single read rate if the fifo is not available
+    :param progress: callback(elapsed, count), called once per second
+    :return: N*6 float array, raw ax, ay, az, gx, gy, gz
+    """
+    try:
+        imu.fifo_init()
+        use_fifo = True
+    except Exception:
+        use_fifo = False
+    blocks = []
+    count = 0
+    start = perf_counter()
+    last_progress = start
+    now = start
+    while now - start < seconds:
+        if use_fifo:
+            block = imu.fifo_read()
+            sleep(0.02)
+        else:
+            data = imu._sh3001_getimudata()
+            block = [data[0] + data[1]] if data != False else []
+            sleep(1 / rate)
+        if len(block) > 0:
+            blocks.append(np.asarray(block, dtype=np.float64))
+            count += len(block)
+        now = perf_counter()
+        if progress is not None and now - last_progress >= 1:
+            progress(now - start, count)
+            last_progress = now
+    if not blocks:
+        return np.empty((0, 6))
+    return np.concatenate(blocks)
+
+
+def fit_ellipsoid(acc, one_g=ACC_1G):
+    """
+    Least squares ellipsoid fit of accelerometer samples
+
+    :param acc: N*3 raw samples in many orientations
+    :param one_g: LSB of 1 G
+    :return: center (3), matrix (3*3), rms error of the corrected norm in G
+    """
+    acc = np.asarray(acc, dtype=np.float64)
+    if len(acc) < MIN_SAMPLES:
+        raise ValueError(f'need at least {MIN_SAMPLES} samples, got {len(acc)}')
+    # work in G, better conditioned
+    x, y, z = (acc / one_g).T
+    design = np.column_stack((x*x, y*y, z*z, 2*x*y, 2*x*z, 2*y*z, 2*x, 2*y, 2*z))
+    v = np.linalg.lstsq(design, np.ones(len(acc)), rcond=None)[0]
+    quadric = np.array([[v[0], v[3], v[4]],
+                        [v[3], v[1], v[5]],
+                        [v[4], v[5], v[2]]])
+    center = -np.linalg.solve(quadric, v[6:9])
+    quadric = quadric / (1 + center @ quadric @ center)
+    eigenvalues, eigenvectors = np.linalg.eigh(quadric)
+    if (eigenvalues <= 0).any():
+        raise ValueError('samples do not cover enough orientations, rotate the device in all 3 axes')
+    matrix = eigenvectors @ np.diag(np.sqrt(eigenvalues)) @ eigenvectors.T
+    corrected = (acc / one_g - center) @ matrix.T
+    rms = np.sqrt(((np.linalg.norm(corrected, axis=1) - 1)**2).mean())
+    return center * one_g, matrix, rms
+
+
+def _parse_list(value):
+    return [float(i.strip()) for i in value.strip("[]").split(",")]
+
+
+class ImuCalibration():
+    """
+    Accelerometer center and matrix, gyro bias
+
+        acc = matrix @ (raw_acc - center)
+        gyro = raw_gyro - gyro_bias
+    """
+
+    def __init__(self, center=(0, 0, 0), matrix=None, gyro_bias=(0, 0, 0)):
+        self.center = np.array(center, dtype=np.float64)
+        self.matrix = np.eye(3) if matrix is None else np.array(matrix, dtype=np.float64).reshape(3, 3)
+        self.gyro_bias = np.array(gyro_bias, dtype=np.float64)
+        # plain lists for the single sample path, faster than numpy on 3 values
+        self._center = self.center.tolist()
+        self._matrix = self.matrix.tolist()
+        self._gyro_bias = self.gyro_bias.tolist()
+        self._bias = np.concatenate((self.center, self.gyro_bias))
+
+    @classmethod
+    def from_offsets(cls, acc_offset, gyro_offset):
+        """
+        Offsets added to raw values, as Pidog._imu_thread computes them at rest
+        """
+        return cls(center=[-v for v in acc_offset], gyro_bias=[-v for v in gyro_offset])
+
+    @classmethod
+    def load(cls, db):
+        """
+        :param db: fileDB
+        :return: ImuCalibration or None if nothing stored
+        """
+        center = db.get(DB_CENTER, None)
+        matrix = db.get(DB_MATRIX, None)
+        if center is None or matrix is None:
+            return None
+        gyro_bias = db.get(DB_GYRO_BIAS, str([0, 0, 0]))
+        try:
+            return cls(_parse_list(center), _parse_list(matrix), _parse_list(gyro_bias))
+        except ValueError:
+            return None
+
+    def save(self, db):
+        db.set(DB_CENTER, str([round(v, 3) for v in self._center]))
+        db.set(DB_MATRIX, str([round(v, 6) for v in self.matrix.flatten().tolist()]))
+        db.set(DB_GYRO_BIAS, str([round(v, 3) for v in self._gyro_bias]))
+
+    def apply(self, acc, gyro):
+        """
+        Calibrate one sample
+
+        :return: acc, gyro lists
+        """
+        a = [acc[0] - self._center[0], acc[1] - self._center[1], acc[2] - self._center[2]]
+        m = self._matrix
+        acc = [m[0][0]*a[0] + m[0][1]*a[1] + m[0][2]*a[2],
+               m[1][0]*a[0] + m[1][1]*a[1] + m[1][2]*a[2],
+               m[2][0]*a[0] + m[2][1]*a[1] + m[2][2]*a[2]]
+        gyro = [gyro[0] - self._gyro_bias[0], gyro[1] - self._gyro_bias[1], gyro[2] - self._gyro_bias[2]]
+        return acc, gyro
+
+    def leveled(self, rest_acc, rest_gyro, one_g=ACC_1G):
+        """
+        Copy with the gyro bias measured now, and the accelerometer rotated so
+        the corrected rest sample reads -1 G on x: the mounting tilt of the
+        startup pose is zeroed as the startup offsets of Pidog do, while the
+        ellipsoid correction (scale and cross-axis) is kept
+
+        :param rest_acc: mean raw acc at rest, 3 values
+        :param rest_gyro: mean raw gyro at rest, 3 values
+        :return: ImuCalibration
+        """
+        a = self.matrix @ (np.asarray(rest_acc, dtype=np.float64) - self.center)
+        a = a / np.linalg.norm(a)
+        b = np.array([-1.0, 0.0, 0.0])
+        v = np.cross(a, b)
+        c = a @ b
+        rotation = np.eye(3)
+        # upside down (c = -1) has no unique rotation, keep the fit as it is
+        if c > -0.99:
+            skew = np.array([[0, -v[2], v[1]],
+                             [v[2], 0, -v[0]],
+                             [-v[1], v[0], 0]])
+            rotation = rotation + skew + skew @ skew / (1 + c)
+        return ImuCalibration(self.center, rotation @ self.matrix, rest_gyro)
+
+    def apply_block(self, block):
+        """
+        Calibrate a block of samples
+
+        :param block: N*6 raw array, eg: from Sh3001.fifo_read
+        :return: N*6 float array
+        """
+        data = block - self._bias
+        data[:, :3] = data[:, :3] @ self.matrix.T
+        return data
+
+
+def calibrate(imu, rest_seconds=2, rotate_seconds=30, db=None):
+    """
+    Full calibration: gyro bias at rest, then accelerometer while rotating
+
+    :param imu: Sh3001 instance
+    :param db: fileDB to store the result in, imu.db if None
+    :return: ImuCalibration
+    """
+    print('Keep the device still ...')
+    rest = collect_samples(imu, rest_seconds)
+    if len(rest) == 0:
+        raise IOError('no imu data')
+    gyro_bias = rest[:, 3:].mean(axis=0)
+
+    print(f'Rotate the device slowly in all 3 axes, {rotate_seconds} seconds')
+    rotate = collect_samples(imu, rotate_seconds,
+                             progress=lambda elapsed, count: print(f'\033[K\r{elapsed:4.0f} s  {count} samples',
+                                                                   end='', flush=True))
+    print('')
+    center, matrix, rms = fit_ellipsoid(np.concatenate((rest[:, :3], rotate[:, :3])))
+    calibration = ImuCalibration(center, matrix, gyro_bias)
+    calibration.save(imu.db if db is None else db)
+    print(f'center: {np.round(center, 1).tolist()}  gyro bias: {np.round(gyro_bias, 2).tolist()}  '
+          f'fit rms: {rms*100:.2f} %')
+    return calibration
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import os
+import ctypes
+import ctypes.util
+
+''' Memory barrier of the lock-free records shared between threads and processes
+
+    Records in shared memory (FrameRing, SensorHub, DistanceRing, ImuBuffer)
+    are published with a commit word, the seq of a slot or a write index,
+    and no lock between the writer and the readers:
+
+        writer:  payload, fence(), commit word
+        reader:  commit word, fence(), payload, fence(), commit word again
+
+    Aligned numpy stores and loads of up to 8 bytes are single accesses, so
+    a commit word is never seen half written. The order of the accesses
+    around it is not guaranteed by Python: ARM cpus reorder stores and
+    loads to different addresses, and a reader could see a new commit word
+    with an old payload. fence() is a full barrier (C11
+    atomic_thread_fence(memory_order_seq_cst) from libatomic), nothing
+    before it is reordered with anything after it.
+
+    Without libatomic, sched_yield() is used: the Linux scheduler runs a
+    full barrier on every call, slower and it may give the cpu away.
+'''
+
+SEQ_CST = 5  # memory_order_seq_cst
+
+
+def _libatomic_fence():
+    name = ctypes.util.find_library('atomic')
+    if name is None:
+        return None
+    try:
+        func = ctypes.CDLL(name).atomic_thread_fence
+    except (OSError, AttributeError):
+        return None
+    func.argtypes = [ctypes.c_int]
+    func.restype = None
+    return lambda: func(SEQ_CST)
+
+
+fence = _libatomic_fence() or os.sched_yield
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+import os
+import threading
+from time import sleep
+from collections import deque
+from multiprocessing import Process, RawArray
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from robot_hat import Servo
+from .stream import DeadlineTimer
+from .memory_barrier import fence
+
+''' MotionProcess: servo output in a dedicated process
+
+    The Pidog process keeps its action buffers and threads, but instead of
+    calling Robot.servo_move they relay keyframes through one FrameRing per
+    part. The motion process interpolates every part at a fixed period, the
+    same way Robot.servo_move does, and acknowledges finished frames, so the
+    servo cadence no longer depends on the GIL of the Pidog process.
+
+    Every servo write goes through the process once it is started, direct
+    frames too (see write() and Pidog.legs_stream), so its positions are
+    always the ones on the servos. The process opens its own servos and
+    I2C bus, the handles of the Pidog process are not shared across fork.
+
+    The process can be pinned to a cpu and run with SCHED_FIFO when the
+    user is allowed to (usually root).
+'''
+
+PARTS = ['legs', 'head', 'tail']
+MAX_CHANNELS = 8
+ANGLE_SCALE = 100  # angles are sent as int16 centidegrees
+
+# compact frame: 32 bytes
+FRAME_DTYPE = np.dtype([
+    ('seq', '<u4'),
+    ('flags', 'u1'),
+    ('speed', 'u1'),
+    ('count', 'u1'),
+    ('pad', 'u1'),
+    ('angles', '<i2', (MAX_CHANNELS,)),
+    ('reserved', '<u4', (2,)),
+])
+FLAG_CLEAR = 0x01  # drop pending frames and stop the current move
+FLAG_WRITE = 0x02  # drop pending frames and write the angles at the next tick
+
+# status slots, written by the motion process only
+STATUS_RUN = 0
+STATUS_TICKS = 1
+STATUS_MISSED = 2
+STATUS_MAX_LATENESS = 3
+STATUS_SUM_LATENESS = 4
+STATUS_SUM_SQUARE_LATENESS = 5
+STATUS_DONE = 6  # + part index, seq of the last finished frame
+STATUS_SIZE = STATUS_DONE + len(PARTS)
+
+
+class FrameRing():
+    """
+    Single producer, single consumer ring of frames in shared memory, lock-free.
+
+    The producer only writes the head index and the slots, the consumer
+    only writes the tail index. The seq of a slot is its commit word,
+    written after the frame: the consumer takes a slot once its seq is
+    the one it expects, and releases it by moving the tail. See
+    memory_barrier.py for the ordering.
+    """
+
+    CACHE_LINE = 64  # head and tail on their own cache line
+    HEAD = 0
+    TAIL = CACHE_LINE // 8
+    SEQ_MASK = 0xFFFFFFFF  # slot seq is 32 bit
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.shm = SharedMemory(create=True, size=2*self.CACHE_LINE + capacity*FRAME_DTYPE.itemsize)
+        self.index = np.ndarray((2*self.CACHE_LINE // 8,), dtype='<u8', buffer=self.shm.buf)
+        self.slots = np.ndarray((capacity,), dtype=FRAME_DTYPE, buffer=self.shm.buf, offset=2*self.CACHE_LINE)
+        self.index[:] = 0
+        self.slots['seq'] = 0
+
+    def __len__(self):
+        return int(self.index[self.HEAD]) - int(self.index[self.TAIL])
+
+    def push(self, angles, speed=50, flags=0):
+        """
+        Producer side
+
+        :return: seq of the frame, 0 if the ring is full
+        """
+        head = int(self.index[self.HEAD])
+        if head - int(self.index[self.TAIL]) >= self.capacity:
+            return 0
+        # the consumer is done with the slot before it is written again
+        fence()
+        slot = self.slots[head % self.capacity]
+        slot['flags'] = flags
+        slot['speed'] = max(0, min(100, int(speed)))
+        slot['count'] = len(angles)
+        slot['angles'][:len(angles)] = np.round(np.asarray(angles, dtype=np.float64)*ANGLE_SCALE)
+        fence()
+        slot['seq'] = (head + 1) & self.SEQ_MASK
+        self.index[self.HEAD] = head + 1
+        return head + 1
+
+    def pop(self):
+        """
+        Consumer side
+
+        :return: (seq, flags, speed, angles) or None if empty
+        """
+        tail = int(self.index[self.TAIL])
+        slot = self.slots[tail % self.capacity]
+        if int(slot['seq']) != (tail + 1) & self.SEQ_MASK:
+            return None
+        fence()
+        frame = (tail + 1, int(slot['flags']), int(slot['speed']),
+                 slot['angles'][:slot['count']].astype(np.float64) / ANGLE_SCALE)
+        fence()
+        self.index[self.TAIL] = tail + 1
+        return frame
+
+    def close(self):
+        del self.index, self.slots
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class MotionProcess():
+
+    PERIOD = 0.01  # second, robot_hat servo_move step time
+    LOOKAHEAD = 4  # frames sent ahead of the one being played
+
+    def __init__(self, robots, max_dps=None, period=PERIOD, cpu=None, priority=None):
+        """
+        :param robots: dict of robot_hat Robot, eg: {'legs': my_dog.legs, ...},
+                       a part mapped to None is only simulated (benchmark)
+        :param max_dps: dict of max degrees per second of every part
+        :param period: servo output period, second
+        :param cpu: cpu index to pin the process to, None for no affinity
+        :param priority: SCHED_FIFO priority 1-99, None for the default scheduler
+        """
+        self.robots = robots
+        self.max_dps = max_dps or {}
+        self.period = period
+        self.cpu = cpu
+        self.priority = priority
+        self.rings = {part: FrameRing() for part in PARTS}
+        self.locks = {part: threading.Lock() for part in PARTS}
+        self.sent = {part: 0 for part in PARTS}
+        self.status = RawArray('d', STATUS_SIZE)
+        # servo offsets of every part, can be changed while running, see set_offset
+        self.offsets = RawArray('d', len(PARTS)*MAX_CHANNELS)
+        for part, robot in robots.items():
+            if robot is not None:
+                self.set_offset(part, robot.offset)
+        self.process = None
+
+    # Pidog process side
+    # =================================================================
+    def start(self):
+        self.status[STATUS_RUN] = 1
+        self.process = Process(name='motion_process', target=self._run)
+        self.process.daemon = True
+        self.process.start()
+
+    def send(self, part, angles, speed=50):
+        """
+        Queue a keyframe, blocks while the ring is full
+
+        :return: seq of the frame
+        """
+        with self.locks[part]:
+            seq = self.rings[part].push(angles, speed)
+            while seq == 0:
+                sleep(self.period)
+                seq = self.rings[part].push(angles, speed)
+            self.sent[part] = seq
+        return seq
+
+    def write(self, part, angles):
+        """
+        Write angles at the next tick without interpolation, the frames not
+        played yet are dropped. Several writes within a tick, only the last
+        one is written. Blocks while the ring is full.
+
+        :param angles: angles list, without offsets
+        :return: seq of the frame
+        """
+        return self._push(part, angles, flags=FLAG_WRITE)
+
+    def clear(self, part):
+        """
+        Drop the frames of a part which are not played yet, the current move stops at once
+        """
+        return self._push(part, [], flags=FLAG_CLEAR)
+
+    def _push(self, part, angles, flags):
+        with self.locks[part]:
+            seq = self.rings[part].push(angles, flags=flags)
+            while seq == 0:
+                sleep(self.period)
+                seq = self.rings[part].push(angles, flags=flags)
+            self.sent[part] = seq
+        return seq
+
+    def set_offset(self, part, offset):
+        """
+        :param offset: servo offsets of a part, eg: robot.offset after set_offset()
+        """
+        start = PARTS.index(part)*MAX_CHANNELS
+        self.offsets[start:start+len(offset)] = [float(value) for value in offset]
+
+    def done(self, part):
+        return int(self.status[STATUS_DONE + PARTS.index(part)])
+
+    def pending(self, part):
+        """
+        Number of frames of a part sent but not finished yet
+        """
+        return self.sent[part] - self.done(part)
+
+    def stats(self):
+        ticks = self.status[STATUS_TICKS]
+        mean = self.status[STATUS_SUM_LATENESS] / ticks if ticks else 0.0
+        square = self.status[STATUS_SUM_SQUARE_LATENESS] / ticks if ticks else 0.0
+        return {
+            'ticks': int(ticks),
+            'missed': int(self.status[STATUS_MISSED]),
+            'max_lateness': self.status[STATUS_MAX_LATENESS],
+            'mean_lateness': mean,
+            'std_lateness': max(0.0, square - mean*mean) ** 0.5,
+        }
+
+    def close(self):
+        self.status[STATUS_RUN] = 0
+        if self.process is not None:
+            self.process.join(1)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+        for ring in self.rings.values():
+            ring.close()
+
+    # motion process side
+    # =================================================================
+    def _setup_realtime(self):
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})
+            except (AttributeError, OSError) as e:
+                print(f'\rmotion_process: cpu affinity not set: {e}')
+        if self.priority is not None:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+            except (AttributeError, PermissionError, OSError) as e:
+                print(f'\rmotion_process: SCHED_FIFO not set: {e}')
+
+    def _open_servos(self):
+        """
+        New robot_hat Servo objects on the same channels, opened in the
+        motion process with their own I2C bus
+        """
+        servos = {}
+        for part, robot in self.robots.items():
+            if robot is not None:
+                servos[part] = [Servo(servo.channel) for servo in robot.servo_list]
+        return servos
+
+    def _write(self, servos, index, positions):
+        # same as Robot.servo_write_all, with the offsets shared with the Pidog process
+        start = index*MAX_CHANNELS
+        for servo, angle, offset in zip(servos, positions, self.offsets[start:start+len(servos)]):
+            servo.angle(angle + offset)
+
+    def _run(self):
+        self._setup_realtime()
+        status = self.status
+        timer = DeadlineTimer(self.period, spin=DeadlineTimer.SPIN_TIME)
+        step_time = self.period * 1000  # ms
+        servos = self._open_servos()
+
+        states = {}
+        for part in PARTS:
+            robot = self.robots.get(part)
+            positions = list(robot.servo_positions) if robot is not None else []
+            states[part] = {
+                'pending': deque(),
+                'positions': np.array(positions, dtype=np.float64),
+                'step': None,
+                'steps': 0,
+                'seq': 0,
+                'write': False,
+            }
+
+        while status[STATUS_RUN]:
+            for index, part in enumerate(PARTS):
+                state = states[part]
+                ring = self.rings[part]
+                frame = ring.pop()
+                while frame is not None:
+                    seq, flags, speed, angles = frame
+                    if flags & (FLAG_CLEAR | FLAG_WRITE):
+                        state['pending'].clear()
+                        state['steps'] = 0
+                        status[STATUS_DONE + index] = seq
+                        if flags & FLAG_WRITE:
+                            state['positions'] = np.array(angles, dtype=np.float64)
+                            state['write'] = True
+                    else:
+                        state['pending'].append(frame)
+                    frame = ring.pop()
+
+                if state['steps'] == 0 and len(state['pending']) > 0:
+                    seq, _, speed, angles = state['pending'].popleft()
+                    if len(state['positions']) != len(angles):
+                        state['positions'] = np.array(angles, dtype=np.float64)
+                    # same interpolation as robot_hat Robot.servo_move
+                    delta = angles - state['positions']
+                    max_delta = np.abs(delta).max(initial=0)
+                    total_time = -9.9 * speed + 1000
+                    max_dps = self.max_dps.get(part)
+                    if max_dps and max_delta / total_time * 1000 > max_dps:
+                        total_time = max_delta / max_dps * 1000
+                    state['steps'] = max(1, int(total_time / step_time))
+                    state['step'] = delta / state['steps']
+                    state['seq'] = seq
+
+                if state['steps'] > 0:
+                    state['positions'] += state['step']
+                    state['steps'] -= 1
+                    state['write'] = True
+                    if state['steps'] == 0:
+                        status[STATUS_DONE + index] = state['seq']
+
+                if state['write']:
+                    state['write'] = False
+                    if part in servos:
+                        self._write(servos[part], index, state['positions'].tolist())
+
+            lateness = timer.wait()
+            status[STATUS_TICKS] += 1
+            status[STATUS_SUM_LATENESS] += lateness
+            status[STATUS_SUM_SQUARE_LATENESS] += lateness*lateness
+            if lateness > 0:
+                status[STATUS_MISSED] = timer.missed
+                status[STATUS_MAX_LATENESS] = max(status[STATUS_MAX_LATENESS], lateness)
@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import os
 import sys
-from time import sleep, time
-from multiprocessing import Process, Value, Lock
+import pwd
+from time import sleep, time, perf_counter, thread_time
+from multiprocessing import Process, Value, Lock, RawArray, Event
 import threading
 import numpy as np
 from math import pi, sin, cos, sqrt, acos, atan2, atan
@@ -11,6 +12,15 @@ from .sh3001 import Sh3001
 from .rgb_strip import RGBStrip
 from .sound_direction import SoundDirection
 from .dual_touch import DualTouch
+from . import trajectory
+from .stream import ServoStream, DeadlineTimer
+from .motion_process import MotionProcess
+from .attitude import AttitudeEstimator
+from .imu_buffer import ImuBuffer
+from .imu_calibration import ImuCalibration
+from .sensor_hub import SensorHub
+from .distance_ring import DistanceRing, DistanceFilter
+from .audio_engine import AudioEngine
 import warnings
 warnings.filterwarnings("ignore") # ignore warnings for pygame # not work
 
@@ -40,8 +50,11 @@ warnings.filterwarnings("ignore") # ignore warnings for pygame # not work
 
 # user and User home directory
 is_run_with_root = (os.geteuid() == 0)
-User = os.popen('echo ${SUDO_USER:-$LOGNAME}').readline().strip()
-UserHome = os.popen('getent passwd %s | cut -d: -f 6' %User).readline().strip()
+User = os.environ.get('SUDO_USER') or os.environ.get('LOGNAME') or pwd.getpwuid(os.getuid()).pw_name
+try:
+    UserHome = pwd.getpwnam(User).pw_dir
+except KeyError:
+    UserHome = os.path.expanduser('~')
 config_file = '%s/.config/pidog/pidog.conf' % UserHome
 
 # color:
@@ -97,6 +110,8 @@ class Pidog():
         [-BODY_WIDTH / 2,  BODY_LENGTH / 2,  0],
         [BODY_WIDTH / 2,  BODY_LENGTH / 2,  0]]).T
     SOUND_DIR = f"{UserHome}/pidog/sounds/"
+    SOUND_CACHE_DIR = f"{UserHome}/.cache/pidog/sounds/"  # decoded sounds
+    AUDIO_PRELOAD = True  # decode the sounds of SOUND_DIR in the background at startup
     # Servo Speed
     # HEAD_DPS = 300
     # LEGS_DPS = 350
@@ -116,6 +131,32 @@ class Pidog():
 
     HEAD_PITCH_OFFSET = 45
 
+    # IMU, sh3001 output data rate and the fraction of it read by the imu thread
+    IMU_ODR = 500
+    IMU_RATE_DIVIDER = 5  # 100 Hz
+    # read every sample from the sh3001 fifo in one burst per tick, instead of one sample per tick,
+    # off by default: the fifo register layout is not verified on hardware yet
+    IMU_FIFO = False
+    IMU_FIFO_MAX_EMPTY = 10  # consecutive empty reads before falling back to single reads
+    # a stored calibration is used at once, and leveled on the first rest samples
+    IMU_LEVEL_SAMPLES = 50
+    IMU_REST_GYRO = 3 * 16.384  # LSB (3 dps), largest gyro deviation from the mean at rest
+
+    # ultrasonic filter, applied in the sensory process
+    DISTANCE_MEDIAN_WINDOW = 5  # readings
+    DISTANCE_EWMA_ALPHA = 0.5  # 1 for median only
+
+    # motion state, shared with the sensory process to adapt the ultrasonic rate
+    MOTION_IDLE = 0
+    MOTION_MOVING = 1
+    MOTION_FORWARD = 2
+    MOTION_STATES = ['idle', 'moving', 'forward']
+    FORWARD_ACTIONS = ['forward', 'trot']
+    # ultrasonic read period of every motion state, second
+    DISTANCE_PERIODS = [0.1, 0.04, 0.01]
+    ULTRASONIC_TIMEOUT = 0.017  # second, longest read
+    DISTANCE_STATE_POLL = 0.01  # second, a faster state is noticed within this time
+
     HEAD_YAW_MIN = -90
     HEAD_YAW_MAX = 90
     HEAD_ROLL_MIN = -70
@@ -125,7 +166,8 @@ class Pidog():
 
     # init
     def __init__(self, leg_pins=DEFAULT_LEGS_PINS, head_pins=DEFAULT_HEAD_PINS, tail_pin=DEFAULT_TAIL_PIN,
-                 leg_init_angles=None, head_init_angles=None, tail_init_angle=None):
+                 leg_init_angles=None, head_init_angles=None, tail_init_angle=None,
+                 motion_process=False, motion_cpu=None, motion_priority=None):
 
 
         utils.reset_mcu()
@@ -163,6 +205,9 @@ class Pidog():
             tail_init_angle = [0]
 
         self.thread_list = []
+        self.motion_process = None
+        # latest sample of every sensor, shared with the sensory process
+        self.sensors = SensorHub()
 
         try:
             debug(f"config_file: {config_file}")
@@ -191,13 +236,29 @@ class Pidog():
             self.legs_actions_coords_buffer = []
 
             self.leg_current_angles = leg_init_angles
-            self.head_current_angles = head_init_angles
+            # raw angles, as in the head buffer, the pitch offset is added on the way to the servos
+            self.head_current_angles = [head_init_angles[0], head_init_angles[1],
+                                        head_init_angles[2] - self.HEAD_PITCH_OFFSET]
             self.tail_current_angles = tail_init_angle
 
             self.legs_speed = 90
             self.head_speed = 90
             self.tail_speed = 90
 
+            self.legs_simple_stream = None
+
+            self.legs_moving = False
+            self.head_moving = False
+            self.tail_moving = False
+
+            # servo output in a dedicated process
+            if motion_process:
+                self.motion_process = MotionProcess(
+                    robots={'legs': self.legs, 'head': self.head, 'tail': self.tail},
+                    max_dps={'legs': self.LEGS_DPS, 'head': self.HEAD_DPS, 'tail': self.TAIL_DPS},
+                    cpu=motion_cpu, priority=motion_priority)
+                self.motion_process.start()
+
             # done
             debug("done")
         except OSError:
@@ -212,6 +273,12 @@ class Pidog():
             self.accData = [0, 0, 0]  # ax,ay,az
             self.gyroData = [0, 0, 0]  # gx,gy,gz
             self.imu_fail_count = 0
+            self.attitude = AttitudeEstimator()
+            self.imu_buffer = ImuBuffer()
+            # stored ellipsoid calibration (Sh3001.acc_calibrate_cmd), None to calibrate at startup
+            self.imu_calibration = ImuCalibration.load(self.imu.db)
+            self.yaw_rate = 0
+            self.imu_cpu_usage = 0
             # add imu thread
             self.thread_list.append("imu")
             debug("done")
@@ -232,7 +299,13 @@ class Pidog():
 
         try:
             debug("dual_touch init ... ", end='', flush=True)
-            self.dual_touch = DualTouch('D2', 'D3')
+            self.dual_touch = DualTouch('D2', 'D3', publish=self.sensors.publish)
+            try:
+                # gestures from the pad edges, read() returns them
+                self.dual_touch.start_events()
+            except Exception as e:
+                self.dual_touch.stop_events()
+                warn(f"dual_touch event mode not available, polling: {e}")
             self.touch = 'N'
             debug("done")
         except:
@@ -240,7 +313,13 @@ class Pidog():
 
         try:
             debug("sound_direction init ... ", end='', flush=True)
-            self.ears = SoundDirection()
+            self.ears = SoundDirection(publish=self.sensors.publish)
+            try:
+                # directions are read on the busy edge and queued, isdetected() / read() use the queue
+                self.ears.start_events()
+            except Exception as e:
+                self.ears.stop_events()
+                warn(f"sound_direction event mode not available, polling: {e}")
             # self.sound_direction = -1
             debug("done")
         except:
@@ -248,23 +327,96 @@ class Pidog():
 
         try:
             debug("sound_effect init ... ", end='', flush=True)
+            # opened before Music, the mixer keeps the low latency settings of the engine
+            self.audio = AudioEngine(self.SOUND_DIR, self.SOUND_CACHE_DIR)
+            self.audio.open()
             self.music = Music()
+            if self.AUDIO_PRELOAD:
+                threading.Thread(name='audio_preload_thread', target=self.audio.preload, daemon=True).start()
             debug("done")
         except:
             error("fail")
 
         self.distance = Value('f', -1.0)
+        self.distance_ring = DistanceRing()
+        self.legs_action_name = None
+        self.motion_state = Value('i', self.MOTION_IDLE, lock=False)
+        # per motion state: reads, read seconds, wall seconds
+        self.distance_rate_stats_array = RawArray('d', 3*len(self.MOTION_STATES))
 
         self.sensory_process = None
         self.sensory_lock = Lock()
+        self.sensory_stop = Event()
 
         self.exit_flag = False
         self.action_threads_start()
         self.sensory_process_start()
 
     def read_distance(self):
+        """
+        Filtered distance in cm, -1 if there are not enough valid readings
+        """
         return round(self.distance.value, 2)
 
+    def read_distance_sample(self):
+        """
+        Latest ultrasonic sample
+
+        :return: DistanceSample(timestamp, raw, filtered, flags) or None, see distance_ring
+        """
+        return self.distance_ring.latest()
+
+    def read_distance_age(self):
+        """
+        Seconds since the latest ultrasonic sample, None if there is none
+        """
+        return self.distance_ring.age()
+
+    def distance_max_age(self):
+        """
+        Longest possible age of the latest ultrasonic sample in the current motion state, second
+        """
+        return self.DISTANCE_PERIODS[self.motion_state.value] + self.ULTRASONIC_TIMEOUT + self.DISTANCE_STATE_POLL
+
+    def distance_rate_stats(self):
+        """
+        Cost of the ultrasonic reads in every motion state
+
+        :return: dict of state name: dict of period, reads, rate (Hz), read_time (mean, second),
+                 duty (fraction of the time spent reading, busy waiting on the echo pin)
+        """
+        stats = {}
+        array = self.distance_rate_stats_array
+        for i, name in enumerate(self.MOTION_STATES):
+            reads, read_time, wall_time = array[3*i:3*i + 3]
+            stats[name] = {
+                'period': self.DISTANCE_PERIODS[i],
+                'reads': int(reads),
+                'rate': reads / wall_time if wall_time else 0.0,
+                'read_time': read_time / reads if reads else 0.0,
+                'duty': read_time / wall_time if wall_time else 0.0,
+            }
+        return stats
+
+    def _update_motion_state(self):
+        busy = len(self.legs_action_buffer) > 0 or self.legs_moving or self._motion_pending('legs')
+        if not busy:
+            state = self.MOTION_IDLE
+        elif self.legs_action_name in self.FORWARD_ACTIONS:
+            state = self.MOTION_FORWARD
+        else:
+            state = self.MOTION_MOVING
+        if state != self.motion_state.value:
+            self.motion_state.value = state
+
+    def distance_history(self, seconds):
+        """
+        Ultrasonic samples of the last seconds, oldest first
+
+        :return: structured array, fields: timestamp, raw, filtered, flags
+        """
+        return self.distance_ring.since(perf_counter() - seconds)
+
     # action related: legs,head,tail,imu,rgb_strip
     def close_all_thread(self):
         self.exit_flag = True
@@ -305,8 +457,18 @@ class Pidog():
                 self.rgb_strip.close()
             if 'imu' in self.thread_list:
                 self.imu_thread.join()
-            if self.sensory_process != None:
-                self.sensory_process.terminate()
+            self.sensory_process_stop()
+            if self.motion_process != None:
+                self.motion_process.close()
+            # no edge callback or event thread publishes into the closed hub
+            if hasattr(self, 'dual_touch'):
+                self.dual_touch.stop_events()
+            if hasattr(self, 'ears'):
+                self.ears.stop_events()
+            self.sensors.close()
+            self.distance_ring.close()
+            if hasattr(self, 'audio'):
+                self.audio.close()
 
             info('Quit')
         except Exception as e:
@@ -317,9 +479,10 @@ class Pidog():
             sys.exit(0)
 
     def legs_simple_move(self, angles_list, speed=90):
-
-        tt = time()
-
+        """
+        Write legs angles directly and wait for the next deadline of a fixed period,
+        the period is derived from speed, see legs_stream for the stream itself
+        """
         max_delay = 0.05
         min_delay = 0.005
 
@@ -328,19 +491,28 @@ class Pidog():
         elif speed < 0:
             speed = 0
 
-        delay = (100 - speed) / 100*(max_delay - min_delay) + min_delay
+        period = (100 - speed) / 100*(max_delay - min_delay) + min_delay
 
-        rel_angles_list = []
-        for i in range(len(angles_list)):
-            rel_angles_list.append(angles_list[i] + self.legs.offset[i])
-        self.legs.servo_write_raw(rel_angles_list)
-
-        tt2 = time() - tt
-        delay2 = 0.001*len(angles_list) - tt2
+        if self.legs_simple_stream is None:
+            self.legs_simple_stream = self.legs_stream(period)
+        else:
+            timer = self.legs_simple_stream.timer
+            timer.set_period(period)
+            # idle for more than a period since the last frame, not a missed deadline
+            if timer.deadline is not None and perf_counter() - timer.deadline > period:
+                timer.restart()
+        self.legs_simple_stream.write(angles_list)
+
+    def legs_stream(self, period=0.01, catch_up=False):
+        """
+        Fixed period stream of legs frames driven by absolute deadlines
 
-        if delay2 < -delay:
-            delay2 = -delay
-        sleep(delay + delay2)
+        :param period: period in second
+        :param catch_up: keep the original schedule after a missed deadline
+        :return: ServoStream, call write(angles) for every frame, stats() for missed deadlines
+        """
+        return ServoStream(self.legs, period, catch_up=catch_up,
+                           motion_process=self.motion_process, part='legs', spin=DeadlineTimer.SPIN_TIME)
 
     def legs_switch(self, flag=False):
         self.legs_sw_flag = flag
@@ -348,16 +520,28 @@ class Pidog():
     def action_threads_start(self):
         # Immutable objects int, float, string, tuple, etc., need to be declared with global
         # Variable object lists, dicts, instances of custom classes, etc., do not need to be declared with global
+        if self.motion_process != None:
+            # keyframes are relayed to the motion process
+            if 'legs' in self.thread_list:
+                self.legs_thread = threading.Thread(name='legs_thread', target=self._relay_action_thread, args=('legs',))
+            if 'head' in self.thread_list:
+                self.head_thread = threading.Thread(name='head_thread', target=self._relay_action_thread, args=('head',))
+            if 'tail' in self.thread_list:
+                self.tail_thread = threading.Thread(name='tail_thread', target=self._relay_action_thread, args=('tail',))
+        else:
+            if 'legs' in self.thread_list:
+                self.legs_thread = threading.Thread(name='legs_thread', target=self._legs_action_thread)
+            if 'head' in self.thread_list:
+                self.head_thread = threading.Thread(name='head_thread', target=self._head_action_thread)
+            if 'tail' in self.thread_list:
+                self.tail_thread = threading.Thread(name='tail_thread', target=self._tail_action_thread)
         if 'legs' in self.thread_list:
-            self.legs_thread = threading.Thread(name='legs_thread', target=self._legs_action_thread)
             self.legs_thread.daemon = True
             self.legs_thread.start()
         if 'head' in self.thread_list:
-            self.head_thread = threading.Thread(name='head_thread', target=self._head_action_thread)
             self.head_thread.daemon = True
             self.head_thread.start()
         if 'tail' in self.thread_list:
-            self.tail_thread = threading.Thread(name='tail_thread', target=self._tail_action_thread)
             self.tail_thread.daemon = True
             self.tail_thread.start()
         if 'rgb' in self.thread_list:
@@ -373,10 +557,13 @@ class Pidog():
     def _legs_action_thread(self):
         while not self.exit_flag:
             try:
+                self._update_motion_state()
                 with self.legs_thread_lock:
                     self.leg_current_angles = list.copy(self.legs_action_buffer[0])
                 # Release lock after copying data before the next operations
+                self.legs_moving = True
                 self.legs.servo_move(self.leg_current_angles, self.legs_speed)
+                self.legs_moving = False
                 with self.legs_thread_lock:
                     self.legs_action_buffer.pop(0)
             except IndexError:
@@ -392,19 +579,26 @@ class Pidog():
                 with self.head_thread_lock:
                     self.head_current_angles = list.copy(self.head_action_buffer[0])
                     self.head_action_buffer.pop(0)
+                    # with the pop, the frame is never out of the buffer and not moving
+                    self.head_moving = True
                 # Release lock after copying data before the next operations
-                _angles = list.copy(self.head_current_angles)
-                _angles[0] = self.limit(self.HEAD_YAW_MIN, self.HEAD_YAW_MAX, _angles[0])
-                _angles[1] = self.limit(self.HEAD_ROLL_MIN, self.HEAD_ROLL_MAX, _angles[1])
-                _angles[2] = self.limit(self.HEAD_PITCH_MIN, self.HEAD_PITCH_MAX, _angles[2])
-                _angles[2] += self.HEAD_PITCH_OFFSET
+                _angles = self._head_servo_angles(self.head_current_angles)
                 self.head.servo_move(_angles, self.head_speed)
+                self.head_moving = False
             except IndexError:
                 sleep(0.001)
             except Exception as e:
                 error(f'\r_head_action_thread Exception:{e}')
                 break
 
+    def _head_servo_angles(self, angles):
+        _angles = list.copy(angles)
+        _angles[0] = self.limit(self.HEAD_YAW_MIN, self.HEAD_YAW_MAX, _angles[0])
+        _angles[1] = self.limit(self.HEAD_ROLL_MIN, self.HEAD_ROLL_MAX, _angles[1])
+        _angles[2] = self.limit(self.HEAD_PITCH_MIN, self.HEAD_PITCH_MAX, _angles[2])
+        _angles[2] += self.HEAD_PITCH_OFFSET
+        return _angles
+
     # tail
     def _tail_action_thread(self):
         while not self.exit_flag:
@@ -412,14 +606,50 @@ class Pidog():
                 with self.tail_thread_lock:
                     self.tail_current_angles = list.copy(self.tail_action_buffer[0])
                     self.tail_action_buffer.pop(0)
+                    # with the pop, the frame is never out of the buffer and not moving
+                    self.tail_moving = True
                 # Release lock after copying data before the next operations
                 self.tail.servo_move(self.tail_current_angles, self.tail_speed)
+                self.tail_moving = False
             except IndexError:
                 sleep(0.001)
             except Exception as e:
                 error(f'\r_tail_action_thread Exception:{e}')
                 break
 
+    # relay keyframes to the motion process
+    def _relay_action_thread(self, part):
+        buffer = getattr(self, f'{part}_action_buffer')
+        lock = getattr(self, f'{part}_thread_lock')
+        while not self.exit_flag:
+            try:
+                if part == 'legs':
+                    self._update_motion_state()
+                if self.motion_process.pending(part) >= self.motion_process.LOOKAHEAD:
+                    sleep(0.001)
+                    continue
+                # hold the lock until sent, so a stop can not slip in between,
+                # and pop once sent, so the frame is always in the buffer or pending
+                with lock:
+                    angles = list.copy(buffer[0])
+                    if part == 'legs':
+                        self.leg_current_angles = angles
+                    elif part == 'head':
+                        self.head_current_angles = angles
+                        angles = self._head_servo_angles(angles)
+                    else:
+                        self.tail_current_angles = angles
+                    self.motion_process.send(part, angles, getattr(self, f'{part}_speed'))
+                    buffer.pop(0)
+            except IndexError:
+                sleep(0.001)
+            except Exception as e:
+                error(f'\r_relay_action_thread ({part}) Exception:{e}')
+                break
+
+    def _motion_pending(self, part):
+        return self.motion_process != None and self.motion_process.pending(part) > 0
+
     # rgb strip
     def _rgb_strip_thread(self):
         while self.rgb_thread_run:
@@ -435,8 +665,8 @@ class Pidog():
 
     # IMU
 
-    def _imu_thread(self):
-        # imu calibrate
+    def _imu_startup_calibrate(self):
+        # offsets at rest, ax = -1G
         _ax = 0
         _ay = 0
         _az = 0
@@ -464,33 +694,106 @@ class Pidog():
         self.imu_gyro_offset[0] = round(0 - _gx/time, 0)
         self.imu_gyro_offset[1] = round(0 - _gy/time, 0)
         self.imu_gyro_offset[2] = round(0 - _gz/time, 0)
+        return ImuCalibration.from_offsets(self.imu_acc_offset, self.imu_gyro_offset)
+
+    def _imu_level(self, calibration, rest, raw):
+        # collect raw samples, then level the stored calibration on this pose
+        # and measure the gyro bias again, see ImuCalibration.leveled
+        # :return: calibration, rest samples or None once leveled
+        rest.extend(raw)
+        if len(rest) < self.IMU_LEVEL_SAMPLES:
+            return calibration, rest
+        block = np.array(rest[:self.IMU_LEVEL_SAMPLES], dtype=np.float64)
+        mean = block.mean(axis=0)
+        if np.abs(block[:, 3:] - mean[3:]).max() > self.IMU_REST_GYRO:
+            # not at rest, try again on the next samples
+            return calibration, []
+        calibration = calibration.leveled(mean[:3], mean[3:])
+        self.imu_acc_offset = (-calibration.center).tolist()
+        self.imu_gyro_offset = (-calibration.gyro_bias).tolist()
+        return calibration, None
+
+    def _imu_thread(self):
+        if self.imu_calibration is None:
+            calibration = self._imu_startup_calibrate()
+            rest = None
+        else:
+            # no blocking rest step, leveled in the loop (_imu_level)
+            calibration = self.imu_calibration
+            rest = []
 
+        use_fifo = self.IMU_FIFO
+        if use_fifo:
+            try:
+                self.imu.fifo_init()
+            except Exception as e:
+                warn(f'\r_imu_thread fifo init failed, single reads: {e}')
+                use_fifo = False
+        fifo_empty = 0
+        sample_time = 1 / self.IMU_ODR
+
+        timer = DeadlineTimer(self.IMU_RATE_DIVIDER / self.IMU_ODR)
+        cpu_start = thread_time()
+        wall_start = perf_counter()
         while not self.exit_flag:
             try:
+                if use_fifo:
+                    samples = self.imu.fifo_read()
+                    timestamp = perf_counter()
+                    count = len(samples)
+                    if count == 0:
+                        fifo_empty += 1
+                        if fifo_empty > self.IMU_FIFO_MAX_EMPTY:
+                            warn('\r_imu_thread fifo stays empty, single reads')
+                            use_fifo = False
+                        timer.wait()
+                        continue
+                    fifo_empty = 0
+                    if rest is not None:
+                        calibration, rest = self._imu_level(calibration, rest, samples.tolist())
+                    # oldest first, the last sample is the newest one
+                    rows = calibration.apply_block(samples).tolist()
+                    for i, row in enumerate(rows):
+                        sample_timestamp = timestamp - (count - 1 - i)*sample_time
+                        self.pitch, self.roll = self.attitude.update(row[:3], row[3:], sample_timestamp)
+                        self.imu_buffer.push(sample_timestamp, row[:3], row[3:], self.pitch, self.roll)
+                    self.accData = rows[-1][:3]
+                    self.gyroData = rows[-1][3:]
+                    self.yaw_rate = self.attitude.yaw_rate
+                    self.sensors.publish('imu', rows[-1] + [self.pitch, self.roll], timestamp)
+                    if timestamp - wall_start >= 1:
+                        self.imu_cpu_usage = (thread_time() - cpu_start) / (timestamp - wall_start)
+                        cpu_start = thread_time()
+                        wall_start = timestamp
+                    self.imu_fail_count = 0
+                    timer.wait()
+                    continue
+
                 data = self.imu._sh3001_getimudata()
+                timestamp = perf_counter()
                 if data == False:
                     self.imu_fail_count += 1
                     if self.imu_fail_count > 10:
                         error('\r_imu_thread imu data error')
                         break
-                self.accData, self.gyroData = data
-                self.accData[0] += self.imu_acc_offset[0]
-                self.accData[1] += self.imu_acc_offset[1]
-                self.accData[2] += self.imu_acc_offset[2]
-                self.gyroData[0] += self.imu_gyro_offset[0]
-                self.gyroData[1] += self.imu_gyro_offset[1]
-                self.gyroData[2] += self.imu_gyro_offset[2]
-                ax = self.accData[0]
-                ay = self.accData[1]
-                az = self.accData[2]
-                ay = -ay
-                az = -az
-
-                self.pitch = atan(ay/sqrt(ax*ax+az*az))*57.2957795
-                self.roll = atan(az/sqrt(ax*ax+ay*ay))*57.2957795
+                if rest is not None:
+                    calibration, rest = self._imu_level(calibration, rest, [data[0] + data[1]])
+                self.accData, self.gyroData = calibration.apply(*data)
+
+                # gyro + accelerometer fusion, with the real dt of every sample
+                self.pitch, self.roll = self.attitude.update(self.accData, self.gyroData, timestamp)
+                self.yaw_rate = self.attitude.yaw_rate
+                self.imu_buffer.push(timestamp, self.accData, self.gyroData, self.pitch, self.roll)
+                self.sensors.publish('imu', self.accData + self.gyroData + [self.pitch, self.roll], timestamp)
+
+                # cpu usage of this thread, updated every second
+                if timestamp - wall_start >= 1:
+                    self.imu_cpu_usage = (thread_time() - cpu_start) / (timestamp - wall_start)
+                    cpu_start = thread_time()
+                    wall_start = timestamp
 
                 self.imu_fail_count = 0
-                sleep(0.05)
+                timer.wait()
             except Exception as e:
                 self.imu_fail_count += 1
                 sleep(0.001)
@@ -503,16 +806,23 @@ class Pidog():
     def legs_stop(self):
         with self.legs_thread_lock:
             self.legs_action_buffer.clear()
+            self.legs_action_name = None
+            if self.motion_process != None:
+                self.motion_process.clear('legs')
         self.wait_legs_done()
 
     def head_stop(self):
         with self.head_thread_lock:
             self.head_action_buffer.clear()
+            if self.motion_process != None:
+                self.motion_process.clear('head')
         self.wait_head_done()
 
     def tail_stop(self):
         with self.tail_thread_lock:
             self.tail_action_buffer.clear()
+            if self.motion_process != None:
+                self.motion_process.clear('tail')
         self.wait_tail_done()
 
     def body_stop(self):
@@ -520,12 +830,28 @@ class Pidog():
         self.head_stop()
         self.tail_stop()
 
+    def body_clear(self):
+        """
+        Clear the buffers of all parts at once, without waiting
+        """
+        with self.legs_thread_lock, self.head_thread_lock, self.tail_thread_lock:
+            self.legs_action_buffer.clear()
+            self.legs_action_name = None
+            self.head_action_buffer.clear()
+            self.tail_action_buffer.clear()
+            if self.motion_process != None:
+                self.motion_process.clear('legs')
+                self.motion_process.clear('head')
+                self.motion_process.clear('tail')
+
     # move
     def legs_move(self, target_angles, immediately=True, speed=50):
         if immediately == True:
             self.legs_stop()
         self.legs_speed = speed
         with self.legs_thread_lock:
+            # not a preset action, set again by do_action
+            self.legs_action_name = None
             self.legs_action_buffer += target_angles
         
     def head_rpy_to_angle(self, target_yrp, roll_comp=0, pitch_comp=0):
@@ -562,14 +888,80 @@ class Pidog():
         with self.tail_thread_lock:
             self.tail_action_buffer += target_angles
         
+    # smooth move
+    def _plan_move(self, buffer, lock, current, target_angles, duration, max_dps, profile, immediately):
+        with lock:
+            if not immediately and len(buffer) > 0:
+                start = buffer[-1]
+            else:
+                start = current
+        return trajectory.plan(start, target_angles, duration=duration,
+                               max_dps=max_dps, profile=profile).tolist()
+
+    def legs_move_smooth(self, target_angles, duration=None, profile='min_jerk', immediately=True):
+        """
+        Move legs through keyframes along a minimum-jerk or trapezoidal profile,
+        frames are emitted at trajectory.FRAME_RATE and never exceed LEGS_DPS
+
+        :param target_angles: keyframes, n*8 list
+        :param duration: total duration in second, None for as fast as LEGS_DPS allows
+        :param profile: 'min_jerk' or 'trapezoid'
+        :param immediately: clear the buffer first
+        """
+        if immediately == True:
+            self.legs_stop()
+        frames = self._plan_move(self.legs_action_buffer, self.legs_thread_lock, self.leg_current_angles,
+                                 target_angles, duration, self.LEGS_DPS, profile, immediately)
+        self.legs_move(frames, immediately=False, speed=100)
+
+    def head_move_smooth(self, target_angles, duration=None, profile='min_jerk', immediately=True):
+        """
+        Same as legs_move_smooth, with raw head angles (see head_move_raw) and HEAD_DPS
+        """
+        if immediately == True:
+            self.head_stop()
+        frames = self._plan_move(self.head_action_buffer, self.head_thread_lock, self.head_current_angles,
+                                 target_angles, duration, self.HEAD_DPS, profile, immediately)
+        self.head_move_raw(frames, immediately=False, speed=100)
+
+    def tail_move_smooth(self, target_angles, duration=None, profile='min_jerk', immediately=True):
+        """
+        Same as legs_move_smooth, for tail with TAIL_DPS
+        """
+        if immediately == True:
+            self.tail_stop()
+        frames = self._plan_move(self.tail_action_buffer, self.tail_thread_lock, self.tail_current_angles,
+                                 target_angles, duration, self.TAIL_DPS, profile, immediately)
+        self.tail_move(frames, immediately=False, speed=100)
+
     # ultrasonic
     def _ultrasonic_thread(self, distance_addr, lock):
-        while True:
+        distance_filter = DistanceFilter(median_window=self.DISTANCE_MEDIAN_WINDOW,
+                                         ewma_alpha=self.DISTANCE_EWMA_ALPHA)
+        stats = self.distance_rate_stats_array
+        while not self.sensory_stop.is_set():
             try:
+                state = self.motion_state.value
+                start = perf_counter()
+                raw = round(float(self.ultrasonic.read()), 2)
+                timestamp = perf_counter()
+                val, flags = distance_filter.update(raw)
+                self.distance_ring.push(timestamp, raw, val, flags)
                 with lock:
-                    val = round(float(self.ultrasonic.read()), 2)
                     distance_addr.value = val
-                sleep(0.01)
+                self.sensors.publish('distance', val, timestamp)
+
+                # wait for the period of the motion state, a faster state cuts the wait short
+                next_time = start + self.DISTANCE_PERIODS[state]
+                now = perf_counter()
+                while now < next_time:
+                    sleep(min(self.DISTANCE_STATE_POLL, next_time - now))
+                    now = perf_counter()
+                    if self.motion_state.value != state:
+                        break
+                stats[3*state] += 1
+                stats[3*state + 1] += timestamp - start
+                stats[3*state + 2] += perf_counter() - start
             except Exception as e:
                 sleep(0.1)
                 error(f'\rultrasonic_thread  except: {e}')
@@ -597,13 +989,29 @@ class Pidog():
             ultrasonic_thread.start()
 
     def sensory_process_start(self):
-        if self.sensory_process != None:
-            self.sensory_process.terminate()
+        self.sensory_process_stop()
+        self.sensory_stop.clear()
         self.sensory_process = Process(name='sensory_process',
                                          target=self.sensory_process_work,
                                          args=(self.distance, self.sensory_lock))
         self.sensory_process.start()
 
+    def sensory_process_stop(self, timeout=1):
+        """
+        Ask the sensory process to stop and wait for it, it is only
+        terminated if it does not stop in time: killed while it holds the
+        lock of the sensor hub, it would block every other publisher
+        """
+        if self.sensory_process == None:
+            return
+        self.sensory_stop.set()
+        self.sensory_process.join(timeout)
+        if self.sensory_process.is_alive():
+            warn('\rsensory_process did not stop, terminated')
+            self.sensory_process.terminate()
+            self.sensory_process.join()
+        self.sensory_process = None
+
     # reset: stop, stop_and_lie
     def stop_and_lie(self, speed=85):
         try:
@@ -616,58 +1024,56 @@ class Pidog():
         except Exception as e:
             error(f'\rstop_and_lie error:{e}')
 
-    def speak(self, name, volume=100):
+    def speak(self, name, volume=100, priority=0, on_done=None):
         """
-        speak, play audio
+        speak, play audio, mixed with the sounds already playing
 
-        :param name: the file name int the folder(SOUND_DIR)
+        :param name: the file name int the folder(SOUND_DIR), an alias, or a file path
         :type name: str
         :param volume: volume, 0-100
         :type volume: int
+        :param priority: sounds of a lower priority are ducked while this one plays
+        :type priority: int
+        :param on_done: callback(voice) when the sound ends or is cancelled
+        :return: Voice handle, voice.cancel() to stop it, voice.wait() to wait for it, False if not found
         """
         if not is_run_with_root and not hasattr(self, "speak_first"):
             self.speak_first = True
             warn("Play sound needs to be run with sudo.")
-        status, _ = utils.run_command('sudo killall pulseaudio') # Solve the problem that there is no sound when running in the vnc environment
-
-        if os.path.isfile(name):
-            self.music.sound_play_threading(name, volume)
-        elif os.path.isfile(self.SOUND_DIR+name+'.mp3'):
-            self.music.sound_play_threading(self.SOUND_DIR+name+'.mp3', volume)
-        elif os.path.isfile(self.SOUND_DIR+name+'.wav'):
-            self.music.sound_play_threading(self.SOUND_DIR+name+'.wav', volume)
-        else:
+
+        voice = self.audio.play(name, volume, priority, on_done)
+        if voice is None:
             warn(f'No sound found for {name}')
             return False
+        return voice
 
-    def speak_block(self, name, volume=100):
+    def speak_block(self, name, volume=100, priority=0):
         """
         speak, play audio with block
 
-        :param name: the file name int the folder(SOUND_DIR)
+        :param name: the file name int the folder(SOUND_DIR), an alias, or a file path
         :type name: str
         :param volume: volume, 0-100
         :type volume: int
+        :param priority: sounds of a lower priority are ducked while this one plays
+        :type priority: int
+        :return: True if played to the end, False if cancelled or not found
         """
-        if not is_run_with_root and not hasattr(self, "speak_first"):
-            self.speak_first = True
-            warn("Play sound needs to be run with sudo.")
-        _status, _ = utils.run_command('sudo killall pulseaudio') # Solve the problem that there is no sound when running in the vnc environment
-        
-        if os.path.isfile(name):
-            self.music.sound_play(name, volume)
-        elif os.path.isfile(self.SOUND_DIR+name+'.mp3'):
-            self.music.sound_play(self.SOUND_DIR+name+'.mp3', volume)
-        elif os.path.isfile(self.SOUND_DIR+name+'.wav'):
-            self.music.sound_play(self.SOUND_DIR+name+'.wav', volume)
-        else:
-            warn(f'No sound found for {name}')
+        voice = self.speak(name, volume, priority)
+        if voice is False:
             return False
+        return voice.wait()
 
     # calibration
     def set_leg_offsets(self, cali_list, reset_list=None):
         self.legs.set_offset(cali_list)
-        if reset_list is None:
+        if self.motion_process != None:
+            self.motion_process.set_offset('legs', self.legs.offset)
+            if reset_list is None:
+                reset_list = [0]*8
+            self.motion_process.write('legs', reset_list)
+            self.leg_current_angles = list.copy(reset_list)
+        elif reset_list is None:
             self.legs.reset()
             self.leg_current_angles = [0]*8
         else:
@@ -677,13 +1083,19 @@ class Pidog():
 
     def set_head_offsets(self, cali_list):
         self.head.set_offset(cali_list)
+        if self.motion_process != None:
+            self.motion_process.set_offset('head', self.head.offset)
         #self.head.reset()
         self.head_move([[0]*3], immediately=True, speed=80)
         self.head_current_angles = [0]*3
 
     def set_tail_offset(self, cali_list):
         self.tail.set_offset(cali_list)
-        self.tail.reset()
+        if self.motion_process != None:
+            self.motion_process.set_offset('tail', self.tail.offset)
+            self.motion_process.write('tail', [0])
+        else:
+            self.tail.reset()
         self.tail_current_angles = [0]
 
     # calculate angles and coords
@@ -913,6 +1325,8 @@ class Pidog():
             if part == 'legs':
                 for _ in range(step_count):
                     self.legs_move(actions, immediately=False, speed=speed)
+                # motion state of the ultrasonic rate, see _update_motion_state
+                self.legs_action_name = action_name
             elif part == 'head':
                 for _ in range(step_count):
                     self.head_move(actions, pitch_comp=pitch_comp, immediately=False, speed=speed)
@@ -924,6 +1338,40 @@ class Pidog():
         except Exception as e:
             error(f"do_action:{e}")
 
+    # play clip
+    def play_clip(self, clip, immediately=True, speed=50, trim=False):
+        """
+        Submit a compiled ActionClip, all parts are enqueued at once.
+
+        Every part runs in its own thread at its own pace, like legs_move,
+        head_move and tail_move called together, all parts have the same
+        number of frames. Build a multi-phase action as one clip, with
+        concat(), merge() and time_scale() for the speed of every phase.
+
+        :param clip: ActionClip, see action_clip.py
+        :param immediately: clear the buffers of the parts driven by the clip first
+        :param speed: speed of all parts, 0-100
+        :param trim: do not enqueue the frames a part holds at the end of the clip
+        """
+        legs = clip.frames('legs', trim=trim)
+        head = clip.frames('head', trim=trim)
+        tail = clip.frames('tail', trim=trim)
+        if immediately == True:
+            if legs: self.legs_stop()
+            if head: self.head_stop()
+            if tail: self.tail_stop()
+        with self.legs_thread_lock, self.head_thread_lock, self.tail_thread_lock:
+            if legs:
+                self.legs_speed = speed
+                self.legs_action_name = None
+                self.legs_action_buffer += legs
+            if head:
+                self.head_speed = speed
+                self.head_action_buffer += head
+            if tail:
+                self.tail_speed = speed
+                self.tail_action_buffer += tail
+
     def wait_legs_done(self):
         while not self.is_legs_done():
             sleep(0.001)
@@ -942,16 +1390,22 @@ class Pidog():
         self.wait_tail_done()
 
     def is_legs_done(self):
-        return not bool(len(self.legs_action_buffer) > 0)
+        return not bool(len(self.legs_action_buffer) > 0) and not self.legs_moving and not self._motion_pending('legs')
 
     def is_head_done(self):
-        return not bool(len(self.head_action_buffer) > 0)
+        return not bool(len(self.head_action_buffer) > 0) and not self.head_moving and not self._motion_pending('head')
 
     def is_tail_done(self):
-        return not bool(len(self.tail_action_buffer) > 0)
+        return not bool(len(self.tail_action_buffer) > 0) and not self.tail_moving and not self._motion_pending('tail')
 
     def is_all_done(self):
         return self.is_legs_done() and self.is_head_done() and self.is_tail_done()
 
+    def is_still(self):
+        """
+        All buffers are empty and no servo is in the middle of a move
+        """
+        return self.is_all_done() and not (self.legs_moving or self.head_moving or self.tail_moving)
+
     def get_battery_voltage(self):
         return round( utils.get_battery_voltage(), 2)
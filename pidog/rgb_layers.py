@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+import threading
+import numpy as np
+
+''' RGB layers: a stack of animations blended on top of the RGBStrip mode
+
+    The mode set with RGBStrip.set_mode() is the bottom layer. Layers added
+    to RGBStrip.layers are rendered every show() tick, from the lowest z to
+    the highest, and alpha-blended over it:
+
+        frame = frame * (1 - alpha) + layer * alpha
+
+    A layer renders all lights at once with numpy, rgb light_num*3 and
+    alpha light_num (or a single alpha). Layers with a ttl are removed once
+    it has passed, eg: a flash on top of a battery bar:
+
+        strip.layers.add(BarLayer(0.6, 'green'))
+        strip.layers.add(FlashLayer('red', ttl=0.5), z=10)
+
+    EnvelopeLayer follows the loudness of a playing sound (audio_engine.Voice),
+    it is removed when the sound ends.
+'''
+
+
+class Layer():
+    """
+    Base layer, subclasses implement render()
+    """
+
+    def __init__(self, alpha=1.0, ttl=None):
+        """
+        :param alpha: opacity, 0~1
+        :param ttl: seconds the layer is shown, None for ever
+        """
+        self.alpha = alpha
+        self.ttl = ttl
+        self.start = None  # perf_counter second of the first render
+
+    def expired(self, now):
+        return self.ttl is not None and self.start is not None and now - self.start >= self.ttl
+
+    def render(self, strip, t):
+        """
+        :param strip: RGBStrip, for light_num, colorConvertor() and compile()
+        :param t: seconds since the layer was first shown
+        :return: rgb float array light_num*3 (0~255), alpha float or array light_num (0~1)
+        """
+        raise NotImplementedError
+
+
+class StyleLayer(Layer):
+    """
+    One of RGBStrip.STYLES, the dark part of its frames is transparent (keyed)
+    """
+
+    def __init__(self, style, color='white', bps=1, brightness=1, alpha=1.0, ttl=None, keyed=True):
+        """
+        :param keyed: alpha follows the frame brightness, False to cover the lower layers
+        """
+        super().__init__(alpha, ttl)
+        self.mode = (style, color, bps, brightness)
+        self.keyed = keyed
+        self.table = None
+
+    def render(self, strip, t):
+        if self.table is None:
+            # compiled in the rgb thread, from the frame table cache of the strip
+            self.table = strip.compile(*self.mode).astype(np.float64)
+            self.peak = max(1.0, self.table.max())
+        rgb = self.table[int(t / strip.MIN_DELAY) % len(self.table)]
+        if not self.keyed:
+            return rgb, self.alpha
+        return rgb, self.alpha * rgb.max(axis=1) / self.peak
+
+
+class BarLayer(Layer):
+    """
+    Level bar from the first light, the last lit light partly transparent
+    """
+
+    def __init__(self, level, color='green', alpha=1.0, ttl=None):
+        """
+        :param level: 0~1, can be changed while shown
+        """
+        super().__init__(alpha, ttl)
+        self.level = level
+        self.color = color
+
+    def render(self, strip, t):
+        fill = np.clip(self.level * strip.light_num - np.arange(strip.light_num), 0, 1)
+        rgb = np.broadcast_to(np.array(strip.colorConvertor(self.color), dtype=np.float64), (strip.light_num, 3))
+        return rgb, self.alpha * fill
+
+
+class FlashLayer(Layer):
+    """
+    Whole strip in one color, fading out over its ttl
+    """
+
+    def __init__(self, color='white', ttl=0.3, alpha=1.0):
+        super().__init__(alpha, ttl)
+        self.color = color
+
+    def render(self, strip, t):
+        rgb = np.broadcast_to(np.array(strip.colorConvertor(self.color), dtype=np.float64), (strip.light_num, 3))
+        return rgb, self.alpha * max(0.0, 1 - t / self.ttl)
+
+
+class EnvelopeLayer(Layer):
+    """
+    Speak animation from the amplitude envelope of a playing Voice: the louder,
+    the brighter and the wider from the middle to both sides
+    """
+
+    EDGE = 0.2  # fade width at the ends of the lit part, part of the half strip
+
+    def __init__(self, voice, color='pink', alpha=1.0, floor=0.1, ttl=None):
+        """
+        :param voice: audio_engine.Voice
+        :param floor: brightness while silent, 0~1
+        """
+        super().__init__(alpha, ttl)
+        self.voice = voice
+        self.color = color
+        self.floor = floor
+
+    def expired(self, now):
+        return self.voice.done() or super().expired(now)
+
+    def render(self, strip, t):
+        level = self.voice.level(self.start + t)
+        center = (strip.light_num - 1) / 2
+        distance = np.abs(np.arange(strip.light_num) - center) / max(center, 1)
+        lit = np.clip((level - distance) / self.EDGE + 1, 0, 1) * level
+        brightness = self.floor + (1 - self.floor) * lit
+        rgb = np.multiply.outer(brightness, np.array(strip.colorConvertor(self.color), dtype=np.float64))
+        return rgb, self.alpha
+
+
+class RGBCompositor():
+    """
+    Stack of layers ordered by z, blended over a base frame
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.layers = []  # [z, order, layer]
+        self.order = 0
+
+    def __len__(self):
+        return len(self.layers)
+
+    def add(self, layer, z=0):
+        """
+        :param layer: Layer
+        :param z: higher z is drawn on top, same z in the order added
+        :return: layer, for remove()
+        """
+        with self.lock:
+            self.order += 1
+            self.layers.append([z, self.order, layer])
+            self.layers.sort(key=lambda item: (item[0], item[1]))
+        return layer
+
+    def remove(self, layer):
+        with self.lock:
+            self.layers = [item for item in self.layers if item[2] is not layer]
+
+    def clear(self):
+        with self.lock:
+            self.layers = []
+
+    def blend(self, base, strip, now):
+        """
+        Blend every layer over base, expired layers are removed
+
+        :param base: uint8 array light_num*3
+        :param now: perf_counter second
+        :return: uint8 array light_num*3
+        """
+        with self.lock:
+            layers = [item[2] for item in self.layers]
+        frame = np.asarray(base, dtype=np.float64)
+        expired = []
+        for layer in layers:
+            if layer.start is None:
+                layer.start = now
+            if layer.expired(now):
+                expired.append(layer)
+                continue
+            rgb, alpha = layer.render(strip, now - layer.start)
+            alpha = np.clip(alpha, 0, 1)
+            if np.ndim(alpha) > 0:
+                alpha = alpha[:, None]
+            frame = frame + (rgb - frame) * alpha
+        for layer in expired:
+            self.remove(layer)
+        return np.clip(frame, 0, 255).astype(np.uint8)
@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 import time
+import copy
+from collections import OrderedDict
 from smbus import SMBus
+from .rgb_layers import RGBCompositor
 import numpy as np
 import math
 
@@ -30,6 +33,17 @@ class RGBStrip():
 
     MIN_DELAY = 0.05
 
+    FRAME_CACHE_SIZE = 16  # compiled frame tables kept, least recently used dropped first
+
+    # let the chip animate the styles it can express (HARDWARE_STYLES): upload one picture,
+    # the breath engine fades it, the host stops streaming frames
+    HARDWARE_ANIMATION = False
+    HARDWARE_STYLES = ["monochromatic", "breath"]
+
+    # write consecutive registers with i2c block writes instead of one write per register
+    BLOCK_WRITE = True
+    BLOCK_SIZE = 32  # max data bytes of a smbus block write
+
     # region constants
     CONFIGURE_CMD_PAGE = 0XFD
     FRAME1_PAGE = 0x00
@@ -72,6 +86,10 @@ class RGBStrip():
     mskBLINK_EN = (0x1 << 3)
     mskBLINK_DIS = (0x0 << 3)
     mskBLINK_PERIOD_TIME_CONST = (0x7 << 0)
+    mskBREATH_EN = (0x1 << 4)
+    mskBREATH_DIS = (0x0 << 4)
+    BREATH_FADE_UNIT = 0.026  # second, fade in/out time = 2^code * unit, code 0~7
+    BREATH_EXTINGUISH_UNIT = 0.0035  # second, extinguish time = 2^code * unit, code 0~7
 
     Type3Vaf = [
         # Frame 1
@@ -111,11 +129,37 @@ class RGBStrip():
         self.bps = 1.5 # beats per second
         self.is_changed = False
 
+        # (style, color, bps, brightness, light_num): frame table
+        self.mode_key = None
+        self.frame_cache = OrderedDict()
+        self.frame_cache_hits = 0
+        self.frame_cache_misses = 0
+        self.hardware_active = False
+        # layers blended over the mode, see rgb_layers
+        self.layers = RGBCompositor()
+        self.layers_shown = False
+        self.tick_time = 0
+
         # Initial
         # =================================================================
         self.bus = SMBus(1)
         self.addr = addr
 
+        # shadow of the chip registers written so far, per page, to skip rewriting known values
+        self.page = None
+        self.shadow = {}
+        self.shadow_known = {}
+        self.i2c_transactions = 0
+        self.i2c_bytes = 0
+        self.i2c_bytes_skipped = 0
+        # last frame sent to display(), identical frames skip the bus
+        self.last_frame = None
+        self.frame_bytes = 3 * self.light_num
+        self.bytes_saved_per_second = 0
+        self.saved_rate_time = time.perf_counter()
+        self.saved_rate_bytes = 0
+        init_start = time.perf_counter()
+
         # Setting SLED1735 Ram Page to Function Page
         self.write_cmd(self.CONFIGURE_CMD_PAGE, self.FUNCTION_PAGE)
         # System must go to SW shutdowm mode when initialization
@@ -153,71 +197,170 @@ class RGBStrip():
         # Clear LED CTL Registers (Frame1Page)
         self.write_Ndata(0X00, 0XFF, 0X10)
         self.write_Ndata(0x20, 0x00, 0X80)
+        self.init_time = time.perf_counter() - init_start
+        self.init_transactions = self.i2c_transactions
 
     # i2c communicate
     # =================================================================
     def write_cmd(self, reg, cmd):
         self.bus.write_byte_data(self.addr, reg, cmd)
+        self.i2c_transactions += 1
+        self.i2c_bytes += 1
+        if reg == self.CONFIGURE_CMD_PAGE:
+            self.page = cmd
+        else:
+            self._shadow_update(reg, [cmd])
+
+    def _shadow_page(self, page=None):
+        if page is None:
+            page = self.page
+        if page not in self.shadow:
+            self.shadow[page] = bytearray(0x100)
+            self.shadow_known[page] = bytearray(0x100)
+        return self.shadow[page], self.shadow_known[page]
+
+    def _shadow_update(self, startaddr, data):
+        shadow, known = self._shadow_page()
+        end = startaddr + len(data)
+        shadow[startaddr:end] = bytes(data)
+        known[startaddr:end] = b'\x01' * len(data)
+
+    def write_block(self, startaddr, data, cached=True, page=None):
+        """
+        Write consecutive registers in block writes
+
+        :param startaddr: first register
+        :param data: list of bytes
+        :param cached: skip the leading and trailing registers already known to hold these values
+        :param page: page of the registers, selected only if something is written, None for the current page
+        :return: number of bytes written
+        """
+        data = bytes(data)
+        start = 0
+        end = len(data)
+        if cached:
+            shadow, known = self._shadow_page(page)
+            changed = [i for i in range(end)
+                       if not known[startaddr + i] or shadow[startaddr + i] != data[i]]
+            if not changed:
+                self.i2c_bytes_skipped += end
+                return 0
+            start = changed[0]
+            end = changed[-1] + 1
+            self.i2c_bytes_skipped += len(data) - (end - start)
+        if page is not None and page != self.page:
+            self.write_cmd(self.CONFIGURE_CMD_PAGE, page)
+        for offset in range(start, end, self.BLOCK_SIZE):
+            chunk = data[offset:min(offset + self.BLOCK_SIZE, end)]
+            self.bus.write_i2c_block_data(self.addr, startaddr + offset, list(chunk))
+            self.i2c_transactions += 1
+            self.i2c_bytes += len(chunk)
+        self._shadow_update(startaddr + start, data[start:end])
+        return end - start
 
     def write_Ndata(self, startaddr, data, length):
-        addr = startaddr
         if isinstance(data, int):
-            for i in range(length):
-                self.write_cmd(addr, data)
-                addr += 1
-        elif isinstance(data, list):
-            for i in range(length):
-                self.write_cmd(addr, data[i])
-                addr += 1
+            data = [data] * length
+        else:
+            data = list(data[:length])
+        if self.BLOCK_WRITE:
+            self.write_block(startaddr, data)
+            return
+        addr = startaddr
+        for i in range(length):
+            self.write_cmd(addr, data[i])
+            addr += 1
+
+    def i2c_stats(self):
+        """
+        :return: dict of i2c transactions, bytes written, bytes skipped (already in the chip)
+        """
+        return {
+            'transactions': self.i2c_transactions,
+            'bytes': self.i2c_bytes,
+            'skipped': self.i2c_bytes_skipped,
+            'saved_per_second': self.bytes_saved_per_second,
+        }
 
     # display fuction
     # =================================================================
     def display(self, image):
         """
-        Display the rgb datas
+        Display the rgb datas, only the register blocks which changed are written
 
         :param image: rgb datas, should be a x*3 array 
         :type image: list [[r, g, b], [r, g, b], ...]
         """
-        # 'lambda x: x[0]'  same as  'fun(x): return x[0]'
-        reds = list(map(lambda x: x[0], image))
-        greens = list(map(lambda x: x[1], image))
-        blues = list(map(lambda x: x[2], image))
+        image = np.asarray(image)
+        if image.dtype != np.uint8:
+            image = np.clip(np.trunc(image.astype(np.float64)), 0, 255).astype(np.uint8)
+        frame = image[:, :3].tobytes()
+        if frame == self.last_frame:
+            self.i2c_bytes_skipped += self.frame_bytes
+            self._update_saved_rate()
+            return
+
+        reds = list(frame[0::3])
+        greens = list(frame[1::3])
+        blues = list(frame[2::3])
         revert_image = [reds, greens, blues]
 
         reg = 0x20  # Register start address of a page
         empty = 0  # Register address vacancy position (needs to be filled with 0)
         pos = 0  # data position, index
+        page = self.FRAME1_PAGE
 
         for i in range(3):
             # Set the page to write
             if i == 0:
-                self.write_cmd(self.CONFIGURE_CMD_PAGE, self.FRAME1_PAGE)  
+                page = self.FRAME1_PAGE
             elif reg == 0x20:
-                self.write_cmd(self.CONFIGURE_CMD_PAGE, self.FRAME2_PAGE)
+                page = self.FRAME2_PAGE
 
             color = i % 3
             data = revert_image[color][pos*14:(pos+1)*14]
             data.insert(empty, 0)  # The written data is filled with 0
             data.insert(empty + 1, 0)
 
-            self.bus.write_i2c_block_data(self.addr, reg, data)
+            self.write_block(reg, data, page=page)
             if color == 2:
                 empty += 3
                 pos += 1
             reg += 0x10
             if reg == 0xA0:
                 reg = 0x20
+        # only once every block is written, a failed write is retried with the next frame
+        self.last_frame = frame
+        self._update_saved_rate()
+
+    def _update_saved_rate(self):
+        now = time.perf_counter()
+        if now - self.saved_rate_time >= 1:
+            self.bytes_saved_per_second = (self.i2c_bytes_skipped - self.saved_rate_bytes) / (now - self.saved_rate_time)
+            self.saved_rate_time = now
+            self.saved_rate_bytes = self.i2c_bytes_skipped
 
     # 
     # calulate rgb data of different styles
     # =================================================================
+    def _colorize(self, color, brightness):
+        """
+        Scale the color by the brightness of every light
+
+        :param color: [r, g, b]
+        :param brightness: float, or array of any shape, eg: frames*lights
+        :return: [r, g, b] ints for a float, uint8 array of brightness.shape*3 for an array
+        """
+        color = np.array([i*self.brightness for i in color], dtype=np.float64)
+        values = np.multiply.outer(brightness, color)
+        values = np.clip(np.trunc(values), 0, 255).astype(np.uint8)
+        return values.tolist() if values.ndim == 1 else values
+
     def monochromatic(self, color="white"):
         """
         monochromatic style
         """
-        color = [i*self.brightness for i in color]
-        return color
+        return self._colorize(color, 1.0)
 
     def Normal_distribution_calculate(self, u, sig, A, x, offset):
         """
@@ -248,86 +391,80 @@ class RGBStrip():
         :param x: xpos
         :return: result, float  or int
         """
-        return (peak/2.0) * math.cos(a*x + offset) + peak/2
+        return (peak/2.0) * np.cos(a*x + offset) + peak/2
 
     def breath(self, frame_index, light_index, color='pink', A=5, sig=2):
         """
         breath style, from dark to bright, and then from bright to dark
 
-        :param frame_index: the index of the frame
-        :type frame_index: int
-        :param light_index: the index of the light
-        :type light_index: int
+        :param frame_index: the index of the frame, or an array of them
+        :type frame_index: int or numpy array
+        :param light_index: the index of the light, or an array of them
+        :type light_index: int or numpy array
         :param color: rgb display color
         :type color: str , 1*3 list, tuple, eg: "white", "WHITE", "#a2c20c", 0xa2c20c, [168, 192, 203], (168, 192, 203)
         :param A: amplitude ratio
         :type  A: float or int
         :param sig: standard deviation
         :type sig: float or int
-        :return list of 11*[r, g, b] values
-        :rtype: list, 11*[int, int, int]
+        :return: [r, g, b] values, uint8 array of the broadcast indexes*3 for arrays
+        :rtype: list or numpy array
         """
         # https://www.geogebra.org/calculator/qz3vsjjn
         u = 5
-        color = [i*self.brightness for i in color]
         multiple = float(2*math.pi/(self.max_frames)) # multiple, period = max_frames
         offset = -self.cos_func(1, multiple, frame_index)
         brightness = self.Normal_distribution_calculate(u, sig, A, light_index, offset)
-        return list([max(0, int(c * brightness)) for c in color])
+        return self._colorize(color, brightness)
 
     def boom(self, frame_index, light_index, color='pink', A=5, sig=2):
         """
         boom style, from dark to bright (from middle to both sides)
 
-        :param frame_index: the index of the frame
-        :type frame_index: int
-        :param light_index: the index of the light
-        :type light_index: int
+        :param frame_index: the index of the frame, or an array of them
+        :type frame_index: int or numpy array
+        :param light_index: the index of the light, or an array of them
+        :type light_index: int or numpy array
         :param color: rgb display color
         :type color: str , 1*3 list, tuple, eg: "white", "WHITE", "#a2c20c", 0xa2c20c, [168, 192, 203], (168, 192, 203)
         :param A: amplitude ratio
         :type  A: float or int
         :param sig: standard deviation
         :type sig: float or int
-        :return: list of 11*[r, g, b] values
-        :rtype: list, 11*[int, int, int]
+        :return: [r, g, b] values, uint8 array of the broadcast indexes*3 for arrays
+        :rtype: list or numpy array
         """
         # https://www.geogebra.org/calculator/gpmxfpks
         u = 5
-        color = [i*self.brightness for i in color]
         multiple = float(2*math.pi/(self.max_frames*2.0)) # multiple, period = 2*max_frames
         offset = -self.cos_func(1, multiple, frame_index)
         brightness = self.Normal_distribution_calculate(u, sig, A, light_index, offset)
-        return list([max(0, int(c * brightness)) for c in color])
+        return self._colorize(color, brightness)
 
     def bark(self, frame_index, light_index, color='pink', A=2.5, sig=1):
         """
         bark style, from middle to both sides
 
-        :param frame_index: the index of the frame
-        :type frame_index: int
-        :param light_index: the index of the light
-        :type light_index: int
+        :param frame_index: the index of the frame, or an array of them
+        :type frame_index: int or numpy array
+        :param light_index: the index of the light, or an array of them
+        :type light_index: int or numpy array
         :param color: rgb display color
         :type color: str , 1*3 list, tuple, eg: "white", "WHITE", "#a2c20c", 0xa2c20c, [168, 192, 203], (168, 192, 203)
         :param A: amplitude ratio
         :type  A: float or int
         :param sig: standard deviation
         :type sig: float or int
-        :return: list of 11*[r, g, b] values
-        :rtype: list, 11*[int, int, int]
+        :return: [r, g, b] values, uint8 array of the broadcast indexes*3 for arrays
+        :rtype: list or numpy array
         """
         # https://www.geogebra.org/calculator/yyemmqht
-        color = [i*self.brightness for i in color]
         peak = (self.light_num-1)/2
         multiple = float(2*math.pi/(self.max_frames*2.0)) # multiple, period = 2*max_frames
         u_offset = self.cos_func(peak, multiple, frame_index)
-        if light_index <= peak:
-            u = u_offset 
-        else:
-            u = 2*peak - u_offset
+        u = np.where(light_index <= peak, u_offset, 2*peak - u_offset)
         brightness = self.Normal_distribution_calculate(u, sig, A, light_index, 0)
-        return list([max(0, int(c * brightness)) for c in color])
+        return self._colorize(color, brightness)
 
     def speak(self, frame_index, light_index, color='pink', A=2.5, sig=1):
         """
@@ -335,16 +472,12 @@ class RGBStrip():
 
         """
         # https://www.geogebra.org/calculator/tpzypj5s
-        color = [i*self.brightness for i in color]
         peak = (self.light_num-1)/2
         multiple = float(2*math.pi/(self.max_frames)) # multiple, period = max_frames
         u_offset = self.cos_func(peak, multiple, frame_index)
-        if light_index <= peak:
-            u = u_offset 
-        else:
-            u = 2*peak - u_offset
+        u = np.where(light_index <= peak, u_offset, 2*peak - u_offset)
         brightness = self.Normal_distribution_calculate(u, sig, A, light_index, 0)
-        return list([max(0, int(c * brightness)) for c in color])
+        return self._colorize(color, brightness)
 
     def listen(self, frame_index, light_index, color='pink', A=2.5, sig=1):
         """
@@ -352,13 +485,12 @@ class RGBStrip():
 
         """
         # https://www.geogebra.org/calculator/gwbrzrkt
-        color = [i*self.brightness for i in color]
         peak = self.light_num-1
         multiple = float(2*math.pi/(self.max_frames)) # multiple, period = max_frames
         offset = math.pi/2 # offset left pi/2
         u = self.cos_func(peak, multiple, frame_index, offset)
         brightness = self.Normal_distribution_calculate(u, sig, A, light_index, 0)
-        return list([max(0, int(c * brightness)) for c in color])
+        return self._colorize(color, brightness)
 
     # set mode
     # =================================================================
@@ -399,25 +531,29 @@ class RGBStrip():
         :param brightness: rgb display brightness
         :type brightness: float or int
         """
-        if style in self.STYLES:
-            self.style = style
-        else:
+        if style not in self.STYLES:
             self.style = None
+            self.mode_key = None
             raise ValueError("Invalid style value.")
 
         color = self.colorConvertor(color)
-        self.color = color
 
-        if isinstance(bps, int) or isinstance(bps, float):
-            self.bps = bps
-        else:
+        if not (isinstance(bps, int) or isinstance(bps, float)):
             raise ValueError("Invalid bps value.")
 
-        if isinstance(brightness, int) or isinstance(brightness, float):
-            self.brightness = brightness
-        else:
+        if not (isinstance(brightness, int) or isinstance(brightness, float)):
             raise ValueError("Invalid brightness value.")
 
+        # already showing this mode, keep the animation running
+        key = (style, tuple(color), bps, brightness, self.light_num)
+        if key == self.mode_key:
+            return
+
+        self.style = style
+        self.color = color
+        self.bps = bps
+        self.brightness = brightness
+        self.mode_key = key
         self.is_changed = True
         
 
@@ -437,34 +573,146 @@ class RGBStrip():
         elif self.style == 'listen':
             return self.listen(frame_index, light_index, color=self.color)
 
+    def frame_table(self):
+        """
+        All frames of the current mode at once, one numpy broadcast over frames*lights
+
+        :return: uint8 array of max_frames*light_num*3
+        """
+        frame_index = np.arange(self.max_frames).reshape(-1, 1)
+        light_index = np.arange(self.light_num).reshape(1, -1)
+        table = np.asarray(self.calulate_data(frame_index, light_index), dtype=np.uint8)
+        return np.broadcast_to(table, (self.max_frames, self.light_num, 3)).copy()
+
+    def cached_frame_table(self):
+        """
+        frame_table() of the current mode, from the LRU cache if it was built recently
+        """
+        return self.compile(self.style, self.color, self.bps, self.brightness)
+
+    def compile(self, style, color='white', bps=1, brightness=1):
+        """
+        Frame table of any mode, from the LRU cache if it was built recently,
+        the current mode is not changed
+
+        :return: uint8 array of frames*light_num*3
+        """
+        color = self.colorConvertor(color)
+        key = (style, tuple(color), bps, brightness, self.light_num)
+        if key in self.frame_cache:
+            self.frame_cache.move_to_end(key)
+            self.frame_cache_hits += 1
+            return self.frame_cache[key]
+        self.frame_cache_misses += 1
+        mode = copy.copy(self)
+        mode.style = style
+        mode.color = color
+        mode.bps = bps
+        mode.brightness = brightness
+        mode.max_frames = int(1/bps/self.MIN_DELAY)
+        table = mode.frame_table()
+        self.frame_cache[key] = table
+        while len(self.frame_cache) > self.FRAME_CACHE_SIZE:
+            self.frame_cache.popitem(last=False)
+        return table
+
+    def frame_cache_stats(self):
+        """
+        :return: dict of frame table cache hits, misses and size
+        """
+        return {
+            'hits': self.frame_cache_hits,
+            'misses': self.frame_cache_misses,
+            'size': len(self.frame_cache),
+        }
+
+    # hardware animation
+    # =================================================================
+    def _breath_code(self, seconds, unit):
+        code = round(math.log2(max(seconds, unit) / unit))
+        return max(0, min(7, code))
+
+    def hardware_start(self):
+        """
+        Upload the picture of the current mode and let the chip animate it
+
+            monochromatic: the static picture
+            breath: the brightest frame, faded in and out by the breath engine in 1/bps
+
+        The picture is written once, show() then only sleeps.
+        """
+        if self.style == 'breath':
+            picture = self.frames.max(axis=0)
+            fade = self._breath_code(0.5/self.bps, self.BREATH_FADE_UNIT)
+            breath = [(fade << 4) | fade, self.mskBREATH_EN | self._breath_code(0, self.BREATH_EXTINGUISH_UNIT)]
+        else:
+            picture = self.frames[0]
+            breath = [0x00, self.mskBREATH_DIS]
+        self.display(picture)
+        self.write_block(self.DISPLAY_OPTION_REG, [self.mskBLINK_FRAME_300 | self.mskBLINK_DIS | self.mskBLINK_PERIOD_TIME_CONST],
+                         page=self.FUNCTION_PAGE)
+        self.write_block(self.BREATH_CTL_REG, breath, page=self.FUNCTION_PAGE)
+        self.hardware_active = True
+
+    def hardware_stop(self):
+        """
+        Stop the breath engine, frames are streamed by show() again
+        """
+        if not self.hardware_active:
+            return
+        self.write_block(self.BREATH_CTL_REG2, [self.mskBREATH_DIS], page=self.FUNCTION_PAGE)
+        self.hardware_active = False
+
     def show(self):
+        tick_start = time.perf_counter()
+        # layers added or all expired, the hardware animation has to stop or may restart
+        layers_shown = len(self.layers) > 0
+        if layers_shown != self.layers_shown:
+            self.layers_shown = layers_shown
+            self.is_changed = True
         if self.style is not None:
             # if changed, calulate frames
             if self.is_changed:
                 self.is_changed = False
-                self.frames.clear()
                 self.max_frames = int(1/self.bps/self.MIN_DELAY)
-                for frame_index in range(self.max_frames):
-                    frame = [] # 11*[r, g ,b]
-                    for light_index in range(self.light_num):
-                        _data = self.calulate_data(frame_index, light_index)
-                        frame.append(_data)
-                    if __name__ == '__main__':
-                        print(f"{frame_index}:{frame}")
-                    self.frames.append(frame)
+                self.frames = self.cached_frame_table() # max_frames*11*[r, g ,b]
+                if __name__ == '__main__':
+                    for frame_index, frame in enumerate(self.frames):
+                        print(f"{frame_index}:{frame.tolist()}")
+                self.hardware_stop()
+                if self.HARDWARE_ANIMATION and self.style in self.HARDWARE_STYLES and not layers_shown:
+                    self.hardware_start()
+            # the chip animates, nothing to stream
+            if self.hardware_active:
+                time.sleep(self.MIN_DELAY)
+                return
             # dispaly frame-by-frame, to quickly change mode or close 
             if self.current_frame >= self.max_frames:
                 self.current_frame = 0
-            self.display(self.frames[self.current_frame])
+            frame = self.frames[self.current_frame]
             self.current_frame += 1
-            time.sleep(self.MIN_DELAY)
         # --- close ---
-        else: 
-            time.sleep(self.MIN_DELAY)
+        else:
+            frame = np.zeros((self.light_num, 3), dtype=np.uint8)
+            if not layers_shown:
+                # the last layer is gone, clear what it left on the strip once
+                if self.is_changed:
+                    self.is_changed = False
+                    self.display(frame)
+                time.sleep(self.MIN_DELAY)
+                return
+        if layers_shown:
+            frame = self.layers.blend(frame, self, tick_start)
+        self.display(frame)
+        # one tick every MIN_DELAY, the time spent blending and writing included
+        self.tick_time = time.perf_counter() - tick_start
+        time.sleep(max(0, self.MIN_DELAY - self.tick_time))
 
     def close(self):
         self.style = None
+        self.mode_key = None
         self.is_changed = True
+        self.hardware_stop()
         self.display([[0, 0, 0]]*self.light_num)
         time.sleep(self.MIN_DELAY)
 
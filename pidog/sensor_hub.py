@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+import os
+from collections import namedtuple
+from multiprocessing import Condition
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter, sleep
+import numpy as np
+from .memory_barrier import fence
+
+''' SensorHub: latest sample of every sensor in shared memory
+
+    One record per sensor: seq, timestamp, values. Writers (the imu
+    thread, the sensory process, touch and sound readers) publish under a
+    multiprocessing Condition and notify waiters, so wait() blocks until a
+    new sample arrives, from threads and from processes alike.
+
+    Readers never take the lock. The seq of a record is odd while it is
+    being written, a reader retries until it copied a record under the
+    same even seq, with a fence between the seq and the copy, see
+    memory_barrier.py. snapshot() copies all records at once the same way,
+    so the values of every sensor in it belong together.
+
+    Timestamps are perf_counter seconds, the same clock in every process.
+'''
+
+# sensor name: number of values
+SENSORS = {
+    'distance': 1,  # cm
+    'imu': 8,  # ax, ay, az, gx, gy, gz, pitch, roll
+    'touch': 1,  # index in TOUCH_CODES
+    'sound': 1,  # direction in degree
+}
+# DualTouch.read() codes, then the gestures of the touch event mode
+TOUCH_CODES = ['N', 'L', 'R', 'LS', 'RS', 'LONG_L', 'LONG_R', 'DOUBLE_L', 'DOUBLE_R']
+MAX_VALUES = 8
+
+RECORD_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('timestamp', '<f8'),
+    ('values', '<f8', (MAX_VALUES,)),
+])
+
+Record = namedtuple('Record', ['seq', 'timestamp', 'values'])
+
+
+class SensorHub():
+
+    def __init__(self, sensors=SENSORS):
+        """
+        :param sensors: dict of sensor name: number of values, at most MAX_VALUES
+        """
+        self.names = list(sensors)
+        self.sizes = dict(sensors)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.shm = SharedMemory(create=True, size=len(self.names)*RECORD_DTYPE.itemsize)
+        self.records = np.ndarray((len(self.names),), dtype=RECORD_DTYPE, buffer=self.shm.buf)
+        self.records['seq'] = 0
+        self.records['timestamp'] = 0
+        self.records['values'] = 0
+        self.condition = Condition()
+        self.owner_pid = os.getpid()
+
+    # writers
+    # =================================================================
+    def publish(self, name, values, timestamp=None):
+        """
+        :param name: sensor name
+        :param values: list of values, or a single value
+        :param timestamp: sample time in perf_counter second, now if None
+        """
+        if timestamp is None:
+            timestamp = perf_counter()
+        if not isinstance(values, (list, tuple, np.ndarray)):
+            values = [values]
+        record = self.records[self.index[name]]
+        with self.condition:
+            seq = int(record['seq'])
+            record['seq'] = seq + 1
+            fence()
+            record['timestamp'] = timestamp
+            record['values'][:len(values)] = values
+            fence()
+            record['seq'] = seq + 2
+            self.condition.notify_all()
+
+    # readers
+    # =================================================================
+    def _make(self, name, raw):
+        return Record(int(raw['seq']) // 2, float(raw['timestamp']),
+                      raw['values'][:self.sizes[name]].tolist())
+
+    def seq(self, name):
+        """
+        Number of samples published for a sensor
+        """
+        return int(self.records[self.index[name]]['seq']) // 2
+
+    def read(self, name):
+        """
+        Latest sample of a sensor, without locking
+
+        :return: Record(seq, timestamp, values), seq 0 if nothing published yet
+        """
+        record = self.records[self.index[name]]
+        while True:
+            seq = int(record['seq'])
+            if seq & 1:
+                sleep(0)
+                continue
+            fence()
+            raw = record.copy()
+            fence()
+            if int(record['seq']) == seq:
+                return self._make(name, raw)
+
+    def age(self, name):
+        """
+        Seconds since the latest sample, None if nothing published yet
+        """
+        record = self.read(name)
+        if record.seq == 0:
+            return None
+        return perf_counter() - record.timestamp
+
+    def wait(self, name, seq=None, timeout=None):
+        """
+        Block until a sample newer than seq is published
+
+        :param seq: last seen seq, the current one if None
+        :param timeout: second, None for no timeout
+        :return: Record, None on timeout
+        """
+        if seq is None:
+            seq = self.seq(name)
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq(name) > seq, timeout):
+                return None
+        return self.read(name)
+
+    def snapshot(self, names=None):
+        """
+        Latest sample of several sensors, copied at once
+
+        :param names: list of sensor names, all if None
+        :return: dict of name: Record
+        """
+        if names is None:
+            names = self.names
+        while True:
+            seqs = self.records['seq'].copy()
+            if (seqs & 1).any():
+                sleep(0)
+                continue
+            fence()
+            raw = self.records.copy()
+            fence()
+            if (self.records['seq'] == seqs).all():
+                return {name: self._make(name, raw[self.index[name]]) for name in names}
+
+    def close(self):
+        del self.records
+        self.shm.close()
+        if os.getpid() == self.owner_pid:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 import time
+import struct
+from collections import namedtuple
+import numpy as np
 from robot_hat import I2C, fileDB
+from .imu_calibration import collect_samples, calibrate as imu_calibrate
 
 # from filedb import fileDB
 
@@ -23,6 +27,37 @@ def bytes_toint(msb, lsb):
     return -(((msb ^ 255) << 8) | (lsb ^ 255) + 1)
 
 
+IMU_STRUCT = struct.Struct('<6h')  # acc x, y, z, gyro x, y, z, little endian int16
+ImuData = namedtuple('ImuData', ['ax', 'ay', 'az', 'gx', 'gy', 'gz'])
+AXIS_INDEX = {
+    'x': 0,
+    'y': 1,
+    'z': 2,
+    'xy': (0, 1),
+    'xz': (0, 2),
+    'yz': (1, 2),
+    'xyz': (0, 1, 2),
+}
+
+
+def decode_imu(regData):
+    '''
+    Decode the 12 bytes from SH3001_ACC_XL in one call
+
+    :return: ImuData of raw int values
+    '''
+    return ImuData._make(IMU_STRUCT.unpack(bytearray(regData)))
+
+
+def decode_imu_block(regData):
+    '''
+    Decode N*12 bytes (a burst or fifo read) in one call
+
+    :return: N*6 int16 array, columns as ImuData
+    '''
+    return np.frombuffer(bytes(regData), dtype='<i2').reshape(-1, 6)
+
+
 def default_wait():
     '''
     delay of 10 ms
@@ -350,6 +385,15 @@ class Sh3001(I2C):
     SH3001_FIFO_ACC_Y_EN = 0x0002
     SH3001_FIFO_ACC_X_EN = 0x0001
     SH3001_FIFO_ALL_DIS = 0x0000
+
+    SH3001_FIFO_IMU_EN = (SH3001_FIFO_ACC_X_EN | SH3001_FIFO_ACC_Y_EN | SH3001_FIFO_ACC_Z_EN
+                          | SH3001_FIFO_GYRO_X_EN | SH3001_FIFO_GYRO_Y_EN | SH3001_FIFO_GYRO_Z_EN)
+    SH3001_FIFO_MAX_ENTRIES = 1024  # 16 bit entries
+    SH3001_FIFO_SAMPLE_ENTRIES = 6  # acc x, y, z, gyro x, y, z
+    SH3001_FIFO_SAMPLE_BYTES = 12
+
+    # LSB to g and dps, 2g and 2000 dps range
+    IMU_SCALE = (1/16384,)*3 + (1/16.384,)*3
     '''
     /******************************************************************
     *	AUX I2C Config Macro Definitions
@@ -401,6 +445,8 @@ class Sh3001(I2C):
 
         self.gyro_offset = [0, 0, 0]
         self.data_vector = [0, 0, 0]
+        self.fifo_transactions = 0
+        self.fifo_samples = 0
 
     def get_from_config(self, name, default_value=None):
         value = self.db.get(name, default_value)
@@ -416,30 +462,15 @@ class Sh3001(I2C):
         '''
         count = 0
         if aram == 'acc':
-            while True:
-                waitfunc()
-                self.data_vector = self._sh3001_getimudata()[0]
-
-                self.acc_max = list(map(max, self.acc_max, self.data_vector))
-                self.acc_min = list(map(min, self.acc_min, self.data_vector))
-                self.acc_offset = list(
-                    map(lambda a, b: (a + b) / 2, self.acc_max, self.acc_min))
-                print('\033[K\rmax_list: %s   min_list: %s' %
-                      (self.acc_max, self.acc_min),
-                      end="",
-                      flush=True)
+            # ellipsoid fit while rotated, stored in the config file, see imu_calibration.py
+            calibration = imu_calibrate(self)
+            self.acc_offset = calibration.center.tolist()
         elif aram == 'gyro':
-            sum_list = [0, 0, 0]
-            count = 0
-            for i in range(503):
-                if i > 2:
-                    sum_list = [
-                        sum_list[i] + self.sh3001_getimudata('gyro', 'xyz')[i]
-                        for i in range(3)
-                    ]
-            self.gyro_offset = [
-                round(sum_list[i], 2) / 500.0 for i in range(3)
-            ]
+            # one second at rest, read in bursts
+            samples = collect_samples(self, 1)
+            if len(samples) == 0:
+                raise IOError('no imu data')
+            self.gyro_offset = [round(v, 2) for v in samples[:, 3:].mean(axis=0).tolist()]
             print("gyro_offset:", self.gyro_offset)
 
         else:
@@ -542,80 +573,157 @@ class Sh3001(I2C):
 
     # endregion: sh3001 internal function
 
+    # region: FIFO
+    def sh3001_fifo_reset(self, fifoMode):
+        regData = self.mem_read(1, self.SH3001_FIFO_CONF0)
+        regData[0] |= 0x80
+        self.mem_write(regData, self.SH3001_FIFO_CONF0)
+        regData[0] &= 0x7F
+        self.mem_write(regData, self.SH3001_FIFO_CONF0)
+        self.mem_write(fifoMode & 0x03, self.SH3001_FIFO_CONF0)
+
+    def sh3001_fifo_freq_config(self, accDownSampleEnDis, accFreq, gyroDownSampleEnDis, gyroFreq):
+        regData = (accDownSampleEnDis | gyroDownSampleEnDis) | (accFreq << 4) | gyroFreq
+        self.mem_write(regData, self.SH3001_FIFO_CONF4)
+
+    def sh3001_fifo_watermark_config(self, waterMarkLevel):
+        waterMarkLevel = min(waterMarkLevel, self.SH3001_FIFO_MAX_ENTRIES)
+        regData = self.mem_read(1, self.SH3001_FIFO_CONF2)
+        regData[0] = (regData[0] & 0xC8) | ((waterMarkLevel & 0x0700) >> 8)
+        self.mem_write(regData, self.SH3001_FIFO_CONF2)
+        self.mem_write(waterMarkLevel & 0xFF, self.SH3001_FIFO_CONF1)
+
+    def sh3001_fifo_channel_config(self, fifoChannel):
+        regData = self.mem_read(1, self.SH3001_FIFO_CONF2)
+        regData[0] = (regData[0] & 0xCF) | ((fifoChannel >> 8) & 0x30)
+        self.mem_write(regData, self.SH3001_FIFO_CONF2)
+        self.mem_write(fifoChannel & 0xFF, self.SH3001_FIFO_CONF3)
+
+    def fifo_init(self, fifoMode=SH3001_FIFO_MODE_STREAM, waterMarkLevel=SH3001_FIFO_MAX_ENTRIES//2):
+        """
+        Buffer acc and gyro samples in the chip FIFO at the full ODR,
+        read them later in bursts with fifo_read
+        """
+        self.sh3001_fifo_reset(self.SH3001_FIFO_MODE_DIS)
+        self.sh3001_fifo_freq_config(self.SH3001_FIFO_ACC_DOWNS_DIS, self.SH3001_FIFO_FREQ_X1_2,
+                                     self.SH3001_FIFO_GYRO_DOWNS_DIS, self.SH3001_FIFO_FREQ_X1_2)
+        self.sh3001_fifo_watermark_config(waterMarkLevel)
+        self.sh3001_fifo_channel_config(self.SH3001_FIFO_IMU_EN)
+        self.sh3001_fifo_reset(fifoMode)
+        self.fifo_transactions = 0
+        self.fifo_samples = 0
+
+    def fifo_count(self):
+        """
+        Number of 16 bit entries in the FIFO
+        """
+        regData = self.mem_read(2, self.SH3001_FIFO_STA0)
+        self.fifo_transactions += 1
+        return ((regData[1] & 0x07) << 8) | regData[0]
+
+    def _burst_read(self, reg, length):
+        # one combined write + read transaction, not limited to the 32 bytes of a smbus block read
+        # bus errors are raised, a retry would read a partly drained fifo out of alignment
+        bus = getattr(self, '_smbus', None)
+        try:
+            from smbus2 import i2c_msg
+            rdwr = bus.i2c_rdwr
+        except (ImportError, AttributeError):
+            rdwr = None
+        if rdwr is None:
+            # fallback: block reads of whole samples
+            chunk = 2 * self.SH3001_FIFO_SAMPLE_BYTES
+            data = bytearray()
+            for start in range(0, length, chunk):
+                data += bytes(self.mem_read(min(chunk, length - start), reg))
+                self.fifo_transactions += 1
+            return bytes(data)
+        write = i2c_msg.write(self.address, [reg])
+        read = i2c_msg.read(self.address, length)
+        rdwr(write, read)
+        self.fifo_transactions += 1
+        return bytes(read)
+
+    def fifo_read(self, max_samples=None):
+        """
+        Drain the FIFO in one burst
+
+        :param max_samples: max number of samples to read, None for all
+        :return: N*6 int16 array, columns ax, ay, az, gx, gy, gz, oldest sample first
+        :rtype: numpy.ndarray
+        """
+        samples = self.fifo_count() // self.SH3001_FIFO_SAMPLE_ENTRIES
+        if max_samples is not None:
+            samples = min(samples, max_samples)
+        if samples == 0:
+            return np.empty((0, 6), dtype=np.int16)
+        data = self._burst_read(self.SH3001_FIFO_DATA, samples * self.SH3001_FIFO_SAMPLE_BYTES)
+        self.fifo_samples += samples
+        return decode_imu_block(data)
+
+    # endregion: FIFO
+
     # return accData,gyroData
     def _sh3001_getimudata(self):
         try:
-            gyroData = [0, 0, 0]
-            accData = [0, 0, 0]
-            # regData = [0 for i in range(12)]
             regData = self.mem_read(12, self.SH3001_ACC_XL)
-
-            accData[0] = bytes_toint(regData[1], regData[0])
-            accData[1] = bytes_toint(regData[3], regData[2])
-            accData[2] = bytes_toint(regData[5], regData[4])
-            # accData = [(accData[i] - self.acc_cal[i]) for i in range(len(accData))]
-
-            gyroData[0] = bytes_toint(regData[7], regData[6])
-            gyroData[1] = bytes_toint(regData[9], regData[8])
-            gyroData[2] = bytes_toint(regData[11], regData[10])
-            # gyroData = [gyroData[i] - self.gyro_offset[i] for i in range(len(gyroData))]
-
-            return accData, gyroData
+            ax, ay, az, gx, gy, gz = IMU_STRUCT.unpack(bytearray(regData))
+            return [ax, ay, az], [gx, gy, gz]
         except Exception as e:
             # print("_sh3001_getimudata error: ", e)
             return False
 
-    def sh3001_getimudata(self, aram, axis):
-        accData, gyroData = self._sh3001_getimudata()
-        accData = [(accData[i] - self.acc_offset[i])
-                   for i in range(len(accData))]
-        gyroData = [
-            gyroData[i] - self.gyro_offset[i] for i in range(len(gyroData))
-        ]
-        # print()
-
-        if aram == 'acc':
-            if axis == 'x':
-                return accData[0]
-            elif axis == 'y':
-                return accData[1]
-            elif axis == 'z':
-                return accData[2]
-            elif axis == 'xy':
-                return [accData[0], accData[1]]
-            elif axis == 'xz':
-                return [accData[0], accData[2]]
-            elif axis == 'yz':
-                return [accData[1], accData[2]]
-            elif axis == 'xyz':
-                return [accData[0], accData[1], accData[2]]
-            # else:
-            #     raise ValueError('axis must be x,y,z,xy,xz,xyz')
+    def offset_vector(self):
+        return np.array(list(self.acc_offset) + list(self.gyro_offset), dtype=np.float64)
+
+    def read(self, scale=None):
+        """
+        Read one sample, offsets applied
+
+        :param scale: None for LSB, or 6 factors multiplied in, eg: IMU_SCALE for g and dps
+        :return: ImuData
+        """
+        return ImuData._make(self._read_values(scale))
+
+    def _read_values(self, scale=None):
+        regData = self.mem_read(12, self.SH3001_ACC_XL)
+        ax, ay, az, gx, gy, gz = IMU_STRUCT.unpack(bytearray(regData))
+        acc, gyro = self.acc_offset, self.gyro_offset
+        data = [ax - acc[0], ay - acc[1], az - acc[2], gx - gyro[0], gy - gyro[1], gz - gyro[2]]
+        if scale is not None:
+            data = [v * k for v, k in zip(data, scale)]
+        return data
+
+    def apply_offsets(self, block, scale=None):
+        """
+        Offsets (and scale) for a block of samples, eg: from fifo_read
+
+        :param block: N*6 array
+        :return: N*6 float array
+        """
+        data = block - self.offset_vector()
+        if scale is not None:
+            data *= np.asarray(scale)
+        return data
 
+    def sh3001_getimudata(self, aram, axis):
+        data = self._read_values()
+        if aram == 'all':
+            return list(data[:3]), list(data[3:])
+        elif aram == 'acc':
+            base = 0
         elif aram == 'gyro':
-            if axis == 'x':
-                return gyroData[0]
-            elif axis == 'y':
-                return gyroData[1]
-            elif axis == 'z':
-                return gyroData[2]
-            elif axis == 'xy':
-                return [gyroData[0], gyroData[1]]
-            elif axis == 'xz':
-                return [gyroData[0], gyroData[2]]
-            elif axis == 'yz':
-                return [gyroData[1], gyroData[2]]
-            elif axis == 'xyz':
-                return [gyroData[0], gyroData[1], gyroData[2]]
-            # else:
-            #     raise ValueError('axis must be x,y,z,xy,xz,xyz')
-
-        elif aram == 'all':
-            return accData, gyroData
-
+            base = 3
         else:
             raise ValueError('aram must be acc ,gyro or all')
 
+        index = AXIS_INDEX.get(axis)
+        if index is None:
+            return None
+        if isinstance(index, int):
+            return data[base + index]
+        return [data[base + i] for i in index]
+
     def sh3001_gettempdata(self):
         tempref = [0, 0]
         regData = self.mem_read(2, self.SH3001_TEMP_CONF0)
@@ -633,14 +741,12 @@ class Sh3001(I2C):
         self.db.set('calibrate_max_list', str(self.acc_max))
         self.db.set('calibrate_min_list', str(self.acc_min))
 
-    def acc_calibrate_cmd(self):
-        try:
-            print(
-                'Calibration start!\nRotate the device for 720 degree in all 3 axis\nPress [Ctrl] + [C] if finish'
-            )
-            while True:
-                self.calibrate('acc')
-        except KeyboardInterrupt:
-            print("")
-            self.set_offset(self.acc_offset)
-            print('offset: ', self.acc_offset)
+    def acc_calibrate_cmd(self, rotate_seconds=30):
+        '''
+        Ellipsoid calibration, stored in the config file and reused by Pidog at startup
+        '''
+        print('Calibration start!')
+        calibration = imu_calibrate(self, rotate_seconds=rotate_seconds)
+        self.acc_offset = calibration.center.tolist()
+        self.set_offset(self.acc_offset)
+        print('offset: ', self.acc_offset)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import os
+import re
+import glob
+import json
+import threading
+import hashlib
+import wave
+from collections import namedtuple
+
+''' SoundCatalog: index of the sound files, and a decoded cache on disk
+
+    The sound folder is scanned once, every file is indexed by its name
+    without extension, plus aliases: the name without a trailing number
+    and without the 'single_' prefix points to the first of its variants
+    (single_bark_1 -> bark), ALIASES adds more. Lookups are dict hits.
+
+    Every asset is identified by the sha1 of its content. Decoded PCM of
+    the catalog assets is stored as <hash>_<frequency>_<channels>.wav in
+    the cache folder, a later process loads it without decoding the mp3
+    again. Files outside the catalog (eg: a tts answer, rewritten for every
+    answer) are never stored, and scan() deletes the decoded files of
+    assets no longer in the folder, so the cache never outgrows the
+    catalog. The hashes are kept in index.json by path, size and mtime,
+    files are only hashed again when they change.
+'''
+
+# name, file path, sha1 of the content, bytes
+SoundAsset = namedtuple('SoundAsset', ['name', 'path', 'hash', 'size'])
+
+
+class SoundCatalog():
+
+    EXTENSIONS = ['.mp3', '.wav']
+    # alias: name
+    ALIASES = {
+        'bark': 'single_bark_1',
+        'howl': 'howling',
+    }
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, sound_dir, cache_dir=None):
+        """
+        :param sound_dir: folder of the sound files
+        :param cache_dir: folder of the decoded cache, None for no disk cache
+        """
+        self.sound_dir = sound_dir
+        self.cache_dir = cache_dir
+        self.assets = {}  # name: SoundAsset
+        self.aliases = {}  # alias: name
+        self.paths = {}  # path: SoundAsset
+        self.hashes = {}  # path: [size, mtime, hash]
+        self.load_index()
+        self.scan()
+
+    # index
+    # =================================================================
+    def load_index(self):
+        if self.cache_dir is None:
+            return
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE)) as f:
+                self.hashes = json.load(f)
+        except (OSError, ValueError):
+            self.hashes = {}
+
+    def save_index(self):
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp = os.path.join(self.cache_dir, self.INDEX_FILE + '.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.hashes, f)
+            os.replace(tmp, os.path.join(self.cache_dir, self.INDEX_FILE))
+        except OSError:
+            pass
+
+    def _hash(self, path, stat):
+        known = self.hashes.get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return known[2]
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                sha1.update(block)
+        digest = sha1.hexdigest()
+        self.hashes[path] = [stat.st_size, stat.st_mtime, digest]
+        return digest
+
+    def _asset(self, name, path):
+        stat = os.stat(path)
+        return SoundAsset(name, path, self._hash(path, stat), stat.st_size)
+
+    def scan(self):
+        """
+        Index every sound file of sound_dir, once at start, or again after files were added
+        """
+        assets = {}
+        try:
+            files = sorted(os.listdir(self.sound_dir))
+        except OSError:
+            files = []
+        for file in files:
+            name, ext = os.path.splitext(file)
+            if ext not in self.EXTENSIONS or name in assets:
+                continue
+            assets[name] = self._asset(name, os.path.join(self.sound_dir, file))
+
+        aliases = {}
+        for name in assets:
+            alias = re.sub(r'_\d+$', '', name)
+            alias = re.sub(r'^single_', '', alias)
+            if alias != name and alias not in assets:
+                aliases.setdefault(alias, name)
+        for alias, name in self.ALIASES.items():
+            if name in assets and alias not in assets:
+                aliases[alias] = name
+
+        self.assets = assets
+        self.aliases = aliases
+        self.paths = {asset.path: asset for asset in assets.values()}
+        self.hashes = {path: self.hashes[path] for path in self.paths}
+        self.save_index()
+        self.prune()
+
+    def prune(self):
+        """
+        Delete the decoded files of assets which are not in the catalog any more
+        """
+        if self.cache_dir is None:
+            return
+        hashes = set(asset.hash for asset in self.assets.values())
+        for path in glob.glob(os.path.join(self.cache_dir, '*_*_*.wav')):
+            if os.path.basename(path).split('_')[0] not in hashes:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    # lookup
+    # =================================================================
+    def names(self):
+        return list(self.assets)
+
+    def cataloged(self, asset):
+        """
+        True if the asset is a file of the sound folder, as it was scanned
+        """
+        return self.paths.get(asset.path) == asset
+
+    def find(self, name):
+        """
+        :param name: sound name, alias, or file path
+        :return: SoundAsset, None if not found
+        """
+        asset = self.assets.get(name)
+        if asset is not None:
+            return asset
+        alias = self.aliases.get(name)
+        if alias is not None:
+            return self.assets[alias]
+        asset = self.paths.get(name)
+        if asset is not None:
+            return asset
+        if not os.path.isfile(name):
+            return None
+        # a file outside the catalog, eg: a tts answer, hashed again only if it changed
+        return self._asset(os.path.splitext(os.path.basename(name))[0], name)
+
+    # decoded cache
+    # =================================================================
+    def decoded_path(self, asset, frequency, channels):
+        """
+        :return: path of the decoded wav, None if not cached
+        """
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, f'{asset.hash}_{frequency}_{channels}.wav')
+        return path if os.path.isfile(path) else None
+
+    def store_decoded(self, asset, pcm, frequency, channels):
+        """
+        Store decoded 16 bit PCM of a catalog asset
+
+        :param pcm: bytes, interleaved int16 samples
+        :return: path of the wav, None if not a catalog asset or it could not be written
+        """
+        if self.cache_dir is None or not self.cataloged(asset):
+            return None
+        path = os.path.join(self.cache_dir, f'{asset.hash}_{frequency}_{channels}.wav')
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with wave.open(tmp, 'wb') as f:
+                f.setnchannels(channels)
+                f.setsampwidth(2)
+                f.setframerate(frequency)
+                f.writeframes(pcm)
+            os.replace(tmp, path)
+        except OSError:
+            return None
+        return path
@@ -30,20 +30,43 @@
 '''
 
 import spidev
-from gpiozero import OutputDevice, InputDevice
+import threading
+from collections import deque, namedtuple
+from math import exp, log
+from time import perf_counter
+from gpiozero import OutputDevice, InputDevice, DigitalInputDevice
+
+# timestamp: falling edge of busy, perf_counter second
+# latency: edge to direction available, the spi transfer time
+SoundEvent = namedtuple('SoundEvent', ['timestamp', 'direction', 'latency'])
 
 
 class SoundDirection():
     CS_DELAY_US = 500  # Mhz
     CLOCK_SPEED = 10000000  # 10 MHz
 
-    def __init__(self, busy_pin=6):
+    QUEUE_SIZE = 32  # events, the oldest are dropped when full
+    HISTOGRAM_BIN = 20  # degree, resolution of the module
+    HISTOGRAM_HALF_LIFE = 2.0  # second
+
+    def __init__(self, busy_pin=6, publish=None):
+        '''
+        :param publish: callback(name, value, timestamp), eg: SensorHub.publish, called with every direction read
+        '''
+        self.publish = publish
         self.spi = spidev.SpiDev()
         self.spi.open(0, 0)
         #
-        self.busy = InputDevice(busy_pin, pull_up=False)
+        self.busy = DigitalInputDevice(busy_pin, pull_up=False)
 
-    def read(self):
+        self.event_mode = False
+        self.events = deque(maxlen=self.QUEUE_SIZE)
+        self.events_condition = threading.Condition()
+        self.dropped_events = 0
+        self.histogram_bins = [0.0] * (360 // self.HISTOGRAM_BIN)
+        self.histogram_time = perf_counter()
+
+    def _read_spi(self, timestamp=None):
         result = self.spi.xfer2([0, 0, 0, 0, 0, 0], self.CLOCK_SPEED,
                                 self.CS_DELAY_US)
 
@@ -55,16 +78,132 @@ class SoundDirection():
         else:
             val = (h_val << 8) + l_val
             val = (360 + 160 - val) % 360  # Convert zero
+            if self.publish is not None:
+                self.publish('sound', val, timestamp)
             return val
 
+    def read(self):
+        """
+        Direction of the last sound, degree, -1 if none
+
+        In event mode the newest queued event is returned instead of reading
+        the module, the event callback already read it. The older events are
+        dropped, a poller reacts to the last sound only, use get_event() or
+        get_events() to see every one.
+        """
+        if self.event_mode:
+            event = self.latest_event()
+            return -1 if event is None else event.direction
+        return self._read_spi()
+
     def isdetected(self):
+        if self.event_mode:
+            return len(self.events) > 0
         return self.busy.value == 0
 
+    # event mode
+    # =================================================================
+    def start_events(self):
+        """
+        Read the direction on the falling edge of busy, instead of polling isdetected()
+        """
+        self.event_mode = True
+        self.busy.when_deactivated = self._on_detected
+        # a sound detected before the callback was set
+        if self.busy.value == 0:
+            self._on_detected()
+
+    def stop_events(self):
+        try:
+            self.busy.when_deactivated = None
+        except Exception:
+            pass
+        self.event_mode = False
+        self.clear_events()
+
+    def _on_detected(self):
+        timestamp = perf_counter()
+        direction = self._read_spi(timestamp)
+        if direction < 0:
+            return
+        event = SoundEvent(timestamp, direction, perf_counter() - timestamp)
+        with self.events_condition:
+            if len(self.events) == self.events.maxlen:
+                self.dropped_events += 1
+            self.events.append(event)
+            self._histogram_add(direction, timestamp)
+            self.events_condition.notify_all()
+
+    def get_event(self, timeout=0):
+        """
+        Oldest queued event
+
+        :param timeout: second to wait for one, 0 to return at once, None to wait forever
+        :return: SoundEvent or None
+        """
+        with self.events_condition:
+            if timeout != 0 and not self.events:
+                self.events_condition.wait_for(lambda: len(self.events) > 0, timeout)
+            return self.events.popleft() if self.events else None
+
+    def latest_event(self):
+        """
+        Newest queued event, the older ones are dropped
+
+        :return: SoundEvent or None
+        """
+        with self.events_condition:
+            event = self.events[-1] if self.events else None
+            self.events.clear()
+        return event
+
+    def get_events(self):
+        """
+        All queued events, oldest first
+        """
+        with self.events_condition:
+            events = list(self.events)
+            self.events.clear()
+        return events
+
+    def clear_events(self):
+        with self.events_condition:
+            self.events.clear()
+
+    # histogram of recent directions
+    # =================================================================
+    def _decay(self, now):
+        factor = exp(-log(2) * (now - self.histogram_time) / self.HISTOGRAM_HALF_LIFE)
+        self.histogram_bins = [v * factor for v in self.histogram_bins]
+        self.histogram_time = now
+
+    def _histogram_add(self, direction, timestamp):
+        self._decay(timestamp)
+        index = int(direction // self.HISTOGRAM_BIN) % len(self.histogram_bins)
+        self.histogram_bins[index] += 1
+
+    def histogram(self):
+        """
+        Decayed count of recent events per direction bin
+
+        :return: list of (bin center in degree, weight)
+        """
+        with self.events_condition:
+            self._decay(perf_counter())
+            bins = list(self.histogram_bins)
+        return [(i * self.HISTOGRAM_BIN + self.HISTOGRAM_BIN / 2, w) for i, w in enumerate(bins)]
+
+    def dominant_direction(self, min_weight=0.5):
+        """
+        Direction heard most in the last seconds, None if too little was heard
+        """
+        direction, weight = max(self.histogram(), key=lambda bin: bin[1])
+        return direction if weight >= min_weight else None
+
 
 if __name__ == '__main__':
-    from time import sleep
     sd = SoundDirection()
+    sd.start_events()
     while True:
-        if sd.isdetected():
-            print(f"Sound detected at {sd.read()} degrees")
-        sleep(0.2)
\ No newline at end of file
+        event = sd.get_event(timeout=None)
+        print(f"Sound detected at {event.direction} degrees, latency {event.latency*1000:.2f} ms")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+from time import perf_counter, sleep
+
+
+class DeadlineTimer():
+    """
+    Fixed period timer driven by absolute deadlines on perf_counter,
+    the period does not drift with the time spent between two waits.
+
+    A deadline is missed when wait() is called after it. With catch_up,
+    the following waits return at once until the schedule is met again,
+    like clock_nanosleep(TIMER_ABSTIME); without it the schedule restarts
+    from now and the lost periods are skipped.
+    """
+
+    SPIN_TIME = 0.0005  # second, busy wait the last part of a period for accuracy, servo streams only
+
+    def __init__(self, period, catch_up=False, spin=0):
+        """
+        :param period: period in second
+        :type period: float
+        :param catch_up: keep the original schedule after a miss
+        :type catch_up: bool
+        :param spin: time to busy wait before each deadline, 0 to only sleep,
+                     the spin holds the GIL, eg: SPIN_TIME for a servo stream
+        :type spin: float
+        """
+        self.period = period
+        self.catch_up = catch_up
+        self.spin = spin
+        self.reset()
+
+    def reset(self):
+        self.deadline = None
+        self.ticks = 0
+        self.missed = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    def restart(self):
+        """
+        Start a new schedule from the next wait(), the stats are kept
+        """
+        self.deadline = None
+
+    def set_period(self, period):
+        if period != self.period:
+            if self.deadline is not None:
+                self.deadline += period - self.period
+            self.period = period
+
+    def wait(self):
+        """
+        Block until the next deadline
+
+        :return: lateness of this tick in second, how long after the deadline it returned
+        :rtype: float
+        """
+        now = perf_counter()
+        if self.deadline is None:
+            self.deadline = now
+        self.deadline += self.period
+        self.ticks += 1
+
+        lateness = now - self.deadline
+        if lateness > 0:
+            missed = int(lateness // self.period) + 1
+            self.missed += missed
+            self.total_lateness += lateness
+            self.max_lateness = max(self.max_lateness, lateness)
+            if not self.catch_up:
+                self.deadline = now
+            return lateness
+
+        remaining = -lateness - self.spin
+        if remaining > 0:
+            sleep(remaining)
+        if self.spin > 0:
+            while perf_counter() < self.deadline:
+                pass
+        # overshoot of the sleep, when the spin was too short or the thread was preempted
+        lateness = perf_counter() - self.deadline
+        self.total_lateness += lateness
+        self.max_lateness = max(self.max_lateness, lateness)
+        return lateness
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'missed': self.missed,
+            'max_lateness': self.max_lateness,
+            'mean_lateness': self.total_lateness / self.ticks if self.ticks else 0.0,
+        }
+
+
+class ServoStream():
+    """
+    Write servo frames directly at a fixed period, bypassing the action buffers
+    """
+
+    def __init__(self, robot, period, catch_up=False, motion_process=None, part=None, spin=0):
+        """
+        :param robot: robot_hat Robot, eg: my_dog.legs
+        :param period: period in second
+        :param catch_up: see DeadlineTimer
+        :param spin: see DeadlineTimer
+        :param motion_process: MotionProcess, frames are written by it instead, see MotionProcess.write
+        :param part: part of the robot in the motion process, eg: 'legs'
+        """
+        self.robot = robot
+        self.timer = DeadlineTimer(period, catch_up=catch_up, spin=spin)
+        self.motion_process = motion_process
+        self.part = part
+
+    def write(self, angles):
+        """
+        Write one frame, then wait for the next deadline
+
+        :param angles: angles list, without offsets
+        :return: lateness, see DeadlineTimer.wait
+        """
+        if self.motion_process is not None:
+            self.motion_process.write(self.part, angles)
+        else:
+            self.robot.servo_write_raw([angle + offset for angle, offset in zip(angles, self.robot.offset)])
+        return self.timer.wait()
+
+    def stats(self):
+        return self.timer.stats()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import numpy as np
+
+''' Trajectory: keyframes -> fixed rate frames
+
+    Every segment between two keyframes follows a normalized profile
+    s(t) in [0, 1], evaluated for all channels at once:
+
+        min_jerk  : s = 10t^3 - 15t^4 + 6t^5, peak velocity 1.875 * delta / T
+        trapezoid : constant acceleration, cruise, constant deceleration,
+                    peak velocity delta / (T * (1 - accel))
+
+    Frames are emitted at FRAME_RATE, which is one robot_hat servo_move
+    step (10 ms), so a frame enqueued with speed=100 is written in a
+    single step and the planned duration is the real duration.
+'''
+
+FRAME_RATE = 100  # Hz
+PROFILES = ['min_jerk', 'trapezoid']
+TRAPEZOID_ACCEL = 0.25  # fraction of the segment spent accelerating (and decelerating)
+
+
+def min_jerk(t):
+    return t*t*t*(10 + t*(-15 + 6*t))
+
+
+def trapezoid(t, accel=TRAPEZOID_ACCEL):
+    v = 1 / (1 - accel)
+    return np.where(t < accel, 0.5*v*t*t/accel,
+                    np.where(t > 1 - accel, 1 - 0.5*v*(1 - t)**2/accel,
+                             v*(t - accel/2)))
+
+
+def peak_velocity(profile):
+    """
+    Peak velocity of a profile, relative to the average velocity
+    """
+    if profile == 'min_jerk':
+        return 1.875
+    elif profile == 'trapezoid':
+        return 1 / (1 - TRAPEZOID_ACCEL)
+    raise ValueError(f"Invalid profile: {profile}")
+
+
+def segment_durations(points, duration=None, max_dps=None, profile='min_jerk'):
+    """
+    Duration of every segment, in second
+
+    :param points: (k+1)*n array, start pose and keyframes
+    :param duration: desired total duration, None for as fast as max_dps allows
+    :param max_dps: max degrees per second, scalar or per channel list
+    :param profile: 'min_jerk' or 'trapezoid'
+    :return: k durations
+    """
+    deltas = np.abs(np.diff(points, axis=0))
+    if max_dps is None:
+        fastest = np.zeros(len(deltas))
+    else:
+        fastest = (deltas / np.asarray(max_dps, dtype=np.float64)).max(axis=1, initial=0) * peak_velocity(profile)
+    if duration is None:
+        return fastest
+    # share the desired duration in proportion to the distance of each segment,
+    # no segment is planned faster than the servos can follow
+    distance = deltas.max(axis=1, initial=0)
+    if distance.sum() > 0:
+        shared = duration * distance / distance.sum()
+    else:
+        shared = np.full(len(deltas), duration / max(1, len(deltas)))
+    return np.maximum(shared, fastest)
+
+
+def plan(start, keyframes, duration=None, max_dps=None, profile='min_jerk', rate=FRAME_RATE):
+    """
+    Plan frames from the start pose through all keyframes
+
+    :param start: start pose, n channels
+    :param keyframes: k*n keyframes
+    :param duration: desired total duration in second, None for as fast as max_dps allows
+    :param max_dps: max degrees per second, scalar or per channel list
+    :param profile: 'min_jerk' or 'trapezoid'
+    :param rate: frame rate, Hz
+    :return: m*n float array, one frame every 1/rate second, the last frame is the last keyframe
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Invalid profile: {profile}")
+    points = np.vstack((np.asarray(start, dtype=np.float64).reshape(1, -1),
+                        np.asarray(keyframes, dtype=np.float64).reshape(len(keyframes), -1)))
+    durations = segment_durations(points, duration, max_dps, profile)
+    counts = np.maximum(1, np.ceil(durations * rate - 1e-9)).astype(np.intp)
+
+    # normalized time of every frame in its segment, all segments at once
+    segment = np.repeat(np.arange(len(counts)), counts)
+    step = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    t = step / counts[segment]
+    if profile == 'min_jerk':
+        s = min_jerk(t)
+    else:
+        s = trapezoid(t)
+
+    deltas = np.diff(points, axis=0)
+    return points[segment] + deltas[segment] * s[:, np.newaxis]
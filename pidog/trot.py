@@ -149,20 +149,21 @@ def test():
     backward_right = Trot(fb=Trot.BACKWARD, lr=Trot.RIGHT)
     leg_coords = forward.get_coords()
 
-    # try:
-    while True:
-        for leg_coord in leg_coords:
-            # print(leg_coord)
-            # dog.set_rpy(**rpy)
-            # dog.set_pose(**pos)
-            # dog.set_rpy(0, 0, 0, True)
-            dog.set_legs(leg_coord)
-            angles = dog.pose2legs_angle()
-            dog.legs_simple_move(angles)
-            # pause()
-            delay(0.001)
-
-    # finally:
+    stream = dog.legs_stream(period=0.01)
+
+    try:
+        while True:
+            for leg_coord in leg_coords:
+                # print(leg_coord)
+                # dog.set_rpy(**rpy)
+                # dog.set_pose(**pos)
+                # dog.set_rpy(0, 0, 0, True)
+                dog.set_legs(leg_coord)
+                angles = dog.pose2legs_angle()
+                stream.write(angles)
+                # pause()
+    finally:
+        print(f"stream stats: {stream.stats()}")
     #     dog.close()
 
 
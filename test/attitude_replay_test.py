@@ -0,0 +1,127 @@
+from pidog.attitude import AttitudeEstimator, accel_angles, ACC_1G, GYRO_SENSITIVITY
+import numpy as np
+import sys
+import time
+
+'''
+Replay imu samples through AttitudeEstimator and check accuracy.
+
+    python3 attitude_replay_test.py              # synthetic walking data, known truth
+    python3 attitude_replay_test.py record.csv   # replay a recording
+    python3 attitude_replay_test.py --record record.csv [seconds]   # record on the robot
+
+A recording is a csv of: time, ax, ay, az, gx, gy, gz (raw LSB, offsets not applied).
+The first second must be at rest, it is used for the offsets. Recordings have no
+truth, the reference is the zero-phase smoothed accelerometer attitude.
+'''
+
+ODR = 500
+MAX_RMS_ERROR = 2.0  # degree, fused attitude vs truth on synthetic data
+
+
+def record(path, seconds=20):
+    from pidog.sh3001 import Sh3001
+    imu = Sh3001()
+    rows = []
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        data = imu._sh3001_getimudata()
+        if data == False:
+            continue
+        acc, gyro = data
+        rows.append([time.perf_counter() - start] + list(acc) + list(gyro))
+    np.savetxt(path, rows, delimiter=',', fmt='%.6f')
+    print(f"{len(rows)} samples saved to {path}")
+
+
+def rotation(axis, angles):
+    """
+    Rotation matrices about a frame axis, angles in degree, n*3*3
+    """
+    c, s = np.cos(np.radians(angles)), np.sin(np.radians(angles))
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    r = np.zeros((len(angles), 3, 3))
+    r[:, axis, axis] = 1
+    r[:, i, i], r[:, i, j] = c, -s
+    r[:, j, i], r[:, j, j] = s, c
+    return r
+
+
+def synthetic(seconds=20, seed=0):
+    """
+    Imu samples of a known body rotation R(t), sensor to world, built
+    without the axis and sign conventions of AttitudeEstimator: the
+    accelerometer is the specific force R^T (g + a) and the gyro the body
+    rate from R^T dR/dt. The world frame is the sensor frame at rest, the
+    accelerometer reads -1 G on x when still. The truth is the attitude
+    of gravity alone in the sensor frame.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(0, seconds, 1/ODR)
+    yaw = 20*np.sin(2*np.pi*0.1*t)
+    tilt_y = 15*np.sin(2*np.pi*0.3*t)
+    tilt_z = 8*np.sin(2*np.pi*0.17*t + 1)
+    r = rotation(0, yaw) @ rotation(1, tilt_y) @ rotation(2, tilt_z)
+    rt = np.transpose(r, (0, 2, 1))
+
+    gravity = np.array([-ACC_1G, 0, 0])
+    truth = np.array([accel_angles(*g) for g in rt @ gravity])
+    # gait: 2 Hz vertical bounce and 1 Hz sway in the world frame, plus broadband vibration
+    motion = np.zeros((len(t), 3))
+    motion[:, 0] = 0.25*ACC_1G*np.sin(2*np.pi*2*t)
+    motion[:, 1] = 0.08*ACC_1G*np.sin(2*np.pi*1*t)
+    acc = np.einsum('nij,nj->ni', rt, gravity + motion) + rng.normal(0, 0.08*ACC_1G, (len(t), 3))
+
+    # body rate, skew-symmetric R^T dR/dt
+    w = rt @ np.gradient(r, t, axis=0)
+    rates = np.degrees(np.stack((w[:, 2, 1], w[:, 0, 2], w[:, 1, 0]), axis=1))
+    gyro = rates*GYRO_SENSITIVITY
+    gyro += rng.normal(0, 0.5*GYRO_SENSITIVITY, gyro.shape) + 0.3*GYRO_SENSITIVITY
+    return t, acc, gyro, truth
+
+
+def load(path):
+    data = np.loadtxt(path, delimiter=',')
+    t, acc, gyro = data[:, 0], data[:, 1:4], data[:, 4:7]
+    rest = t < 1
+    acc_offset = np.array([-ACC_1G, 0, 0]) - acc[rest].mean(axis=0)
+    gyro_offset = -gyro[rest].mean(axis=0)
+    acc = acc + acc_offset
+    gyro = gyro + gyro_offset
+    # zero-phase 0.5 s moving average of the accelerometer attitude
+    raw = np.array([accel_angles(*a) for a in acc])
+    window = max(1, int(0.5 / np.median(np.diff(t))))
+    kernel = np.ones(window) / window
+    reference = np.stack([np.convolve(raw[:, i], kernel, mode='same') for i in range(2)], axis=1)
+    return t, acc, gyro, reference
+
+
+def replay(t, acc, gyro, reference, divider=1):
+    estimator = AttitudeEstimator()
+    index = np.arange(0, len(t), divider)
+    fused = np.array([estimator.update(acc[i], gyro[i], t[i]) for i in index])
+    raw = np.array([accel_angles(*acc[i]) for i in index])
+    settled = t[index] > 2  # skip the start-up transient
+    rms_fused = np.sqrt(((fused - reference[index])[settled]**2).mean(axis=0))
+    rms_raw = np.sqrt(((raw - reference[index])[settled]**2).mean(axis=0))
+    rate = ODR / divider
+    print(f"{rate:5.0f} Hz  accel only rms (pitch, roll): {rms_raw[0]:6.2f} {rms_raw[1]:6.2f} deg   "
+          f"fused rms: {rms_fused[0]:6.2f} {rms_fused[1]:6.2f} deg   "
+          f"update: {estimator.mean_update_time()*1e6:5.1f} us, cpu {estimator.mean_update_time()*rate*100:4.2f} %")
+    return rms_fused
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--record':
+        record(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 20)
+        sys.exit(0)
+    if len(sys.argv) > 1:
+        data = load(sys.argv[1])
+        for divider in [1, 5]:
+            replay(*data, divider=divider)
+    else:
+        data = synthetic()
+        for divider in [1, 5]:
+            rms = replay(*data, divider=divider)
+            assert (rms < MAX_RMS_ERROR).all(), f"fused rms error too large: {rms}"
+        print("pass")
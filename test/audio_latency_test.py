@@ -0,0 +1,48 @@
+from pidog.audio_engine import AudioEngine
+import os
+import time
+
+'''
+AudioEngine trigger to sound latency: first play (decode) vs cached plays,
+then barks over a long clip, as one-shots and mixed, and the underruns of the mixer.
+
+Run with sudo, from the pidog folder.
+'''
+
+SOUND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../sounds/')
+REPEAT = 5
+
+audio = AudioEngine(SOUND_DIR)
+start = time.perf_counter()
+audio.open()
+print(f'open: {(time.perf_counter() - start)*1000:.1f} ms')
+
+for name in ['single_bark_1', 'single_bark_2', 'growl_1']:
+    for i in range(REPEAT):
+        audio.play(name, volume=60)
+        time.sleep(0.05)  # the latency is known once the first chunk is mixed
+        stats = audio.stats()
+        print(f"{name:<14} play {i}: {stats['latency_last']*1000:6.1f} ms")
+        time.sleep(0.6)
+
+howling = audio.play('howling', volume=60)
+time.sleep(0.5)
+for one_shot in [True, False]:
+    for i in range(REPEAT):
+        audio.play('bark', volume=100, priority=1, one_shot=one_shot)
+        time.sleep(0.05)
+        print(f"bark over howling, {'one-shot' if one_shot else 'mixed':<8} {i}: "
+              f"{audio.stats()['latency_last']*1000:6.1f} ms")
+        time.sleep(0.4)
+howling.cancel()
+print(f'howling played to the end: {howling.wait()}')
+
+stats = audio.stats()
+print(f"underruns: {stats['underruns']} in {stats['chunks_mixed']} chunks, "
+      f"latency mean {stats['latency_mean']*1000:.1f} ms, max {stats['latency_max']*1000:.1f} ms")
+
+start = time.perf_counter()
+audio.preload()
+print(f"preload: {(time.perf_counter() - start)*1000:.0f} ms, cache: {audio.stats()['cache_bytes']/1024/1024:.1f} MB")
+print(audio.stats())
+audio.close()
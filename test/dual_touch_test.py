@@ -1,8 +1,16 @@
 from pidog.dual_touch import DualTouch
 from time import sleep
+import sys
 
 touch = DualTouch('D2', 'D3')
 
+if len(sys.argv) > 1 and sys.argv[1] == '--events':
+    # gestures: tap, double tap, long press, slide
+    touch.subscribe(lambda event: print(f"{event.timestamp:.3f}  {event.gesture}"))
+    touch.start_events()
+    while True:
+        sleep(1)
+
 while True:
     print(
         f"\rLeft value: {touch.touch_L.value()} | Right value: {touch.touch_R.value()} | {touch.read()}", end="          ", flush=True)
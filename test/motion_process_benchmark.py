@@ -0,0 +1,66 @@
+from pidog.motion_process import MotionProcess
+from pidog.stream import DeadlineTimer
+import threading
+import time
+
+'''
+Servo cadence jitter, motion thread vs motion process,
+with and without heavy CPU load in the parent process.
+
+Servos are only simulated, no hardware is needed.
+'''
+
+PERIOD = 0.01
+DURATION = 3
+LOAD_THREADS = 4
+
+
+def busy_loop(stop):
+    x = 0
+    while not stop.is_set():
+        for i in range(10000):
+            x += i * i
+
+
+def thread_cadence(duration):
+    timer = DeadlineTimer(PERIOD, spin=DeadlineTimer.SPIN_TIME)
+    lateness = []
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        lateness.append(timer.wait())
+    stats = timer.stats()
+    mean = sum(lateness) / len(lateness)
+    stats['std_lateness'] = (sum([(l - mean)**2 for l in lateness]) / len(lateness)) ** 0.5
+    return stats
+
+
+def process_cadence(duration):
+    motion = MotionProcess({'legs': None, 'head': None, 'tail': None}, period=PERIOD)
+    motion.start()
+    time.sleep(duration)
+    stats = motion.stats()
+    motion.close()
+    return stats
+
+
+def run(name, func, load):
+    stop = threading.Event()
+    loads = [threading.Thread(target=busy_loop, args=(stop,), daemon=True) for _ in range(load)]
+    for t in loads:
+        t.start()
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(func(DURATION)))
+    worker.start()
+    worker.join()
+    stop.set()
+    for t in loads:
+        t.join()
+    print(f"{name:<8} load threads: {load}  ticks: {result['ticks']:5}  missed: {result['missed']:4}  "
+          f"mean: {result['mean_lateness']*1000:7.3f} ms  std: {result['std_lateness']*1000:7.3f} ms  "
+          f"max: {result['max_lateness']*1000:7.3f} ms")
+
+
+if __name__ == '__main__':
+    for load in [0, LOAD_THREADS]:
+        run('thread', thread_cadence, load)
+        run('process', process_cadence, load)
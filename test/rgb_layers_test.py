@@ -0,0 +1,39 @@
+from pidog.rgb_strip import RGBStrip
+from pidog.rgb_layers import BarLayer, FlashLayer, StyleLayer
+import time
+
+'''
+Layers over the rgb strip mode: a battery bar, an alert pulse on top of it,
+then flashes. Prints the worst tick time against the MIN_DELAY budget.
+'''
+
+strip = RGBStrip(0X74, 11)
+strip.set_mode('breath', 'white', bps=0.5, brightness=0.2)
+bar = strip.layers.add(BarLayer(0.0, 'green'))
+worst = 0
+
+
+def run(seconds):
+    global worst
+    start = time.time()
+    while time.time() - start < seconds:
+        strip.show()
+        worst = max(worst, strip.tick_time)
+
+
+try:
+    print('battery bar')
+    for i in range(11):
+        bar.level = i / 10
+        run(0.3)
+    print('alert pulse on top, 3 s')
+    strip.layers.add(StyleLayer('boom', 'red', bps=2, ttl=3), z=5)
+    run(3.5)
+    print('flashes')
+    for color in ['blue', 'yellow', 'magenta']:
+        strip.layers.add(FlashLayer(color, ttl=0.5), z=10)
+        run(0.8)
+    print(f'worst tick: {worst*1000:.1f} ms, budget {strip.MIN_DELAY*1000:.0f} ms')
+finally:
+    strip.layers.clear()
+    strip.close()
@@ -0,0 +1,42 @@
+from pidog.rgb_strip import RGBStrip
+import numpy as np
+import time
+
+'''
+RGBStrip frame table build time of every style,
+one calulate_data() call per light and frame vs one frame_table() broadcast.
+
+Needs the robot_hat and the rgb strip (SLED1735 at 0x74).
+'''
+
+RUNS = 5
+BPS = [2, 1, 0.35]
+
+
+def per_light(strip):
+    return np.array([[strip.calulate_data(frame_index, light_index)
+                      for light_index in range(strip.light_num)]
+                     for frame_index in range(strip.max_frames)], dtype=np.uint8)
+
+
+def best(func, strip):
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        result = func(strip)
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+if __name__ == '__main__':
+    strip = RGBStrip(0X74, 11)
+    print(f"{'style':<14} {'bps':>5} {'frames':>6} {'per light':>10} {'table':>9}  same")
+    for style in strip.STYLES:
+        for bps in BPS:
+            strip.set_mode(style, 'pink', bps)
+            strip.max_frames = int(1/strip.bps/strip.MIN_DELAY)
+            loop_time, loop_frames = best(per_light, strip)
+            table_time, table_frames = best(RGBStrip.frame_table, strip)
+            print(f"{style:<14} {bps:5} {strip.max_frames:6} {loop_time*1000:8.2f}ms "
+                  f"{table_time*1e6:7.0f}us  {np.array_equal(loop_frames, table_frames)}")
+    strip.close()
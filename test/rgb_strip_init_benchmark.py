@@ -0,0 +1,30 @@
+from pidog.rgb_strip import RGBStrip
+import time
+
+'''
+RGBStrip init cost: i2c transactions and wall time,
+one write per register vs block writes with the register shadow.
+
+Needs the robot_hat and the rgb strip (SLED1735 at 0x74).
+'''
+
+RUNS = 5
+
+
+def run(block_write):
+    RGBStrip.BLOCK_WRITE = block_write
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        strip = RGBStrip(0X74, 11)
+        times.append(time.perf_counter() - start)
+    stats = strip.i2c_stats()
+    print(f"block write: {str(block_write):<5}  transactions: {strip.init_transactions:5}  "
+          f"bytes: {stats['bytes']:5}  skipped: {stats['skipped']:4}  "
+          f"init: {min(times)*1000:7.1f} ms (best of {RUNS})")
+    strip.close()
+
+
+if __name__ == '__main__':
+    run(False)
+    run(True)
@@ -0,0 +1,86 @@
+from pidog.sh3001 import Sh3001, bytes_toint, decode_imu, decode_imu_block
+import timeit
+
+'''
+Per sample cost of decoding a sh3001 register block, old vs new path.
+
+No hardware is needed, mem_read returns a fixed 12 byte block.
+'''
+
+RUNS = 20000
+REG_DATA = [0x12, 0xC0, 0x34, 0x01, 0xF0, 0xFF, 0x05, 0x00, 0xFB, 0xFF, 0x10, 0x00]
+
+
+def legacy_decode(regData):
+    accData = [0, 0, 0]
+    gyroData = [0, 0, 0]
+    accData[0] = bytes_toint(regData[1], regData[0])
+    accData[1] = bytes_toint(regData[3], regData[2])
+    accData[2] = bytes_toint(regData[5], regData[4])
+    gyroData[0] = bytes_toint(regData[7], regData[6])
+    gyroData[1] = bytes_toint(regData[9], regData[8])
+    gyroData[2] = bytes_toint(regData[11], regData[10])
+    return accData, gyroData
+
+
+def legacy_getimudata(imu, aram, axis):
+    acc_offset, gyro_offset = imu.acc_offset, imu.gyro_offset
+    accData, gyroData = legacy_decode(imu.mem_read(12, 0))
+    accData = [(accData[i] - acc_offset[i]) for i in range(len(accData))]
+    gyroData = [gyroData[i] - gyro_offset[i] for i in range(len(gyroData))]
+    data = accData if aram == 'acc' else gyroData
+    if axis == 'x':
+        return data[0]
+    elif axis == 'y':
+        return data[1]
+    elif axis == 'z':
+        return data[2]
+    elif axis == 'xy':
+        return [data[0], data[1]]
+    elif axis == 'xz':
+        return [data[0], data[2]]
+    elif axis == 'yz':
+        return [data[1], data[2]]
+    elif axis == 'xyz':
+        return [data[0], data[1], data[2]]
+
+
+def fake_imu():
+    imu = Sh3001.__new__(Sh3001)
+    imu.acc_offset = [12.0, -30.0, 5.0]
+    imu.gyro_offset = [1.0, -2.0, 0.5]
+    imu.mem_read = lambda length, reg: REG_DATA[:length]
+    return imu
+
+
+def bench(func, number=RUNS):
+    # best of 5, the least disturbed run
+    return min(timeit.repeat(func, number=number, repeat=5))
+
+
+def report(name, seconds, samples=RUNS):
+    print(f"{name:<36} {seconds / samples * 1e6:7.2f} us/sample")
+
+
+if __name__ == '__main__':
+    imu = fake_imu()
+    acc, gyro = legacy_decode(REG_DATA)
+    assert tuple(acc + gyro) == tuple(decode_imu(REG_DATA))
+    assert tuple(acc + gyro) == tuple(decode_imu_block(REG_DATA)[0])
+    assert legacy_getimudata(imu, 'gyro', 'xyz') == imu.sh3001_getimudata('gyro', 'xyz')
+
+    report('decode: bytes_toint x6', bench(lambda: legacy_decode(REG_DATA)))
+    report('decode: struct.unpack', bench(lambda: decode_imu(REG_DATA)))
+    report('decode: np.frombuffer', bench(lambda: decode_imu_block(REG_DATA)))
+    report('_sh3001_getimudata: old', bench(lambda: legacy_decode(imu.mem_read(12, 0))))
+    report('_sh3001_getimudata: new', bench(imu._sh3001_getimudata))
+    report('getimudata xyz: old', bench(lambda: legacy_getimudata(imu, 'gyro', 'xyz')))
+    report('getimudata xyz: new', bench(lambda: imu.sh3001_getimudata('gyro', 'xyz')))
+    report('read (offsets)', bench(lambda: imu.read()))
+    report('read (offsets, scaled to g/dps)', bench(lambda: imu.read(Sh3001.IMU_SCALE)))
+
+    # numpy pays off on blocks, eg: a fifo burst
+    block = REG_DATA * 100
+    report('decode: np.frombuffer, 100 samples', bench(lambda: decode_imu_block(block), RUNS // 100))
+    report('decode + offsets/scale, 100 samples',
+           bench(lambda: imu.apply_offsets(decode_imu_block(block), Sh3001.IMU_SCALE), RUNS // 100))
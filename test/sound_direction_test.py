@@ -3,7 +3,9 @@ from time import sleep
 
 
 sd = SoundDirection()
+sd.start_events()
 while True:
-    if sd.isdetected():
-        print(f"Sound detected at {sd.read()} degrees")
-    sleep(0.2)
+    # wait for the busy edge instead of polling isdetected()
+    event = sd.get_event(timeout=None)
+    print(f"Sound detected at {event.direction} degrees, latency {event.latency*1000:.2f} ms, "
+          f"dominant: {sd.dominant_direction()}")